@@ -3,6 +3,7 @@ import config
 import filters
 import sthelp
 import setup
+import reports
 import reports_heatmap
 
 sthelp.chrome()
@@ -30,14 +31,7 @@ if config.has_tenant_url():
         """
     )
 
-if not config.get_materialization_complete():
-    st.info("Please wait for materialization to complete before running reports.")
-    st.button(
-        "Refresh Status",
-        on_click=config.refresh,
-        key="refresh-materialization-status",
-    )
-else:
+if reports.materialization_status():
     credit_cost = config.get_compute_credit_cost()
 
     st.markdown(
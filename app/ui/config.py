@@ -62,6 +62,57 @@ def get_materialization_complete():
     )
 
 
+def get_backfill_progress():
+    # Read on every call rather than cached with the config, the backfill advances in the background.
+    df = connection.execute_select(
+        """
+        select
+            count_if(status = 'DONE') as done,
+            count(*) as total,
+            min(iff(status = 'DONE', chunk_start, null)) as loaded_since
+        from internal.query_history_backfill
+        """
+    )
+    return int(df["DONE"][0]), int(df["TOTAL"][0]), df["LOADED_SINCE"][0]
+
+
+def get_label_store_enabled():
+    return Config.get("LABEL_STORE_ENABLED") == "true"
+
+
+def set_label_store_enabled(enabled: bool):
+    connection.execute(
+        "call internal.enable_label_store(%(enabled)s)", {"enabled": enabled}
+    )
+    refresh()
+
+
+def get_probe_monitor_schedule():
+    return (
+        Config.get("PROBE_MONITOR_ADAPTIVE") == "true",
+        int(dval(Config.get("PROBE_MONITOR_FAST_SECONDS"), 15)),
+        int(dval(Config.get("PROBE_MONITOR_IDLE_MINUTES"), 5)),
+    )
+
+
+def set_probe_monitor_schedule(adaptive: bool, fast_seconds: int, idle_minutes: int):
+    Config.set("PROBE_MONITOR_ADAPTIVE", "true" if adaptive else "false")
+    Config.set("PROBE_MONITOR_FAST_SECONDS", fast_seconds)
+    Config.set("PROBE_MONITOR_IDLE_MINUTES", idle_minutes)
+
+
+def get_retention():
+    return (
+        int(dval(Config.get("TASK_LOG_RETENTION_DAYS"), 90)),
+        int(dval(Config.get("HISTORY_RETENTION_DAYS"), 0)),
+    )
+
+
+def set_retention(task_log_days: int, history_days: int):
+    Config.set("TASK_LOG_RETENTION_DAYS", task_log_days)
+    Config.set("HISTORY_RETENTION_DAYS", history_days)
+
+
 def get_compute_credit_cost():
     return Config.get("compute_credit_cost") or 2
 
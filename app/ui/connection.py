@@ -1,27 +1,250 @@
+import numpy as np
 import pandas as pd
 from snowflake.snowpark import Session
 from snowflake.snowpark.context import get_active_session
 from snowflake.snowpark.exceptions import SnowparkSessionException
 from configparser import ConfigParser
 import os
+import time
+import datetime
+from decimal import Decimal
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from threading import Lock
 from cachetools import TTLCache, cached
 
-# Add back once more things are supported in native apps.
-# class Runner:
-#     job: AsyncJob
-#     is_select: bool
-#
-#     def __init__(self, job: AsyncJob, is_select: bool = False):
-#         self.job = job
-#         self.is_select = is_select
-#
-#     def result(self):
-#         if self.is_select:
-#             return self.job.result()
-#         else:
-#             rows = self.job.result()
-#             return pd.DataFrame([row.as_dict() for row in rows])
+# Snowpark async jobs (to_pandas(block=False)/collect_nowait) aren't supported in native apps, so queries that
+# should run concurrently are submitted to a thread pool instead.
+class Runner:
+    future: Future
+
+    def __init__(self, future: Future):
+        self.future = future
+
+    def result(self):
+        return self.future.result()
+
+
+class Panel:
+    """
+    A piece of a report whose query can run independently of the other panels on the page. The render function is
+    called with the container and the query results, always from the Streamlit script thread.
+    """
+
+    def __init__(self, container, render, sql: str, args: dict = None):
+        self.container = container
+        self.render = render
+        self.sql = sql
+        self.args = args
+
+
+class ResultCache:
+    """
+    Caches select results keyed on the bound SQL. Memory is bounded by the size of the cached DataFrames rather than
+    the number of entries, and everything is dropped once a refresh task records a newer successful run.
+    """
+
+    # Both refresh tasks record their latest successful run, which identifies the data that reports are reading.
+    FRESHNESS_SQL = """
+        select
+            (select max(run) from internal.task_last_state where task_name = 'QUERY_HISTORY') as query_history,
+            (select max(run) from internal.task_last_state where task_name = 'WAREHOUSE_EVENTS') as warehouse_events
+        """
+
+    def __init__(self, max_bytes: int, default_ttl: int, freshness_interval: int = 30):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.freshness_interval = freshness_interval
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.freshness = None
+        self.freshness_checked = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        _, nbytes, _ = self.entries.pop(key)
+        self.size -= nbytes
+
+    def _check_freshness(self):
+        # Claimed under the lock so that concurrent panel queries check at most once per interval.
+        now = time.monotonic()
+        with self.lock:
+            if now - self.freshness_checked < self.freshness_interval:
+                return
+            self.freshness_checked = now
+        freshness = tuple(Connection.execute(self.FRESHNESS_SQL).iloc[0])
+        with self.lock:
+            if self.freshness is not None and freshness != self.freshness:
+                self.invalidations += 1
+                self.entries.clear()
+                self.size = 0
+            self.freshness = freshness
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            df, _, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return df.copy()
+
+    def put(self, key: str, df: pd.DataFrame, ttl: int = None):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            while self.entries and self.size + nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            self.entries[key] = (df.copy(), nbytes, expires)
+            self.size += nbytes
+
+    def execute(self, sql: str, args: dict = None, ttl: int = None):
+        self._check_freshness()
+        key = Connection.bind(sql, args)
+        df = self.get(key)
+        if df is None:
+            df = Connection.execute(key, is_select=True)
+            self.put(key, df, ttl)
+        return df
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+class Pager:
+    """
+    Pages through the results of a select, newest (largest key) first. Each page is fetched with a keyset predicate on
+    the keys of the last row of the previous page instead of an offset, so every page is a bounded query no matter how
+    deep into the results it is, and only the current page is held in memory. Pages are streamed with
+    to_pandas_batches and reading stops once the page is full.
+    """
+
+    def __init__(self, sql: str, args: dict, keys: list, page_size: int = 100):
+        self.sql = sql
+        self.args = args
+        # Together the keys have to identify a row, e.g. [START_TIME, QUERY_ID].
+        self.keys = keys
+        self.page_size = page_size
+        self.start = None
+        self.position = None
+        self.history = []
+        self.page = None
+        self.has_next = False
+
+    @staticmethod
+    def _bind_key(name: str, value) -> (str, object):
+        """
+        Returns the placeholder and value to bind a key value read back from a page. Numpy scalars are converted to
+        their Python value, and timestamps and decimals are bound as strings with an explicit cast so that they
+        compare as the key's type rather than as text.
+        """
+        # pd.Timestamp is a datetime, and numpy datetimes are converted to one rather than to their integer value.
+        if isinstance(value, np.datetime64):
+            value = pd.Timestamp(value)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return f"%({name})s::timestamp_ltz", value.isoformat()
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, Decimal):
+            scale = max(-value.as_tuple().exponent, 0)
+            return f"%({name})s::number(38, {scale})", str(value)
+        return f"%({name})s", value
+
+    def _predicate(self) -> (str, dict):
+        conditions = []
+        args = {}
+        if self.start is not None:
+            placeholder, args["pager_start"] = self._bind_key("pager_start", self.start)
+            conditions.append(f"{self.keys[0]} <= {placeholder}")
+        if self.position is not None:
+            # Rows strictly after the position in (descending) key order.
+            placeholders = []
+            for i, value in enumerate(self.position):
+                placeholder, args[f"pager_{i}"] = self._bind_key(f"pager_{i}", value)
+                placeholders.append(placeholder)
+            after = []
+            for i, key in enumerate(self.keys):
+                equal = [
+                    f"{k} = {placeholders[j]}" for j, k in enumerate(self.keys[:i])
+                ]
+                after.append(" and ".join(equal + [f"{key} < {placeholders[i]}"]))
+            conditions.append("(" + " or ".join(f"({a})" for a in after) + ")")
+        return " and ".join(conditions) or "true", args
+
+    def _fetch(self) -> pd.DataFrame:
+        predicate, pager_args = self._predicate()
+        order = ", ".join(f"{k} desc" for k in self.keys)
+        # One extra row tells us whether there is a next page.
+        sql = f"""select * from ({self.sql}) where {predicate} order by {order} limit {self.page_size + 1}"""
+        key = Connection.bind(sql, {**(self.args or {}), **pager_args})
+        df = results.get(key)
+        if df is None:
+            frames = []
+            rows = 0
+            for batch in Connection.get().sql(key).to_pandas_batches():
+                frames.append(batch)
+                rows += len(batch)
+                if rows > self.page_size:
+                    break
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            results.put(key, df)
+        return df
+
+    def current(self) -> pd.DataFrame:
+        if self.page is None:
+            df = self._fetch()
+            self.has_next = len(df) > self.page_size
+            self.page = df.head(self.page_size)
+        return self.page
+
+    def has_prev(self) -> bool:
+        return len(self.history) > 0
+
+    def next(self):
+        page = self.current()
+        if not self.has_next:
+            return
+        self.history.append(self.position)
+        self.position = tuple(
+            page.iloc[-1][Connection.remove_quotes(k)] for k in self.keys
+        )
+        self.page = None
+
+    def prev(self):
+        if not self.history:
+            return
+        self.position = self.history.pop()
+        self.page = None
+
+    def seek(self, start):
+        """Restarts paging from the rows whose first key is at or before start."""
+        self.start = start
+        self.position = None
+        self.history = []
+        self.page = None
 
 
 class Connection:
@@ -120,15 +343,9 @@ class Connection:
         sql = Connection.bind(sql, args)
 
         if is_select:
-            # if asyncd:
-            #    return Runner(cls.get().sql(sql).to_pandas(block=False), is_select)
-            # else:
             # print("Executing (select): " + sql)
             return cls.get().sql(sql).to_pandas()
         else:
-            # if asyncd:
-            #    return Runner(cls.get().sql(sql).collect_nowait(), is_select)
-            # else:
             # print("Executing (nonselect): " + sql)
             rows = cls.get().sql(sql).collect()
             return pd.DataFrame([row.as_dict() for row in rows])
@@ -142,10 +359,44 @@ def execute_select(sql: str, args: dict = None):
     return Connection.execute(sql, args, is_select=True)
 
 
-# This isn't supported in native apps/snowpark :(
-# def execute_async_select(sql: str, args: dict = None):
-#    return Connection.execute(sql, args, is_select=True, asyncd=True)
-
-
 def execute_with_cache(sql: str):
     return Connection.cached(sql)
+
+
+results = ResultCache(max_bytes=256 * 1024 * 1024, default_ttl=15 * 60)
+
+
+def execute_select_with_cache(sql: str, args: dict = None, ttl: int = None):
+    return results.execute(sql, args, ttl)
+
+
+def cache_stats() -> dict:
+    return results.stats()
+
+
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="opscenter-query")
+
+
+def pager(sql: str, args: dict, keys: list, page_size: int = 100) -> Pager:
+    return Pager(sql, args, keys, page_size)
+
+
+def execute_async_select(sql: str, args: dict = None, ttl: int = None) -> Runner:
+    return Runner(executor.submit(execute_select_with_cache, sql, args, ttl))
+
+
+def render_panels(panels: list):
+    """
+    Submits every panel's query at once and renders each panel as soon as its results arrive, so the page takes about
+    as long as its slowest query instead of the sum of all of them. A failed query is reported in its own panel and
+    doesn't keep the other panels from rendering.
+    """
+    pending = {execute_async_select(p.sql, p.args).future: p for p in panels}
+    for future in as_completed(pending):
+        panel = pending[future]
+        try:
+            df = future.result()
+        except Exception as e:
+            panel.container.error(f"Unable to load this section: {e}")
+            continue
+        panel.render(panel.container, df)
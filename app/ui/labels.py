@@ -1,3 +1,5 @@
+import json
+import pandas as pd
 import streamlit as st
 from connection import Connection
 import session as general_session
@@ -218,6 +220,72 @@ class Label:
             self.session.set_toast("Label deleted.")
             self.session.do_list()
 
+    def preview(self, condition: str, is_dynamic: bool):
+        with st.expander("Preview"):
+            st.caption(
+                "Estimates what the condition matches from a sample of recent queries, without changing the label."
+            )
+            cols = st.columns(2)
+            days = cols[0].number_input(
+                "Days", min_value=1, max_value=90, value=7, key="PREVIEW_DAYS"
+            )
+            sample = cols[1].number_input(
+                "Sample %",
+                min_value=0.1,
+                max_value=100.0,
+                value=10.0,
+                key="PREVIEW_SAMPLE",
+                help="Larger samples are capped to keep the preview fast.",
+            )
+            if not st.button("Preview", disabled=not condition):
+                return
+
+            with st.spinner("Evaluating condition..."):
+                preview = json.loads(
+                    self.snowflake.call(
+                        "INTERNAL.PREVIEW_LABEL",
+                        condition,
+                        is_dynamic,
+                        int(days),
+                        float(sample),
+                    )
+                )
+            if "error" in preview:
+                st.error(preview["error"])
+                return
+
+            if preview.get("match_rate") is None:
+                st.info("No queries were sampled in this period.")
+                return
+            cols = st.columns(3)
+            cols[0].metric(
+                "Match Rate",
+                f"{preview['match_rate']:.1%}",
+                help=f"95% bounds: {preview['match_rate_low']:.1%} - {preview['match_rate_high']:.1%}",
+            )
+            cols[1].metric("Matched Queries", f"{preview['matches']:,.0f}")
+            cols[2].metric(
+                "Matched Cost",
+                f"${preview['matched_cost']:,.2f}",
+                help=f"95% bounds: ${preview['matched_cost_low']:,.2f} - ${preview['matched_cost_high']:,.2f}",
+            )
+            st.caption(
+                f"Evaluated {preview['sampled_queries']:,} of about {preview['total_queries']:,.0f} queries "
+                f"({preview['sample_percent']:.2f}% sample)."
+            )
+            if preview["top_hashes"]:
+                st.dataframe(
+                    pd.DataFrame(preview["top_hashes"]).rename(
+                        columns={
+                            "query_hash": "Query Hash",
+                            "query_text": "Example Query",
+                            "matches": "Matches",
+                            "cost": "Cost",
+                        }
+                    ),
+                    use_container_width=True,
+                )
+
     def create_label(self, grouped: str, is_dynamic: bool):
         st.title("New Label")
         group = None
@@ -239,6 +307,7 @@ class Label:
             rank = st.number_input(
                 key="GROUP_RANK", label="Rank", format="%i", value=10
             )
+        self.preview(condition, is_dynamic)
         st.button(
             "Create",
             on_click=lambda: self.on_create_click(
@@ -272,6 +341,7 @@ class Label:
         condition = st.text_area(
             key="CONDITION", label="Condition", value=update["condition"]
         )
+        self.preview(condition, is_dynamic)
 
         st.button(
             "Update",
@@ -1,3 +1,4 @@
+import pandas as pd
 import streamlit as st
 import connection
 import config
@@ -112,6 +113,36 @@ with config_tab:
                 )
                 st.success("Saved")
 
+    label_store_enabled = config.get_label_store_enabled()
+    materialize_labels = st.checkbox(
+        "Materialize label values",
+        value=label_store_enabled,
+        help="Store the value of every label for each query instead of evaluating label conditions in every report. "
+        "New and changed labels are backfilled in the background.",
+    )
+    if materialize_labels != label_store_enabled:
+        with st.spinner("Updating label settings."):
+            config.set_label_store_enabled(materialize_labels)
+        st.success("Saved")
+
+    with st.form("retention"):
+        task_log_days, history_days = config.get_retention()
+        task_log_days = st.number_input(
+            "Task log retention (days)",
+            min_value=1,
+            value=task_log_days,
+            help="Older task runs and probe actions are summarized per day and removed.",
+        )
+        history_days = st.number_input(
+            "Query and warehouse history retention (days)",
+            min_value=0,
+            value=history_days,
+            help="Materialized history older than this is removed daily. 0 keeps all history.",
+        )
+        if st.form_submit_button("Save"):
+            config.set_retention(task_log_days, history_days)
+            st.success("Saved")
+
 
 with setup_tab:
     setup.setup_block()
@@ -187,6 +218,52 @@ with tasks:
             "Unable to load task information. Make sure to run post-setup scripts."
         )
 
+    st.subheader("Probe Monitoring")
+    adaptive, fast_seconds, idle_minutes = config.get_probe_monitor_schedule()
+    with st.form("probe_monitoring"):
+        adaptive = st.checkbox(
+            "Adaptive probe monitoring",
+            value=adaptive,
+            help="Evaluate probes several times a minute while queries are running and back off while the account is idle.",
+        )
+        fast_seconds = st.number_input(
+            "Interval while active (seconds)",
+            min_value=10,
+            max_value=45,
+            value=fast_seconds,
+        )
+        idle_minutes = st.number_input(
+            "Interval while idle (minutes)",
+            min_value=1,
+            max_value=10,
+            value=idle_minutes,
+        )
+        if st.form_submit_button("Save"):
+            config.set_probe_monitor_schedule(adaptive, fast_seconds, idle_minutes)
+            st.success("Saved")
+
+    # Detection latency is only recorded by ticks which matched a query.
+    latency = connection.execute_select(
+        """
+        select
+            count(*) as ticks,
+            median(output:tick_interval_ms::number) / 1000 as interval,
+            median(output:detection_latency_ms::number) / 1000 as p50,
+            approx_percentile(output:detection_latency_ms::number, 0.95) / 1000 as p95
+        from internal.task_probe_monitoring
+        where success and run > dateadd(hour, -1, current_timestamp())
+        """
+    )
+    cols = st.columns(4)
+    cols[0].metric("Probe Evaluations (last hour)", int(latency["TICKS"][0]))
+    for col, name, title in [
+        (cols[1], "INTERVAL", "Median Evaluation Interval"),
+        (cols[2], "P50", "Median Detection Latency"),
+        (cols[3], "P95", "P95 Detection Latency"),
+    ]:
+        value = latency[name][0]
+        col.metric(title, "-" if pd.isna(value) else f"{float(value):.0f}s")
+
 with diagnostics_tab:
     st.title("Diagnostics")
 
@@ -252,6 +329,51 @@ with diagnostics_tab:
             """
         )
 
+    st.header("Report Cache")
+    stats = connection.cache_stats()
+    cols = st.columns(len(stats))
+    for col, (name, value) in zip(cols, stats.items()):
+        col.metric(name.title(), value)
+
+    st.header("Query History Clustering")
+    st.caption(
+        "Materialized query history is clustered by day and warehouse so that date and warehouse filters skip "
+        "micro-partitions. A low average depth means few partitions are scanned for a day."
+    )
+    try:
+        clustering = connection.execute_select(
+            """
+            select
+                info:total_partition_count::number as partitions,
+                info:average_depth::float as depth,
+                info:average_overlaps::float as overlaps
+            from (select parse_json(system$clustering_information('internal_reporting_mv.query_history_complete_and_daily')) as info)
+            """
+        )
+        cols = st.columns(3)
+        cols[0].metric("Micro-partitions", int(clustering["PARTITIONS"][0]))
+        cols[1].metric("Average Depth", f"{clustering['DEPTH'][0]:.2f}")
+        cols[2].metric("Average Overlaps", f"{clustering['OVERLAPS'][0]:.2f}")
+    except Exception:
+        st.info(
+            "Clustering information is available once query history has been loaded."
+        )
+
+    st.header("Storage")
+    storage = connection.execute_select("call internal.table_storage_stats()")
+    st.dataframe(
+        storage.rename(
+            columns={
+                "TABLE_SCHEMA": "Schema",
+                "TABLE_NAME": "Table",
+                "ROW_COUNT": "Rows",
+                "BYTES": "Bytes",
+                "LAST_ALTERED": "Last Altered",
+            }
+        ),
+        use_container_width=True,
+    )
+
 
 with reset:
     st.title("Reset/Reload")
@@ -265,8 +387,18 @@ with reset:
         begin
             truncate table internal.task_query_history;
             truncate table internal.task_warehouse_events;
+            delete from internal.task_last_state where task_name in ('QUERY_HISTORY', 'WAREHOUSE_EVENTS');
+            truncate table internal.query_history_backfill;
             truncate table internal_reporting_mv.cluster_and_warehouse_sessions_complete_and_daily;
+            truncate table internal_reporting_mv.warehouse_session_stats;
             truncate table internal_reporting_mv.query_history_complete_and_daily;
+            truncate table internal_reporting_mv.query_history_daily_rollup;
+            truncate table internal_reporting_mv.query_history_hourly;
+            truncate table internal_reporting_mv.query_tables;
+            truncate table internal_reporting_mv.warehouse_daily_utilization;
+            truncate table internal.qlike_cache;
+            truncate table internal_reporting_mv.query_hash_daily;
+            truncate table internal_reporting_mv.query_hash_frequency;
         end;
         """
         )
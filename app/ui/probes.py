@@ -1,4 +1,6 @@
+import datetime
 import streamlit as st
+import connection
 from connection import Connection
 import session as general_session
 from session import Mode
@@ -130,6 +132,75 @@ class Probe:
             "New", key="create", on_click=self.session.do_create, args=[None, False]
         )
 
+        with st.expander("Backtest probes"):
+            names = st.multiselect(
+                "Probes", options=[row["NAME"] for row in data], key="backtest_names"
+            )
+            self.backtest(
+                [
+                    {"name": row["NAME"], "condition": row["CONDITION"]}
+                    for row in data
+                    if row["NAME"] in names
+                ],
+                "list",
+            )
+
+    def backtest(self, probes: list, key: str):
+        st.caption(
+            "Evaluates the probe conditions against past queries and estimates what cancelling matching queries "
+            "would have saved. Conditions relative to the current time (e.g. using current_timestamp()) don't "
+            "reflect what the probe would have matched at the time."
+        )
+        today = datetime.date.today()
+        cols = st.columns([2, 1])
+        dates = cols[0].date_input(
+            "Date Range",
+            value=[today - datetime.timedelta(days=30), today],
+            key=f"backtest_range_{key}",
+        )
+        detection = cols[1].number_input(
+            "Seconds until cancelled",
+            min_value=0,
+            value=60,
+            key=f"backtest_detection_{key}",
+        )
+        if not st.button(
+            "Run Backtest", key=f"backtest_{key}", disabled=len(probes) == 0
+        ):
+            return
+        if len(dates) != 2:
+            st.error("Please select a start and end date.")
+            return
+
+        with st.spinner("Backtesting probes..."):
+            try:
+                df = connection.execute_select(
+                    "call internal.backtest_probes(%(probes)s, %(start)s, %(end)s, %(detection)s)",
+                    {
+                        "probes": probes,
+                        "start": dates[0],
+                        "end": dates[1] + datetime.timedelta(days=1),
+                        "detection": int(detection),
+                    },
+                )
+            except Exception as e:
+                st.error(f"Unable to backtest probes: {e}")
+                return
+        st.dataframe(
+            df.rename(
+                columns={
+                    "NAME": "Probe",
+                    "QUERIES": "Queries",
+                    "MATCHES": "Matches",
+                    "MATCHED_CREDITS": "Matched Credits",
+                    "MATCHED_COST": "Matched Cost",
+                    "SAVED_CREDITS": "Credits Saved by Cancelling",
+                    "SAVED_COST": "Cost Saved by Cancelling",
+                }
+            ),
+            use_container_width=True,
+        )
+
     def on_create_click(
         self,
         name,
@@ -235,6 +306,13 @@ class Probe:
                 options=("Email", "Slack"),
                 index=0,
             )
+        with st.expander("Backtest"):
+            self.backtest(
+                [{"name": name or "New Probe", "condition": condition}]
+                if condition
+                else [],
+                "create",
+            )
         st.button(
             "Create",
             on_click=self.on_create_click,
@@ -285,6 +363,11 @@ class Probe:
                 index=1 if update["notify_other_method"].lower() == "slack" else 0,
             )
 
+        with st.expander("Backtest"):
+            self.backtest(
+                [{"name": name, "condition": condition}] if condition else [],
+                "edit",
+            )
         st.button(
             "Update",
             on_click=self.on_update_click,
@@ -0,0 +1,65 @@
+import streamlit as st
+
+import connection
+import filters
+
+# Builds the filter predicates shared by the reports. Predicates are rendered canonically (sorted and de-duplicated
+# values) so that the same filter choices always produce the same SQL, and therefore the same result cache entry, no
+# matter which page or in which order they were picked.
+
+
+def label_filters(bf: filters.BaseFilter):
+    labels = connection.execute_with_cache(
+        "select name from internal.labels where group_name is null"
+    )
+
+    if len(labels) == 0:
+        return [], [], []
+
+    with bf.container:
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            include_all = st.multiselect("Include All", options=labels)
+        with c2:
+            include_any = st.multiselect("Include Any", options=labels)
+        with c3:
+            exclude_any = st.multiselect("Exclude Any", options=labels)
+    return include_all, include_any, exclude_any
+
+
+def label_filter_sql(
+    include_all: list, include_any: list, exclude_any: list, rollup: bool = False
+) -> str:
+    def label(name):
+        # The rollup stores the names of matching labels instead of a boolean column per label.
+        if rollup:
+            sql = f"array_contains({connection.Connection.convert(name)}::variant, labels)"
+        else:
+            sql = f'"{name}"'
+        # Report queries are bound with %-style arguments afterwards.
+        return sql.replace("%", "%%")
+
+    addition_filter = ""
+    for name in sorted(set(include_all)):
+        addition_filter += f" and {label(name)} "
+
+    if len(include_any) > 0:
+        addition_filter += (
+            f" and ({' or '.join(label(name) for name in sorted(set(include_any)))}) "
+        )
+
+    if len(exclude_any) > 0:
+        addition_filter += f" and not ({' or '.join(label(name) for name in sorted(set(exclude_any)))}) "
+
+    return addition_filter
+
+
+def warehouse_filter_sql(warehouse_names: list, column: str = "warehouse_name") -> str:
+    # A literal IN list (rather than array_contains over a bound array) lets Snowflake prune on the warehouse.
+    if not warehouse_names:
+        return ""
+    values = ", ".join(
+        connection.Connection.convert(name) for name in sorted(set(warehouse_names))
+    )
+    # Report queries are bound with %-style arguments afterwards.
+    return f" and {column} in ({values.replace('%', '%%')}) "
@@ -4,14 +4,39 @@ import pandas as pd
 import config
 
 
-def display(options):
-    if not config.get_materialization_complete():
-        st.info("Please wait for materialization to complete before running reports.")
-        st.button(
-            "Refresh Status",
-            on_click=config.refresh,
-            key="refresh-materialization-status",
+def materialization_status() -> bool:
+    # Reports are available once recent history is materialized, older history is backfilled in the background.
+    ready = config.get_materialization_complete()
+    done, total, loaded_since = (
+        config.get_backfill_progress() if ready else (0, 0, None)
+    )
+    if not ready:
+        st.info(
+            "Loading recent query history and warehouse events. Reports are available shortly."
+        )
+    elif done < total:
+        since = (
+            f" Reports include queries since {loaded_since:%Y-%m-%d}."
+            if loaded_since is not None
+            else ""
         )
+        st.progress(
+            done / total,
+            text=f"Loading older query history: {done} of {total} days loaded.{since}",
+        )
+    else:
+        return True
+
+    st.button(
+        "Refresh Status",
+        on_click=config.refresh,
+        key="refresh-materialization-status",
+    )
+    return ready
+
+
+def display(options):
+    if not materialization_status():
         return
 
     credit_cost = config.get_compute_credit_cost()
@@ -2,10 +2,11 @@ import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 import plotly.express as px
-from reports_query_activity import topn
+from reports_query_activity import topn_sql
 
 import connection
 import filters
+import query_builder
 
 
 def report(
@@ -14,151 +15,113 @@ def report(
 ):
     _ = connection.execute("CALL INTERNAL.REPORT_PAGE_VIEW('Query Report dbt Summary')")
 
-    labels = connection.execute_with_cache(
-        "select name from internal.labels where group_name is null"
+    include_all, include_any, exclude_any = query_builder.label_filters(bf)
+    addition_filter = query_builder.label_filter_sql(
+        include_all, include_any, exclude_any
     )
-
-    addition_filter = ""
-
-    if len(labels) > 0:
-        with bf.container:
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                include_all = st.multiselect("Include All", options=labels)
-            with c2:
-                include_any = st.multiselect("Include Any", options=labels)
-            with c3:
-                exclude_any = st.multiselect("Exclude Any", options=labels)
-
-        for label in include_all:
-            addition_filter += f""" and "{label}" """
-
-        if len(include_any) > 0:
-            addition_filter += " and ("
-            for label in include_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
-
-        if len(exclude_any) > 0:
-            addition_filter += " and not ("
-            for label in exclude_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
+    warehouse_filter = query_builder.warehouse_filter_sql(bf.warehouse_names)
 
     sql = f"""
-with raw as (
-    select
-        query_id,
-        cost,
-        date_trunc({bf.trunc()}, start_time) as d,
-        value:KEY as dbt_qtag_name,
-        value:VALUE as dbt_qtag_value, tools.model_run_time(total_elapsed_time) as run_time,
-tools.model_size(tools.model_size_rows(zeroifnull(rows_produced)), tools.model_size_bytes(bytes_written_to_result)) as size,
-tools.model_efficiency(bytes_spilled_to_local_storage, bytes_spilled_to_remote_storage) as efficiency
-    from reporting.labeled_query_history, lateral flatten(qtag)
-    where
-        value:SOURCE = 'dbt'
-        and (value:KEY = 'invocation_id' or value:KEY = 'node_id')
-        and start_time between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-            OR array_contains(warehouse_name::variant, %(warehouse_names)s))
-        {addition_filter}
-    order by query_id
-),
-
-agg as (
-    select
-        dbt_qtag_value as k2,
-        d,
-        cost, run_time, size, efficiency,
-        lag(dbt_qtag_value)
-            over (partition by query_id order by dbt_qtag_name)
-            as k1
-    from raw
-    where cost is not null
-)
-
 select
-    d as "Date",
+    date_trunc({bf.trunc()}, start_time) as "Date",
     cost as "Cost",
     1 as "Count",
-    k2 as "ModelId",
-    coalesce(k1, 'Unknown') as "RunId", run_time as "RunTimeGrade", size as "SizeGrade", efficiency as "EfficiencyGrade"
-from agg
+    qtag_filter:dbt:node_id::string as "ModelId",
+    coalesce(qtag_filter:dbt:invocation_id::string, 'Unknown') as "RunId",
+    tools.model_run_time(total_elapsed_time) as "RunTimeGrade",
+    tools.model_size(tools.model_size_rows(zeroifnull(rows_produced)), tools.model_size_bytes(bytes_written_to_result)) as "SizeGrade",
+    tools.model_efficiency(bytes_spilled_to_local_storage, bytes_spilled_to_remote_storage) as "EfficiencyGrade"
+from reporting.labeled_query_history
 where
-    not (k2 ilike '________-____-____-____-____________' and regexp_like(k2, '^[0-9a-f]{{8}}-[0-9a-f]{{4}}-[0-9a-f]{{4}}-[0-9a-f]{{4}}-[0-9a-f]{{12}}$', 'i'))
+    qtag_filter:dbt:node_id is not null
+    and cost is not null
+    and start_time between %(start)s and %(end)s {warehouse_filter}
+    {addition_filter}
         """
 
     def overview():
-        df = connection.execute_select(
-            sql + " ;",
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
-        )
-        df["ModelId"] = df["ModelId"].map(lambda x: x.replace('"', ""))
-        dfc = (
-            df.groupby(["Date"]).agg({"Cost": "sum", "RunId": "nunique"}).reset_index()
-        )
+        args = {"start": bf.start, "end": bf.end}
+        daily_sql = f"""
+            select "Date", sum("Cost") as "Cost", count(distinct "RunId") as "RunId"
+            from ({sql}) group by "Date" order by "Date"
+            """
+        models_sql = f"""
+            select "ModelId", sum("Cost") as "Cost"
+            from ({sql}) group by "ModelId" having sum("Cost") > 0.5
+            """
+        # Grades are only shown for the models in the cost chart, so only their rows are fetched.
+        grades_sql = f"""
+            with models as ({models_sql} order by "Cost" desc limit 20)
+            select * from ({sql}) where "ModelId" in (select "ModelId" from models)
+            """
 
-        # Create figure with secondary y-axis
-        fig_cost = go.Figure(
-            data=[
-                go.Bar(
-                    x=dfc["Date"],
-                    y=dfc["Cost"],
-                    name="Cost",
-                    yaxis="y",
-                    offsetgroup=0,
-                    marker_color="#0095F0",
-                ),
-                go.Scatter(
-                    x=dfc["Date"],
-                    y=dfc["RunId"],
-                    name="Run Count",
-                    yaxis="y2",
-                    marker_color="#856CF3",
-                ),
-            ],
-            layout={
-                "yaxis": {"title": "Cost", "tickprefix": "$", "tickformat": ",.2f"},
-                "yaxis2": {
-                    "title": "Number of Runs",
-                    "overlaying": "y",
-                    "side": "right",
+        def daily(container, dfc: pd.DataFrame):
+            # Create figure with secondary y-axis
+            fig_cost = go.Figure(
+                data=[
+                    go.Bar(
+                        x=dfc["Date"],
+                        y=dfc["Cost"],
+                        name="Cost",
+                        yaxis="y",
+                        offsetgroup=0,
+                        marker_color="#0095F0",
+                    ),
+                    go.Scatter(
+                        x=dfc["Date"],
+                        y=dfc["RunId"],
+                        name="Run Count",
+                        yaxis="y2",
+                        marker_color="#856CF3",
+                    ),
+                ],
+                layout={
+                    "yaxis": {"title": "Cost", "tickprefix": "$", "tickformat": ",.2f"},
+                    "yaxis2": {
+                        "title": "Number of Runs",
+                        "overlaying": "y",
+                        "side": "right",
+                    },
+                    "xaxis": {"dtick": bf.dtick(), "title": bf.ticktitle()},
+                    "legend": {"xanchor": "right", "x": 0.2},
                 },
-                "xaxis": {"dtick": bf.dtick(), "title": bf.ticktitle()},
-                "legend": {"xanchor": "right", "x": 0.2},
-            },
-        )
-        fig_cost.update_layout({"title": "Cost and Number of Runs"})
-
-        st.plotly_chart(fig_cost, use_container_width=True)
-
-        dfm = (
-            df.groupby(["ModelId"])
-            .agg({"Cost": "sum", "RunId": "nunique"})
-            .reset_index()
-            .sort_values(by=["Cost"], ascending=True)
-        )
-        dfm = topn(dfm[dfm.Cost > 0.5], 20, "Cost", "sum", "ModelId", False)
-
-        fig = px.bar(dfm[dfm.Cost > 0.5], x="Cost", y="ModelId", orientation="h")
-        fig.update_layout({"title": "Model Cost"})
-        st.plotly_chart(fig, use_container_width=True)
-
-        dfh = create_heatmap(df[df.ModelId.isin(dfm.ModelId)])
-        st.markdown(
+            )
+            fig_cost.update_layout({"title": "Cost and Number of Runs"})
+
+            container.plotly_chart(fig_cost, use_container_width=True)
+
+        def models(container, dfm: pd.DataFrame):
+            fig = px.bar(dfm[dfm.Cost > 0.5], x="Cost", y="ModelId", orientation="h")
+            fig.update_layout({"title": "Model Cost"})
+            container.plotly_chart(fig, use_container_width=True)
+
+        def grades(container, df: pd.DataFrame):
+            dfh = create_heatmap(df)
+            container.markdown(
+                """
+            Below rankings are based on the criteria from the [GitLab dbt
+            Manual](https://about.gitlab.com/handbook/business-technology/data-team/platform/dbt-guide/#model-performance)
+            and take into account the following:
+            * Run time
+            * Output table size
+            * Output table rows
+            * Amount spilled to disk
             """
-        Below rankings are based on the criteria from the [GitLab dbt
-        Manual](https://about.gitlab.com/handbook/business-technology/data-team/platform/dbt-guide/#model-performance)
-        and take into account the following:
-        * Run time
-        * Output table size
-        * Output table rows
-        * Amount spilled to disk
-        """
+            )
+            container.dataframe(dfh, use_container_width=True)
+
+        connection.render_panels(
+            [
+                connection.Panel(st.container(), daily, daily_sql, args),
+                connection.Panel(
+                    st.container(),
+                    models,
+                    topn_sql(models_sql, 20, ["Cost"], "Cost", "ModelId", False),
+                    args,
+                ),
+                connection.Panel(st.container(), grades, grades_sql, args),
+            ]
         )
-        st.dataframe(dfh, use_container_width=True)
 
     view = st.selectbox("Pick View", pd.DataFrame({"options": ["Graph", "List"]}))
 
@@ -173,9 +136,9 @@ where
     if view == "Graph":
         overview()
     else:
-        df = connection.execute_select(
+        df = connection.execute_select_with_cache(
             sql + " limit 1000;",
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
+            {"start": bf.start, "end": bf.end},
         )
         st.dataframe(df, use_container_width=True)
 
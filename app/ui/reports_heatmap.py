@@ -6,6 +6,7 @@ import plotly.express as px
 import calendar
 import numpy as np
 import filters
+import query_builder
 
 
 def heatmap(
@@ -14,11 +15,12 @@ def heatmap(
 ):
     _ = connection.execute("CALL INTERNAL.REPORT_PAGE_VIEW('Warehouse Heatmap')")
 
+    warehouse_filter = query_builder.warehouse_filter_sql(bf.warehouse_names)
     sql = f"""
     with util as (
         select date_trunc('DAY', PERIOD) AS PERIOD, SUM(LOADED_CC * {cost_per_credit}) AS COST, IFF(SUM(LOADED_CC) = 0,null, SUM(UNLOADED_CC)/SUM(LOADED_CC)) AS UTILIZATION
         from REPORTING.WAREHOUSE_DAILY_UTILIZATION
-        where PERIOD between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0 OR array_contains(warehouse_name::variant, %(warehouse_names)s))
+        where PERIOD between %(start)s and %(end)s {warehouse_filter}
         GROUP BY 1
     )
 
@@ -31,9 +33,7 @@ def heatmap(
     high = (
         bf.end - datetime.timedelta(days=bf.end.weekday()) + datetime.timedelta(days=6)
     )
-    df = connection.execute(
-        sql, {"start": low, "end": high, "warehouse_names": bf.warehouse_names}
-    )
+    df = connection.execute(sql, {"start": low, "end": high})
     df.set_index(["PERIOD"], inplace=True)
 
     df = df.reindex(
@@ -2,45 +2,20 @@ import pandas as pd
 import streamlit as st
 import filters
 import connection
+import query_builder
 import plotly.express as px
+import sthelp
 
 
 def report(
     bf: filters.BaseFilter,
     cost_per_credit,
 ):
-    labels = connection.execute_select(
-        "select name from internal.labels where group_name is null"
+    include_all, include_any, exclude_any = query_builder.label_filters(bf)
+    addition_filter = query_builder.label_filter_sql(
+        include_all, include_any, exclude_any
     )
-
-    addition_filter = ""
-
-    if len(labels) > 0:
-        with bf.container:
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                include_all = st.multiselect("Include All", options=labels)
-            with c2:
-                include_any = st.multiselect("Include Any", options=labels)
-            with c3:
-                exclude_any = st.multiselect("Exclude Any", options=labels)
-
-        for label in include_all:
-            addition_filter += f""" and "{label}" """
-
-        if len(include_any) > 0:
-            addition_filter += " and ("
-            for label in include_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
-
-        if len(exclude_any) > 0:
-            addition_filter += " and not ("
-            for label in exclude_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
+    warehouse_filter = query_builder.warehouse_filter_sql(bf.warehouse_names)
 
     groups = pd.concat(
         [
@@ -62,6 +37,7 @@ def report(
     )
 
     grouping = st.selectbox("Color by Category or Grouping Label", groups)
+    rollup_grp = None
     if grouping == "User":
         grp = "USER_NAME"
     elif grouping == "Warehouse":
@@ -74,65 +50,72 @@ def report(
         grp = "EXECUTION_STATUS"
     else:
         grp = f""" "{grouping}" """
+        rollup_grp = f"label_groups[{connection.Connection.convert(grouping)}]::string"
 
     _ = connection.execute(
         f"CALL INTERNAL.REPORT_PAGE_VIEW('Query Activity by {grouping}')"
     )
 
     def overview():
-        sql = f"""
-        select
-            date_trunc({bf.trunc()}, start_time) as "Date", {grp} as "Group",
-            sum(qh.unloaded_direct_compute_credits * {cost_per_credit}) as "Cost",
-            count(*) as "Queries"
-        from reporting.labeled_query_history qh
-        where start_time between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-            OR array_contains(warehouse_name::variant, %(warehouse_names)s))
-        {addition_filter}
-        group by "Date", "Group"
-        """
-        df = connection.execute_select(
-            sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
-        )
-        df_c = topn(df, 10, "Cost", "sum")
-        df_q = topn(df, 10, "Queries", "sum")
-
-        fig_cost = px.bar(
-            df_c,
-            x="Date",
-            y="Cost",
-            color="Group",
-            barmode="stack",
-            category_orders={"Group": df.Group.sort_values()},
-        )
-
-        fig_cost.update_layout(
-            title="Query Cost",
-            xaxis_dtick=bf.dtick(),
-            xaxis_title=bf.ticktitle(),
-            yaxis_title="Cost",
-            showlegend=True,
-        )
-        st.plotly_chart(fig_cost, use_container_width=True)
-
-        fig_count = px.bar(
-            df_q,
-            x="Date",
-            y="Queries",
-            color="Group",
-            barmode="stack",
-            category_orders={"Group": df.Group.sort_values()},
-        )
+        if has_daily_rollup():
+            rollup_filter = query_builder.label_filter_sql(
+                include_all, include_any, exclude_any, rollup=True
+            )
+            sql = f"""
+            select
+                date_trunc({bf.trunc()}, day) as "Date", {rollup_grp or grp} as "Group",
+                sum(unloaded_direct_compute_credits * {cost_per_credit}) as "Cost",
+                sum(queries) as "Queries"
+            from reporting.query_history_daily_rollup
+            where day >= %(start)s and day < %(end)s {warehouse_filter}
+            {rollup_filter}
+            group by "Date", "Group"
+            """
+        else:
+            sql = f"""
+            select
+                date_trunc({bf.trunc()}, start_time) as "Date", {grp} as "Group",
+                sum(qh.unloaded_direct_compute_credits * {cost_per_credit}) as "Cost",
+                count(*) as "Queries"
+            from reporting.labeled_query_history qh
+            where start_time between %(start)s and %(end)s {warehouse_filter}
+            {addition_filter}
+            group by "Date", "Group"
+            """
+
+        def chart(title: str, col: str):
+            def render(container, df: pd.DataFrame):
+                fig = px.bar(
+                    df,
+                    x="Date",
+                    y=col,
+                    color="Group",
+                    barmode="stack",
+                    category_orders={"Group": df.Group.sort_values()},
+                )
+
+                fig.update_layout(
+                    title=title,
+                    xaxis_dtick=bf.dtick(),
+                    xaxis_title=bf.ticktitle(),
+                    yaxis_title=col,
+                    showlegend=True,
+                )
+                container.plotly_chart(fig, use_container_width=True)
+
+            return connection.Panel(
+                st.container(),
+                render,
+                topn_sql(sql, 10, ["Cost", "Queries"], col),
+                {
+                    "start": bf.start,
+                    "end": bf.end,
+                },
+            )
 
-        fig_count.update_layout(
-            title="Query Count",
-            xaxis_dtick=bf.dtick(),
-            xaxis_title=bf.ticktitle(),
-            yaxis_title="Queries",
-            showlegend=True,
+        connection.render_panels(
+            [chart("Query Cost", "Cost"), chart("Query Count", "Queries")]
         )
-        st.plotly_chart(fig_count, use_container_width=True)
 
     view = st.selectbox("Pick View", pd.DataFrame({"options": ["Graph", "List"]}))
 
@@ -142,47 +125,59 @@ def report(
         sql = f"""
                 select
                     start_time,
+                    query_id,
                     user_name,
                     query_text,
                     duration,
                     execution_status,
                     qh.unloaded_direct_compute_credits * {cost_per_credit} as COST
                 from reporting.labeled_query_history qh
-                where start_time between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-                    OR array_contains(warehouse_name::variant, %(warehouse_names)s))
+                where start_time between %(start)s and %(end)s {warehouse_filter}
                 {addition_filter}
-                limit 1000
                 """
-        df = connection.execute_select(
+        sthelp.paged_dataframe(
+            "query_activity",
             sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
+            {"start": bf.start, "end": bf.end},
+            ["START_TIME", "QUERY_ID"],
+            seek_label="Show queries started on or before",
         )
-        st.dataframe(df, use_container_width=True)
 
 
-def topn(
-    df: pd.DataFrame,
+def has_daily_rollup() -> bool:
+    df = connection.execute_with_cache(
+        "select internal.is_daily_rollup_current() as current"
+    )
+    return len(df) > 0 and bool(df["CURRENT"][0])
+
+
+def topn_sql(
+    sql: str,
     n: int,
-    col: str,
-    col_agg: str,
+    cols: list,
+    rank_col: str,
     rank_col_name: str = "Group",
     has_date: bool = True,
-) -> pd.DataFrame:
-    topn = set(
-        df.groupby([rank_col_name])
-        .agg({col: col_agg})
-        .reset_index()
-        .sort_values([col], ascending=False)
-        .head(n)[rank_col_name]
-        .tolist()
-    )
-    df["NewGroup"] = df[rank_col_name].map(lambda x: x if x in topn else "Other")
-    date_list = ["Date"] if has_date else []
-    df = df[["NewGroup", col] + date_list]
-    df.rename(columns={"NewGroup": rank_col_name}, inplace=True)
-    return (
-        df.groupby([rank_col_name] + date_list)
-        .agg({col: col_agg})
-        .reset_index()
-        .sort_values([col], ascending=True)
-    )
+) -> str:
+    """
+    Wraps a query grouped by (Date, rank_col_name) so that only the n groups with the largest total rank_col keep their
+    name and every other group is summed into "Other". The ranking happens in Snowflake, so only the rows being charted
+    are returned.
+    """
+    date = '"Date", ' if has_date else ""
+    sums = ", ".join(f'sum(g."{col}") as "{col}"' for col in cols)
+    return f"""
+        with grouped as (
+            {sql}
+        ), ranked as (
+            select "{rank_col_name}", true as is_top from grouped
+            group by "{rank_col_name}"
+            order by sum("{rank_col}") desc
+            limit {n}
+        )
+        select {date}iff(r.is_top, g."{rank_col_name}", 'Other') as "{rank_col_name}", {sums}
+        from grouped g
+        left outer join ranked r on equal_null(g."{rank_col_name}", r."{rank_col_name}")
+        group by all
+        order by "{rank_col}"
+        """
@@ -3,6 +3,8 @@ import streamlit as st
 
 import connection
 import filters
+import query_builder
+import sthelp
 
 
 def report(
@@ -13,48 +15,32 @@ def report(
         "CALL INTERNAL.REPORT_PAGE_VIEW('Query Report Repeated Queries')"
     )
 
-    labels = connection.execute_with_cache(
-        "select name from internal.labels where group_name is null"
+    include_all, include_any, exclude_any = query_builder.label_filters(bf)
+    addition_filter = query_builder.label_filter_sql(
+        include_all, include_any, exclude_any
     )
-
-    addition_filter = ""
-
-    if len(labels) > 0:
-        with bf.container:
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                include_all = st.multiselect("Include All", options=labels)
-            with c2:
-                include_any = st.multiselect("Include Any", options=labels)
-            with c3:
-                exclude_any = st.multiselect("Exclude Any", options=labels)
-
-        for label in include_all:
-            addition_filter += f""" and "{label}" """
-
-        if len(include_any) > 0:
-            addition_filter += " and ("
-            for label in include_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
-
-        if len(exclude_any) > 0:
-            addition_filter += " and not ("
-            for label in exclude_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
-
-    sql = f"""
-        with agg as (
+    warehouse_filter = query_builder.warehouse_filter_sql(bf.warehouse_names)
+
+    # Without label filters the per day hash counts answer the report, labels are only known per query.
+    use_daily = not (include_all or include_any or exclude_any) and has_hash_daily()
+    if use_daily:
+        agg = f"""
+select sum(cost) as cost, sum(costed_queries) as cnt, any_value(query_text) as query, query_parameterized_hash
+from reporting.query_hash_daily where day >= %(start)s and day < %(end)s {warehouse_filter}
+group by query_parameterized_hash
+having sum(costed_queries) > 0 and sum(cost) > 0
+"""
+    else:
+        agg = f"""
 select sum(cost) as cost, count(*) as cnt, any_value(query_text) as query, query_parameterized_hash
 from reporting.labeled_query_history where query_parameterized_hash is not null and cost >0
-        and start_time between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-            OR array_contains(warehouse_name::variant, %(warehouse_names)s))
+        and start_time between %(start)s and %(end)s {warehouse_filter}
         {addition_filter}
 group by query_parameterized_hash
-), buckets as (
+"""
+
+    sql = f"""
+        with agg as ({agg}), buckets as (
 select sum(cost) as cost, sum(cnt) as cnt, width_bucket(log(10, cnt), 0, 7, 7) as bucket from agg group by all
 )
 select cost as "Cost", cnt as "Count", '[' || pow(10,bucket-1) || ', ' || pow(10,bucket) || ')' as "Bucket" from buckets order by "Bucket" desc
@@ -63,7 +49,7 @@ select cost as "Cost", cnt as "Count", '[' || pow(10,bucket-1) || ', ' || pow(10
     def overview():
         df = connection.execute_select(
             sql + " ;",
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
+            {"start": bf.start, "end": bf.end},
         )
 
         labels = list(df.Bucket.values)
@@ -95,32 +81,39 @@ select cost as "Cost", cnt as "Count", '[' || pow(10,bucket-1) || ', ' || pow(10
 
     def top_table():
         val = st.radio(
-            "Top 1000 repeated queries by:",
+            "Repeated queries by:",
             ["Count", "Cost", "Cost per Query"],
         )
-        sql = f"""
-            with raw as (
-            select any_value(query_text) as "Query Text", to_varchar(sum(cost), '999,999.00') as "Cost", count(*) as "Count", to_varchar(sum(cost)/count(*), '999,999.000000') as "Cost per Query"
+        if use_daily:
+            sql = f"""
+            select any_value(query_text) as "Query Text", round(sum(cost), 2) as "Cost", sum(costed_queries) as "Count", round(sum(cost)/nullif(sum(costed_queries), 0), 6) as "Cost per Query",
+                query_parameterized_hash as "Query Hash"
+            from reporting.query_hash_daily where day >= %(start)s and day < %(end)s {warehouse_filter}
+                    group by query_parameterized_hash
+                    having sum(costed_queries) > 0 and sum(cost) > 0 and length("Query Text") > 0
+                    """
+        else:
+            sql = f"""
+            select any_value(query_text) as "Query Text", round(sum(cost), 2) as "Cost", count(*) as "Count", round(sum(cost)/count(*), 6) as "Cost per Query",
+                query_parameterized_hash as "Query Hash"
             from reporting.labeled_query_history where query_parameterized_hash is not null and cost >0
-                and start_time between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-                    OR array_contains(warehouse_name::variant, %(warehouse_names)s))
+                and start_time between %(start)s and %(end)s {warehouse_filter}
                     {addition_filter}
                     group by query_parameterized_hash
-                    order by "{val}" desc
-                    ) select * from raw where length("Query Text") > 0
-                    limit 100
+                    having length("Query Text") > 0
                     """
-        df = connection.execute_select(
-            sql + ";",
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
-        )
         st.markdown(
             """
         Tip: double click on the query text to see the full query.
 
         """
         )
-        st.dataframe(df, use_container_width=True)
+        sthelp.paged_dataframe(
+            "query_hash",
+            sql,
+            {"start": bf.start, "end": bf.end},
+            [f'"{val}"', '"Query Hash"'],
+        )
 
     is_enabled = connection.execute_select(
         """select system$BEHAVIOR_CHANGE_BUNDLE_STATUS('2023_06') = 'ENABLED' and count(*) = 1
@@ -155,3 +148,10 @@ select cost as "Cost", cnt as "Count", '[' || pow(10,bucket-1) || ', ' || pow(10
         )
         overview()
         top_table()
+
+
+def has_hash_daily() -> bool:
+    df = connection.execute_with_cache(
+        "select count(*) > 0 as built from internal.config where key = 'QUERY_HASH_FREQUENCY_BUILT'"
+    )
+    return len(df) > 0 and bool(df["BUILT"][0])
@@ -4,6 +4,8 @@ import streamlit as st
 
 import connection
 import filters
+import query_builder
+from reports_query_activity import has_daily_rollup
 
 
 def report(
@@ -14,50 +16,33 @@ def report(
         "CALL INTERNAL.REPORT_PAGE_VIEW('Query Report Top Spenders')"
     )
 
-    labels = connection.execute_with_cache(
-        "select name from internal.labels where group_name is null"
+    include_all, include_any, exclude_any = query_builder.label_filters(bf)
+    addition_filter = query_builder.label_filter_sql(
+        include_all, include_any, exclude_any
     )
-
-    addition_filter = ""
-
-    if len(labels) > 0:
-        with bf.container:
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                include_all = st.multiselect("Include All", options=labels)
-            with c2:
-                include_any = st.multiselect("Include Any", options=labels)
-            with c3:
-                exclude_any = st.multiselect("Exclude Any", options=labels)
-
-        for label in include_all:
-            addition_filter += f""" and "{label}" """
-
-        if len(include_any) > 0:
-            addition_filter += " and ("
-            for label in include_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
-
-        if len(exclude_any) > 0:
-            addition_filter += " and not ("
-            for label in exclude_any:
-                addition_filter += f""" "{label}" or """
-
-            addition_filter = addition_filter[:-3] + ") "
+    warehouse_filter = query_builder.warehouse_filter_sql(bf.warehouse_names)
 
     def overview():
-        sql = f"""
-        select user_name, sum(cost) as cst, count(1) as queries from reporting.labeled_query_history qh
-        where start_time between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-            OR array_contains(warehouse_name::variant, %(warehouse_names)s))
-        {addition_filter}
-        group by user_name having cst is not null order by cst desc
-        """
-        df = connection.execute_select(
+        if has_daily_rollup():
+            rollup_filter = query_builder.label_filter_sql(
+                include_all, include_any, exclude_any, rollup=True
+            )
+            sql = f"""
+            select user_name, sum(cost) as cst, sum(queries) as queries from reporting.query_history_daily_rollup
+            where day >= %(start)s and day < %(end)s {warehouse_filter}
+            {rollup_filter}
+            group by user_name having cst is not null order by cst desc
+            """
+        else:
+            sql = f"""
+            select user_name, sum(cost) as cst, count(1) as queries from reporting.labeled_query_history qh
+            where start_time between %(start)s and %(end)s {warehouse_filter}
+            {addition_filter}
+            group by user_name having cst is not null order by cst desc
+            """
+        df = connection.execute_select_with_cache(
             sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
+            {"start": bf.start, "end": bf.end},
         )
 
         fig = go.Figure(
@@ -106,13 +91,12 @@ def report(
                     execution_status,
                     qh.unloaded_direct_compute_credits * {cost_per_credit} as COST
                 from reporting.labeled_query_history qh
-                where start_time between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-                    OR array_contains(warehouse_name::variant, %(warehouse_names)s))
+                where start_time between %(start)s and %(end)s {warehouse_filter}
                 {addition_filter}
                 limit 1000
                 """
-        df = connection.execute_select(
+        df = connection.execute_select_with_cache(
             sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
+            {"start": bf.start, "end": bf.end},
         )
         st.dataframe(df, use_container_width=True)
@@ -3,28 +3,25 @@ import streamlit as st
 import filters
 
 import connection
+import query_builder
 
 
 def report(
     bf: filters.BaseFilter,
     cost_per_credit,
 ):
-    def warehouse_stats(container):
+    args = {"start": bf.start, "end": bf.end}
+    warehouse_filter = query_builder.warehouse_filter_sql(bf.warehouse_names)
 
-        sql = f"""
+    stats_sql = f"""
     select date_trunc('{bf.trunc()}', PERIOD) AS DT, SUM(LOADED_CC * {cost_per_credit}) AS COST, IFF(SUM(LOADED_CC) = 0,null, SUM(UNLOADED_CC)/SUM(LOADED_CC)) AS UTILIZATION
     FROM REPORTING.WAREHOUSE_{bf.tbl()}_UTILIZATION
-    where PERIOD between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-        OR array_contains(warehouse_name::variant, %(warehouse_names)s))
+    where PERIOD between %(start)s and %(end)s {warehouse_filter}
     GROUP BY 1
     ;
             """
 
-        df = connection.execute_select(
-            sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
-        )
-
+    def warehouse_stats(container, df):
         with container:
             fig = go.Figure(
                 data=[
@@ -64,23 +61,19 @@ def report(
             st.header("Warehouse Cost and Utilization")
             st.plotly_chart(fig, use_container_width=True)
 
-    def warehouse_durations(container):
-        sql = """
+    # Buckets are precomputed per session, the friendly name is only derived once per bucket.
+    durations_sql = f"""
             select
-                internal.friendly_duration(duration) as duration,
-                internal.friendly_duration_ordinal(duration) as ord,
+                internal.friendly_duration(min(duration)) as duration,
+                duration_ord as ord,
                 count(1) as cnt
-            from REPORTING.WAREHOUSE_SESSIONS
-            where st between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-                OR array_contains(warehouse_name::variant, %(warehouse_names)s))
-            group by 1, ord
+            from REPORTING.WAREHOUSE_SESSION_STATS
+            where st between %(start)s and %(end)s {warehouse_filter}
+            group by ord
             order by ord asc
             """
-        df = connection.execute_select(
-            sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
-        )
 
+    def warehouse_durations(container, df):
         with container:
             fig = go.Figure(
                 data=[
@@ -96,33 +89,18 @@ def report(
             st.header("Warehouse Running Duration")
             st.plotly_chart(fig, use_container_width=True)
 
-    def warehouse_sleeps(container):
-        sql = """
-    with durations AS (
-    SELECT
-      warehouse_id,
-      warehouse_name,
-      st,
-      datediff('seconds', LAG(st) OVER (PARTITION BY warehouse_id ORDER BY st), st)  AS duration
-    FROM
-      reporting.warehouse_sessions
-    )
+    sleeps_sql = f"""
     select
-        internal.friendly_duration(duration*1000) as duration,
-        internal.friendly_duration_ordinal(duration*1000) as ord,
+        internal.friendly_duration(min(gap)) as duration,
+        gap_ord as ord,
         count(1) as cnt
-    from durations
-        where st between %(start)s and %(end)s
-            and (array_size(%(warehouse_names)s) = 0
-            OR array_contains(warehouse_name::variant, %(warehouse_names)s))
-    group by 1, ord
+    from reporting.warehouse_session_stats
+        where st between %(start)s and %(end)s {warehouse_filter}
+    group by ord
     order by ord asc
             """
-        df = connection.execute_select(
-            sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
-        )
 
+    def warehouse_sleeps(container, df):
         with container:
             fig = go.Figure(
                 data=[
@@ -138,19 +116,14 @@ def report(
             st.header("Warehouse Sleeping Duration")
             st.plotly_chart(fig, use_container_width=True)
 
-    def warehouse_users(container):
-        sql = """
+    users_sql = f"""
             select warehouse_name, st_period, count(distinct user_name) cnt
             from reporting.enriched_query_history_daily
-            where st_period between %(start)s and %(end)s and (array_size(%(warehouse_names)s) = 0
-                OR array_contains(warehouse_name::variant, %(warehouse_names)s))
+            where st_period between %(start)s and %(end)s {warehouse_filter}
             group by warehouse_id, warehouse_name, st_period;
             """
 
-        df = connection.execute(
-            sql,
-            {"start": bf.start, "end": bf.end, "warehouse_names": bf.warehouse_names},
-        )
+    def warehouse_users(container, df):
         fig = go.Figure()
 
         # Get the unique names of the warehouses
@@ -176,13 +149,24 @@ def report(
             hovermode="x",
         )
 
-        st.plotly_chart(fig, use_container_width=True)
+        with container:
+            st.plotly_chart(fig, use_container_width=True)
 
     _ = connection.execute("CALL INTERNAL.REPORT_PAGE_VIEW('Warehouse Activity')")
 
-    warehouse_stats(st.empty())
+    stats_container = st.empty()
     cols = st.columns(2)
     with cols[0]:
-        warehouse_durations(st.empty())
+        durations_container = st.empty()
     with cols[1]:
-        warehouse_sleeps(st.empty())
+        sleeps_container = st.empty()
+
+    connection.render_panels(
+        [
+            connection.Panel(stats_container, warehouse_stats, stats_sql, args),
+            connection.Panel(
+                durations_container, warehouse_durations, durations_sql, args
+            ),
+            connection.Panel(sleeps_container, warehouse_sleeps, sleeps_sql, args),
+        ]
+    )
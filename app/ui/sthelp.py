@@ -1,9 +1,12 @@
 import os
 import base64
+import datetime
 import plotly.graph_objects as go
 import streamlit as st
 import urllib.parse
 
+import connection
+
 # Show a streamlit image without using st.image (since it is disabled)
 # Uses plotly and writes a png to the background.
 def image_png(file):
@@ -121,3 +124,53 @@ def chrome(name: str = None):
             # st.title('Sundeck OpsCenter')
             image_svg("opscenter_logo.svg")
             pass
+
+
+# Show a query one page at a time. The pager is kept in the session so that paging doesn't re-run the query from the
+# first row, and it is replaced whenever the query or its arguments change.
+def paged_dataframe(
+    name: str,
+    sql: str,
+    args: dict,
+    keys: list,
+    page_size: int = 100,
+    seek_label: str = None,
+):
+    state_key = f"pager_{name}"
+    bound = connection.Connection.bind(sql, args)
+    entry = st.session_state.get(state_key)
+    if entry is None or entry[0] != bound:
+        entry = (bound, connection.pager(sql, args, keys, page_size))
+        st.session_state[state_key] = entry
+    pager = entry[1]
+
+    if seek_label is not None:
+        cols = st.columns([3, 1])
+        day = cols[0].date_input(
+            seek_label, value=datetime.date.today(), key=f"{state_key}_seek"
+        )
+        cols[1].button(
+            "Jump",
+            key=f"{state_key}_jump",
+            on_click=lambda: pager.seek(
+                datetime.datetime.combine(day, datetime.time.max)
+            ),
+        )
+
+    df = pager.current()
+    st.dataframe(df, use_container_width=True)
+
+    cols = st.columns([1, 1, 6])
+    cols[0].button(
+        "Previous",
+        key=f"{state_key}_prev",
+        disabled=not pager.has_prev(),
+        on_click=pager.prev,
+    )
+    cols[1].button(
+        "Next",
+        key=f"{state_key}_next",
+        disabled=not pager.has_next,
+        on_click=pager.next,
+    )
+    cols[2].caption(f"Page {len(pager.history) + 1}")
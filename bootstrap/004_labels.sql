@@ -3,6 +3,19 @@ CREATE TABLE INTERNAL.LABELS if not exists (name string, group_name string null,
 
 CREATE TABLE INTERNAL.PREDEFINED_LABELS if not exists (name string, group_name string null, group_rank number, label_created_at timestamp, condition string, enabled boolean, label_modified_at timestamp, is_dynamic boolean);
 
+-- The SQL a label condition is evaluated as. Conditions run over one query at a time, so table references and QLike
+-- calls are resolved against the query's own database and schema, which is also what query_tables and the QLike cache
+-- are keyed on.
+CREATE OR REPLACE FUNCTION INTERNAL.LABEL_CONDITION_SQL(condition string)
+    RETURNS STRING
+AS
+$$
+    regexp_replace(
+        regexp_replace(condition, 'tools\\.tables_contains\\s*\\(\\s*query_text\\s*,', 'tools.tables_contains(query_text, database_name, schema_name,', 1, 0, 'i'),
+        'tools\\.qlike\\s*\\(\\s*query_text\\s*,\\s*(\'([^\']|\'\')*\')\\s*(,\\s*\'([^\']|\'\')*\'\\s*)?\\)',
+        'tools.qlike(query_text, \\1\\3, database_name, schema_name)', 1, 0, 'i')
+$$;
+
 CREATE OR REPLACE PROCEDURE INTERNAL.MIGRATE_LABELS_TABLE()
 RETURNS OBJECT
 AS
@@ -73,6 +86,84 @@ EXCEPTION
 END;
 $$;
 
+-- Estimates what a candidate label condition would match over the last `days` days without scanning all of them. The
+-- condition is evaluated over a Bernoulli sample of the queries, so the sampled counts and costs scale up by the sampling
+-- rate and come with approximate 95% bounds. The sample is capped at a fixed number of rows, whatever the length of the
+-- window, to keep the preview interactive. The cap is applied to the number of queries in the daily rollup (or, before it
+-- is built, in all of the materialized history), so the window is never counted row by row; the total is estimated from
+-- the sample as well. Dynamic conditions match the queries for which they are not null.
+CREATE OR REPLACE PROCEDURE INTERNAL.PREVIEW_LABEL(condition string, is_dynamic boolean, days number, sample_percent float)
+RETURNS OBJECT
+AS
+$$
+BEGIN
+    let invalid string;
+    call internal.validate_label_condition(:condition, :is_dynamic) into :invalid;
+    if (invalid is not null) then
+        return object_construct('error', invalid);
+    end if;
+
+    let max_rows number := 200000;
+    let since timestamp_ltz := dateadd(day, -1 * :days, current_timestamp());
+    let total number := (select sum(queries) from internal_reporting_mv.query_history_daily_rollup where day >= date_trunc('day', :since));
+    if (total is null) then
+        total := (select any_value(row_count) from information_schema.tables
+            where table_schema = 'INTERNAL_REPORTING_MV' and table_name = 'QUERY_HISTORY_COMPLETE_AND_DAILY');
+    end if;
+    let pct number(12, 6) := greatest(least(:sample_percent, 100, 100 * :max_rows / greatest(:total, 1)), 0.000001);
+    let q float := pct / 100;
+
+    let condition_sql string := (select internal.label_condition_sql(:condition));
+    let matched string := iff(is_dynamic, '(' || condition_sql || ') is not null', 'case when \n' || condition_sql || '\n then true else false end');
+    -- query_parameterized_hash only exists once the 2023_06 bundle is enabled.
+    let query_hash_enabled boolean := (select system$BEHAVIOR_CHANGE_BUNDLE_STATUS('2023_06') = 'ENABLED');
+    let key_expr string := iff(query_hash_enabled, 'coalesce(query_parameterized_hash, hash(query_text)::varchar)', 'hash(query_text)::varchar');
+
+    execute immediate 'with sampled as (
+            -- Rows are sampled before the condition is evaluated, so it only runs over the sample.
+            select ' || key_expr || ' as query_hash, query_text, coalesce(cost, 0) as cost, ' || matched || ' as matched
+            from reporting.enriched_query_history sample bernoulli (' || pct::string || ')
+            where start_time >= ?
+        ), top_hashes as (
+            select query_hash, any_value(left(query_text, 200)) as query_text, count(*) / ? as matches, sum(cost) / ? as cost
+            from sampled where matched
+            group by query_hash
+            order by cost desc, matches desc
+            limit 10
+        )
+        select
+            count(*) as sampled,
+            count_if(matched) as matches,
+            sum(iff(matched, cost, 0)) as cost,
+            sum(iff(matched, cost * cost, 0)) as cost_squares,
+            (select array_agg(object_construct(\'query_hash\', query_hash, \'query_text\', query_text, \'matches\', matches, \'cost\', cost))
+                within group (order by cost desc, matches desc) from top_hashes) as top_hashes
+        from sampled' using (since, q, q);
+
+    -- Horvitz-Thompson estimates of the matched totals (the top hashes are already scaled). The variance of a Bernoulli
+    -- sample with rate q is estimated by (1 - q) / q^2 times the sum of the squared sampled values.
+    let result object := (
+        select object_construct(
+            'total_queries', round(sampled / :q),
+            'sample_percent', :pct,
+            'sampled_queries', sampled,
+            'match_rate', p,
+            'match_rate_low', greatest(0, p - 1.96 * sqrt(p * (1 - p) / nullif(sampled, 0))),
+            'match_rate_high', least(1, p + 1.96 * sqrt(p * (1 - p) / nullif(sampled, 0))),
+            'matches', matches / :q,
+            'matched_cost', cost / :q,
+            'matched_cost_low', greatest(0, cost / :q - 1.96 * sqrt((1 - :q) * cost_squares) / :q),
+            'matched_cost_high', cost / :q + 1.96 * sqrt((1 - :q) * cost_squares) / :q,
+            'top_hashes', coalesce(top_hashes, array_construct()))
+        from (select *, matches / nullif(sampled, 0) as p from TABLE(RESULT_SCAN(LAST_QUERY_ID()))));
+    return result;
+EXCEPTION
+    WHEN OTHER THEN
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while previewing a label.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
+$$;
+
 DROP PROCEDURE IF EXISTS INTERNAL.VALIDATE_LABEL_Name(string);
 
 -- Verify label name as quoted identifier is not same as any column name in view reporting.enriched_query_history.
@@ -95,32 +186,89 @@ EXCEPTION
         return 'Failure validating name. Please check your syntax.' || :SQLERRM;
 END;
 
+-- Labels (and label groups) whose values are held in the materialized label store, along with the definition they
+-- were computed from.
+CREATE TABLE INTERNAL.MATERIALIZED_LABELS if not exists (name string, is_group boolean, definition string, materialized_at timestamp);
+
+-- A fingerprint of every ungrouped label and every label group, used to tell whether values stored for them
+-- (e.g. in the materialized label store) were computed from the current definition.
+CREATE OR REPLACE VIEW INTERNAL.LABEL_DEFINITIONS AS
+    select name, false as is_group, hash(condition)::string as definition
+    from internal.labels where group_name is null
+    union all
+    select group_name as name, true as is_group, hash_agg(name, group_rank, condition, is_dynamic)::string as definition
+    from internal.labels where group_name is not null group by group_name;
+
+-- Expressions over the label columns of REPORTING.LABELED_QUERY_HISTORY that collapse them into an array of the
+-- matching ungrouped label names and an object of group name to grouped label value.
+CREATE OR REPLACE PROCEDURE INTERNAL.LABEL_EXPRESSIONS()
+RETURNS OBJECT
+AS
+BEGIN
+    let label_columns string := (
+        select coalesce(listagg(', "' || name || '"', ''), '') from internal.labels where group_name is null);
+    let group_columns string := (
+        select coalesce(listagg(distinct ', "' || group_name || '"', ''), '') from internal.labels where group_name is not null);
+    let labels_expr string := (
+        select 'array_construct_compact(' || coalesce(listagg('iff("' || name || '", \'' || replace(name, '\'', '\\\'') || '\', null)', ', '), '') || ')'
+        from internal.labels where group_name is null);
+    let groups_expr string := (
+        select 'object_construct(' || coalesce(listagg(distinct '\'' || replace(group_name, '\'', '\\\'') || '\', "' || group_name || '"', ', '), '') || ')'
+        from internal.labels where group_name is not null);
+    return object_construct('label_columns', label_columns, 'group_columns', group_columns, 'labels', labels_expr, 'groups', groups_expr);
+END;
+
 CREATE OR REPLACE PROCEDURE INTERNAL.UPDATE_LABEL_VIEW()
 RETURNS boolean
 AS
 BEGIN
-    let labels cursor for select name, condition from internal.labels where group_name is null;
+    -- Labels (and groups) whose values are in the label store are read from it, anything else (including queries that
+    -- are not in the store yet) is evaluated from the condition.
+    let store_enabled boolean := (select count(*) > 0 from internal.config where key = 'LABEL_STORE_ENABLED' and value = 'true');
+    let labels cursor for
+        select l.name, internal.label_condition_sql(l.condition) as condition, m.name is not null as materialized
+        from internal.labels l
+        left outer join internal.label_definitions d on d.name = l.name and not d.is_group
+        left outer join internal.materialized_labels m on m.name = d.name and not m.is_group and m.definition = d.definition
+        where l.group_name is null;
     let s string := $$
 CREATE OR REPLACE VIEW REPORTING.LABELED_QUERY_HISTORY
 COPY GRANTS
 AS
-SELECT *,$$;
+SELECT qh.*,$$;
     for label in labels do
-         s := s || '\n\tcase when ' || label.condition || ' then true else false end as "' || label.name || '",';
+        if (store_enabled and label.materialized) then
+            s := s || '\n\tiff(lq_query_id is null, case when ' || label.condition || ' then true else false end, array_contains(\'' || replace(label.name, '\'', '\\\'') || '\'::variant, lq_labels)) as "' || label.name || '",';
+        else
+            s := s || '\n\tcase when ' || label.condition || ' then true else false end as "' || label.name || '",';
+        end if;
     end for;
 
     let grouped_labels cursor for
-        select group_name, name, condition from internal.labels
-        where group_name is not null and NOT is_dynamic
-        order by group_name, group_rank;
+        select l.group_name, l.name, internal.label_condition_sql(l.condition) as condition, m.name is not null as materialized
+        from internal.labels l
+        left outer join internal.label_definitions d on d.name = l.group_name and d.is_group
+        left outer join internal.materialized_labels m on m.name = d.name and m.is_group and m.definition = d.definition
+        where l.group_name is not null and NOT l.is_dynamic
+        order by l.group_name, l.group_rank;
     let group_name string := null;
+    let group_materialized boolean := false;
     for grp in grouped_labels do
         if (grp.group_name <> group_name or group_name is null) then
             if (group_name is not null) then
-                s := s || ' end as "'|| group_name || '", ';
+                s := s || $$ else 'Other' end$$;
+                if (group_materialized) then
+                    s := s || ', lq_label_groups[\'' || replace(group_name, '\'', '\\\'') || '\']::string)';
+                end if;
+                s := s || ' as "'|| group_name || '", ';
             end if;
 
-            s := s || '\n\tcase ';
+            group_materialized := store_enabled and grp.materialized;
+            if (group_materialized) then
+                s := s || '\n\tiff(lq_query_id is null, case ';
+            else
+                s := s || '\n\tcase ';
+            end if;
         end if;
 
         s := s || ' when ' || grp.condition || $$ then '$$ || grp.name || $$' $$;
@@ -128,17 +276,31 @@ SELECT *,$$;
     end for;
 
     if (group_name is not null) then
-        s := s || $$ else 'Other' end as "$$ || group_name || '", ';
+        s := s || $$ else 'Other' end$$;
+        if (group_materialized) then
+            s := s || ', lq_label_groups[\'' || replace(group_name, '\'', '\\\'') || '\']::string)';
+        end if;
+        s := s || ' as "' || group_name || '", ';
     end if;
 
     let dynamic_groups cursor for
-        select group_name, condition from internal.labels
-        where is_dynamic;
+        select l.group_name, internal.label_condition_sql(l.condition) as condition, m.name is not null as materialized
+        from internal.labels l
+        left outer join internal.label_definitions d on d.name = l.group_name and d.is_group
+        left outer join internal.materialized_labels m on m.name = d.name and m.is_group and m.definition = d.definition
+        where l.is_dynamic;
     for dgrp in dynamic_groups do
-        s := s || '\n\tiff( ' || dgrp.condition || ' is not null, ' || dgrp.condition || ', \'Other\')  as "' || dgrp.group_name || '",';
+        if (store_enabled and dgrp.materialized) then
+            s := s || '\n\tiff(lq_query_id is null, iff( ' || dgrp.condition || ' is not null, ' || dgrp.condition || ', \'Other\'), lq_label_groups[\'' || replace(dgrp.group_name, '\'', '\\\'') || '\']::string) as "' || dgrp.group_name || '",';
+        else
+            s := s || '\n\tiff( ' || dgrp.condition || ' is not null, ' || dgrp.condition || ', \'Other\')  as "' || dgrp.group_name || '",';
+        end if;
     end for;
 
-    s := s || '\n\t1 as not_used_internal\nFROM REPORTING.ENRICHED_QUERY_HISTORY';
+    s := s || '\n\t1 as not_used_internal\nFROM REPORTING.ENRICHED_QUERY_HISTORY qh';
+    if (store_enabled) then
+        s := s || '\nLEFT OUTER JOIN (SELECT query_id as lq_query_id, labels as lq_labels, label_groups as lq_label_groups FROM INTERNAL_REPORTING_MV.LABELED_QUERIES) lq ON lq.lq_query_id = qh.query_id';
+    end if;
     SYSTEM$LOG_INFO('Updating label definitions. Updated SQL: \n' || s);
     --return s;
     execute immediate s;
@@ -211,6 +373,9 @@ BEGIN
 
     COMMIT;
     CALL INTERNAL.UPDATE_LABEL_VIEW();
+    if (outcome is null) then
+        CALL INTERNAL.START_LABEL_BACKFILL();
+    end if;
     return outcome;
 
 END;
@@ -347,6 +512,9 @@ BEGIN
 
     COMMIT;
     CALL INTERNAL.UPDATE_LABEL_VIEW();
+    if (outcome is null) then
+        CALL INTERNAL.START_LABEL_BACKFILL();
+    end if;
     return outcome;
 EXCEPTION
   WHEN OTHER THEN
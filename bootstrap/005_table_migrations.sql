@@ -115,3 +115,45 @@ begin
   return :inserted;
 end;
 $$;
+
+CREATE OR REPLACE PROCEDURE internal.migrate_clustering_if_necessary(table_schema STRING, table_name STRING, cluster_by STRING)
+    RETURNS STRING
+    LANGUAGE SQL
+    COMMENT = 'Sets the clustering key of a materialized table to the given comma separated expressions unless the table is already clustered by them.'
+    AS
+BEGIN
+  let current_key string := (SELECT any_value(CLUSTERING_KEY) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = :table_schema AND TABLE_NAME = :table_name);
+  -- Snowflake reports the key as LINEAR(<expressions>), upper cased.
+  if (current_key is not null and upper(replace(current_key, ' ', '')) = 'LINEAR(' || upper(replace(cluster_by, ' ', '')) || ')') then
+    RETURN null;
+  end if;
+
+  let alter_statement string := 'ALTER TABLE "' || :table_schema || '"."' || :table_name || '" CLUSTER BY (' || :cluster_by || ')';
+  execute immediate alter_statement;
+  SYSTEM$LOG_INFO('Clustering updated for ' || :table_schema || '.' || :table_name);
+  SYSTEM$ADD_EVENT('table clustered', {'alter_statement': alter_statement});
+  RETURN alter_statement;
+END;
+
+CREATE OR REPLACE PROCEDURE internal.schema_fingerprint(source STRING)
+    RETURNS STRING
+    LANGUAGE SQL
+    COMMENT = 'Hashes everything the migration of the QUERY_HISTORY or WAREHOUSE_EVENTS materialized tables depends on: the columns of the account usage view, of the complete and daily view and of the materialized tables, the label definitions and the app version.'
+    AS
+BEGIN
+  let prefix string := iff(source = 'QUERY_HISTORY', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY');
+  let account_usage_view string := iff(source = 'QUERY_HISTORY', 'QUERY_HISTORY', 'WAREHOUSE_EVENTS_HISTORY');
+  let columns_hash string := (
+      SELECT hash_agg(TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE)::string
+      FROM INFORMATION_SCHEMA.COLUMNS
+      WHERE (TABLE_SCHEMA = 'ACCOUNT_USAGE' AND TABLE_NAME = :account_usage_view)
+         OR (TABLE_SCHEMA = 'INTERNAL_REPORTING' AND TABLE_NAME = :prefix)
+         OR (TABLE_SCHEMA = 'INTERNAL_REPORTING_MV' AND TABLE_NAME IN (:prefix, :prefix || '_INCOMPLETE'))
+      );
+  let labels_hash string := '';
+  if (source = 'QUERY_HISTORY') then
+    labels_hash := (select internal.label_definitions_hash());
+  end if;
+  let version string := (select internal.get_version());
+  RETURN columns_hash || '-' || labels_hash || '-' || version;
+END;
@@ -7,6 +7,12 @@ CREATE TABLE INTERNAL.PREDEFINED_PROBES if not exists (name string, condition st
 CREATE TABLE INTERNAL.PROBE_ACTIONS (action_time timestamp, probe_name string, query_id string, actions_taken variant, outcome string) IF NOT EXISTS;
 CREATE OR REPLACE VIEW REPORTING.PROBE_ACTIONS AS SELECT * FROM INTERNAL.PROBE_ACTIONS;
 
+-- The (probe, query) pairs which were actioned and whose query may still be evaluated by a future tick, i.e. queries that
+-- are running or ended after the probe watermark. Kept small so that de-duplication doesn't scan all of PROBE_ACTIONS.
+-- query_end_time is null while the query is running.
+CREATE TABLE INTERNAL.PROBE_RECENT_ACTIONS IF NOT EXISTS (probe_name string, query_id string, action_time timestamp_ltz, query_end_time timestamp_ltz);
+ALTER TABLE INTERNAL.PROBE_RECENT_ACTIONS ADD COLUMN IF NOT EXISTS query_end_time timestamp_ltz;
+
 CREATE OR REPLACE PROCEDURE INTERNAL.MIGRATE_PROBES_TABLE()
 RETURNS OBJECT
 AS
@@ -88,6 +94,45 @@ EXCEPTION
 END;
 
 
+-- Evaluates probe conditions against the materialized query history between start_time and end_time. `probes` is an
+-- array of objects with a name and a condition. All probes are evaluated in a single pass, and each is counted on its
+-- own since a query may match several of them. Cancelling is assumed to take effect detection_seconds after the
+-- query started, so the estimated savings are the credits the query used after that.
+CREATE OR REPLACE PROCEDURE INTERNAL.BACKTEST_PROBES(probes array, start_time timestamp_ltz, end_time timestamp_ltz, detection_seconds number)
+RETURNS TABLE (name string, queries number, matches number, matched_credits float, matched_cost float, saved_credits float, saved_cost float)
+AS
+BEGIN
+    let columns string := '';
+    let results string := '';
+    for i in 0 to array_size(probes) - 1 do
+        let name string := probes[i]:name::string;
+        let condition string := probes[i]:condition::string;
+        let p string := 'p' || i;
+        -- The share of the query which would have run after it was cancelled.
+        let saved string := 'greatest(total_elapsed_time - ' || (detection_seconds * 1000) || ', 0) / nullif(total_elapsed_time, 0)';
+        columns := columns || ',\n coalesce(' || condition || ', false) as ' || p;
+        results := results || iff(i > 0, ', ', '') || 'object_construct(\'name\', \'' || replace(name, '\'', '\\\'') || '\''
+            || ', \'matches\', count_if(' || p || ')'
+            || ', \'matched_credits\', sum(iff(' || p || ', unloaded_direct_compute_credits, 0))'
+            || ', \'matched_cost\', sum(iff(' || p || ', cost, 0))'
+            || ', \'saved_credits\', sum(iff(' || p || ', unloaded_direct_compute_credits * ' || saved || ', 0))'
+            || ', \'saved_cost\', sum(iff(' || p || ', cost * ' || saved || ', 0)))';
+    end for;
+
+    let stmt string := 'with matches as (
+            select unloaded_direct_compute_credits, cost, total_elapsed_time' || columns || '
+            from reporting.enriched_query_history
+            where start_time >= ? and start_time < ?
+        ), totals as (
+            select count(*) as queries, array_construct(' || results || ') as results from matches
+        )
+        select r.value:name::string, queries, r.value:matches::number, zeroifnull(r.value:matched_credits::float), zeroifnull(r.value:matched_cost::float),
+            zeroifnull(r.value:saved_credits::float), zeroifnull(r.value:saved_cost::float)
+        from totals, lateral flatten(input => results) r';
+    let res resultset := (execute immediate :stmt using (start_time, end_time));
+    return table(res);
+END;
+
 CREATE OR REPLACE PROCEDURE ADMIN.UPDATE_PROBE_MONITOR_RUNNING()
     RETURNS string
     LANGUAGE SQL
@@ -129,36 +174,54 @@ LANGUAGE JAVASCRIPT
 AS 'return Object.assign(O1, O2);'
 ;
 
-CREATE OR REPLACE PROCEDURE INTERNAL.GET_PROBE_SELECT()
+-- The compiled probe select is cached here along with the fingerprint of the probe definitions it was compiled from.
+CREATE TABLE INTERNAL.PROBE_PLAN IF NOT EXISTS (fingerprint string, plan string, compiled_at timestamp);
+
+CREATE OR REPLACE FUNCTION INTERNAL.PROBE_DEFINITIONS_HASH()
+    RETURNS STRING
+AS
+$$
+    (select hash_agg(name, condition, notify_writer, notify_writer_method, notify_other, notify_other_method, cancel)::string from internal.probes)
+$$;
+
+-- Builds the select which evaluates every probe against the queries since the watermark (bound as the only parameter).
+-- The actions of each probe are inlined into the select so that probes are only read when compiling. Queries which
+-- were already actioned are returned with actioned set, so that the caller can track when they end.
+CREATE OR REPLACE PROCEDURE INTERNAL.COMPILE_PROBE_PLAN()
 RETURNS string
 AS
 BEGIN
-    -- TODO: find a way to improve this so we're not double querying probes.
-    -- We do it here so we don't have to transport objects from queries to sql text but it means
-    -- there is a slight chance of seeing different actions for the probe between the first step and the second.
-    let s string := $$
+    let fingerprint string := (select internal.probe_definitions_hash());
+    let cases string := (
+        select coalesce(listagg('\n\t when ' || condition || ' then \'' || replace(name, '\'', '\\\'') || '\' ', '') within group (order by name), '')
+        from internal.probes);
+    if (length(cases) = 0) then
+        cases := '\n\t when true then null::text ';
+    end if;
+    let definitions string := (
+        select replace(replace(to_json(coalesce(array_agg(object_construct(
+                'name', name, 'notify_writer', notify_writer, 'notify_writer_method', notify_writer_method,
+                'notify_other', notify_other, 'notify_other_method', notify_other_method, 'cancel', cancel)), array_construct())),
+            '\\', '\\\\'), '\'', '\\\'')
+        from internal.probes where cancel or notify_writer or length(notify_other) > 3);
+
+    let plan string := $$
     with
     users as (
         select name, email from internal.sfusers
     ),
     probes as (
-        select * from internal.probes where cancel or notify_writer or length(notify_other) > 3
+        select value:name::string as name, value:notify_writer::boolean as notify_writer, value:notify_writer_method::string as notify_writer_method,
+            value:notify_other::string as notify_other, value:notify_other_method::string as notify_other_method, value:cancel::boolean as cancel
+        from table(flatten(parse_json('$$ || definitions || $$')))
     ),
     actions as (
-    SELECT current_timestamp() as probe_time, query_id, user_name, query_text, warehouse_name, start_time, case $$;
-    let found boolean := false;
-    let probes cursor for select name, condition from internal.probes;
-    for probe in probes do
-        found := true;
-        s := s || '\n\t when ' || probe.condition || $$ then '$$ || probe.name || $$' $$;
-    end for;
-
-    if (not found) then
-        s := s || '\n\t when true then null::text ';
-    end if;
-    s := s || $$
+    SELECT current_timestamp() as probe_time, query_id, user_name, query_text, warehouse_name, start_time,
+        iff(execution_status in ('RUNNING', 'QUEUED', 'BLOCKED', 'RESUMING_WAREHOUSE'), null, end_time) as end_time,
+        case $$ || cases || $$
     else null end as probe_to_execute
-    from table(SNOWFLAKE.INFORMATION_SCHEMA.QUERY_HISTORY(CURRENT_TIMESTAMP()))
+    -- Only queries which are still running or ended since the previous tick (the watermark is bound by the caller).
+    from table(SNOWFLAKE.INFORMATION_SCHEMA.QUERY_HISTORY(END_TIME_RANGE_START => ?::timestamp_ltz, RESULT_LIMIT => 10000))
     where session_id <> current_session()
     ),
     items as (
@@ -171,16 +234,278 @@ BEGIN
         a.user_name,
         a.warehouse_name,
         a.start_time,
+        a.end_time,
         a.query_text
     from actions a
     join probes p on a.probe_to_execute = p.name
     left join users u on a.user_name = u.name
     where probe_to_execute is not null
-    and (probe_to_execute, query_id) not in (select probe_name, query_id from internal.probe_actions)
+    and not exists (select 1 from internal.probe_recent_actions r where r.probe_name = a.probe_to_execute and r.query_id = a.query_id)
     )
-    select probe_time, probe_name, query_id, action_taken, user_name, warehouse_name, start_time, query_text from items
+    select probe_time, probe_name, query_id, action_taken, user_name, warehouse_name, start_time, end_time, query_text, false as actioned from items
+    union all
+    select a.probe_time, r.probe_name, a.query_id, null, a.user_name, a.warehouse_name, a.start_time, a.end_time, a.query_text, true as actioned
+    from actions a
+    join internal.probe_recent_actions r on r.query_id = a.query_id
     $$;
-    return s;
+
+    delete from internal.probe_plan;
+    insert into internal.probe_plan select :fingerprint, :plan, current_timestamp();
+    return plan;
+END;
+
+-- Returns the cached probe select. Probes changed outside of the ADMIN procedures (e.g. by merging the predefined
+-- probes) are caught by the fingerprint.
+CREATE OR REPLACE PROCEDURE INTERNAL.GET_PROBE_SELECT()
+RETURNS string
+AS
+BEGIN
+    let plan string := (select any_value(plan) from internal.probe_plan where fingerprint = internal.probe_definitions_hash());
+    if (plan is null) then
+        call internal.compile_probe_plan() into :plan;
+    end if;
+    return plan;
+END;
+
+CREATE TABLE INTERNAL.TASK_PROBE_MONITORING IF NOT EXISTS (run timestamp, success boolean, input variant, output variant);
+
+-- One tick of the probe monitor. Matches are handled as a batch: all cancels are issued by one statement, every
+-- recipient gets a single notification listing all of their matched queries and the actions are recorded with one
+-- insert. The time spent in each step is recorded in TASK_PROBE_MONITORING.
+CREATE OR REPLACE PROCEDURE INTERNAL.RUN_PROBE_MONITOR()
+RETURNS OBJECT
+AS
+BEGIN
+    let tick_start timestamp_ltz := current_timestamp();
+    let watermark timestamp_ltz;
+    let output object := object_construct();
+    BEGIN
+        -- The time since the previous tick, i.e. how often probes are evaluated. A query which ended in between is
+        -- only noticed by this tick.
+        let previous_tick string := (CALL INTERNAL.get_config('PROBE_WATERMARK'));
+        CALL INTERNAL.GET_PROBE_WATERMARK() into :watermark;
+        let sql string;
+        CALL INTERNAL.GET_PROBE_SELECT() into :sql;
+        execute immediate sql using (watermark);
+        let evaluated string := (select last_query_id());
+        -- Queries which were already actioned are only returned to learn when they ended.
+        update internal.probe_recent_actions r set query_end_time = e.end_time
+            from (select query_id, max(end_time) as end_time from TABLE(RESULT_SCAN(:evaluated)) where actioned group by query_id) e
+            where r.query_id = e.query_id and e.end_time is not null;
+        select * from TABLE(RESULT_SCAN(:evaluated)) where not actioned;
+        let matches string := (select last_query_id());
+        let matched number := (select count(*) from TABLE(RESULT_SCAN(:matches)));
+        output := object_construct('watermark', :watermark, 'matched', :matched, 'select_ms', datediff('millisecond', :tick_start, current_timestamp()),
+            'tick_interval_ms', datediff('millisecond', :previous_tick::timestamp_ltz, :tick_start));
+
+        if (matched > 0) then
+            -- How long the matched queries had been running before this tick noticed them.
+            select max(latency), approx_percentile(latency, 0.95)
+                from (select datediff('millisecond', start_time, :tick_start) as latency from TABLE(RESULT_SCAN(:matches)));
+            let latency string := (select last_query_id());
+            output := object_insert(output, 'detection_latency_ms', (select $1 from TABLE(RESULT_SCAN(:latency))));
+            output := object_insert(output, 'detection_latency_p95_ms', (select $2 from TABLE(RESULT_SCAN(:latency))));
+            -- Cancel every matched query that asked for it in one statement. SYSTEM$CANCEL_QUERY reports queries it can't
+            -- cancel in its result, so the statement only fails as a whole. Only then is each query cancelled on its own
+            -- to tell which ones failed.
+            let step_start timestamp_ltz := current_timestamp();
+            let cancels string;
+            BEGIN
+                select query_id, SYSTEM$CANCEL_QUERY(query_id) as outcome from TABLE(RESULT_SCAN(:matches)) where action_taken:CANCEL::boolean;
+                cancels := (select last_query_id());
+            EXCEPTION
+                WHEN OTHER THEN
+                    let cancel_outcomes array := array_construct();
+                    let to_cancel cursor for select distinct query_id from TABLE(RESULT_SCAN(?)) where action_taken:CANCEL::boolean;
+                    open to_cancel using (matches);
+                    for c in to_cancel do
+                        let cancel_id string := c.query_id;
+                        let outcome string;
+                        BEGIN
+                            outcome := (select SYSTEM$CANCEL_QUERY(:cancel_id));
+                        EXCEPTION
+                            WHEN OTHER THEN
+                                outcome := SQLERRM;
+                        END;
+                        cancel_outcomes := array_append(cancel_outcomes, object_construct('query_id', cancel_id, 'outcome', outcome));
+                    end for;
+                    let cancel_json string := to_json(cancel_outcomes);
+                    select value:query_id::string as query_id, value:outcome::string as outcome from table(flatten(input => parse_json(:cancel_json)));
+                    cancels := (select last_query_id());
+            END;
+            output := object_insert(output, 'cancelled', (select count(*) from TABLE(RESULT_SCAN(:cancels))));
+            output := object_insert(output, 'cancel_ms', datediff('millisecond', :step_start, current_timestamp()));
+
+            -- One message per recipient, covering every query matched for them in this tick.
+            step_start := current_timestamp();
+            let email_template string := '
+                Probe: {probe_name}\n
+                Query Id: {query_id}\n
+                Query User: {user_name}\n
+                Warehouse Name: {warehouse_name}\n
+                Start Time: {start_time}\n
+                Query Text: \n{query_text}
+            ';
+            let slack_template string := '
+Probe: {probe_name}\n
+Query Id: {bt}{query_id}{bt}\n
+Query User: {user_name}\n
+Warehouse Name: {bt}{warehouse_name}{bt}\n
+Start Time: {bt}{start_time}{bt}\n
+Query Text: {bt}{bt}{bt}{query_text}{bt}{bt}{bt}
+            ';
+            let notifications string;
+            let messages string;
+            select method, receiver, array_agg(query_id) as query_ids,
+                iff(count(*) = 1, 'Sundeck OpsCenter probe [' || any_value(probe_name) || '] matched query.',
+                    'Sundeck OpsCenter probes matched ' || count(*) || ' queries.') as subject,
+                iff(method = 'slack', subject || '\n', '') || listagg(tools.templatejs(iff(method = 'slack', :slack_template, :email_template),
+                    object_construct('bt', CHAR(UNICODE('\u0060')), 'query_id', query_id, 'query_text', query_text, 'user_name', user_name,
+                        'warehouse_name', warehouse_name, 'start_time', start_time, 'probe_name', probe_name)), '\n') within group (order by start_time) as body
+            from (
+                select m.*, lower(f.key) as method, trim(r.value::string) as receiver
+                from TABLE(RESULT_SCAN(:matches)) m, lateral flatten(input => m.action_taken) f, table(split_to_table(f.value::string, ',')) r
+                where lower(f.key) in ('email', 'slack') and length(trim(r.value::string)) > 1
+            )
+            group by method, receiver;
+            messages := (select last_query_id());
+            BEGIN
+                select query_ids, to_json(INTERNAL.NOTIFICATIONS(body, iff(method = 'slack', 'unused', subject), method, receiver)) as outcome
+                from TABLE(RESULT_SCAN(:messages));
+                notifications := (select last_query_id());
+            EXCEPTION
+                WHEN OTHER THEN
+                    let err string := SQLERRM;
+                    select query_ids, :err as outcome from TABLE(RESULT_SCAN(:messages));
+                    notifications := (select last_query_id());
+            END;
+            output := object_insert(output, 'notifications', (select count(*) from TABLE(RESULT_SCAN(:notifications))));
+            output := object_insert(output, 'notify_ms', datediff('millisecond', :step_start, current_timestamp()));
+
+            step_start := current_timestamp();
+            insert into internal.probe_actions
+                select current_timestamp(), m.probe_name, m.query_id, m.action_taken, coalesce(c.outcome, '') || coalesce(n.outcome, '')
+                from TABLE(RESULT_SCAN(:matches)) m
+                left outer join TABLE(RESULT_SCAN(:cancels)) c on c.query_id = m.query_id
+                left outer join (
+                    select q.value::string as query_id, listagg(n.outcome, '') as outcome
+                    from TABLE(RESULT_SCAN(:notifications)) n, lateral flatten(input => n.query_ids) q
+                    group by 1
+                ) n on n.query_id = m.query_id;
+            insert into internal.probe_recent_actions
+                select probe_name, query_id, current_timestamp(), end_time from TABLE(RESULT_SCAN(:matches));
+            output := object_insert(output, 'record_ms', datediff('millisecond', :step_start, current_timestamp()));
+        end if;
+
+        CALL INTERNAL.ADVANCE_PROBE_WATERMARK(:tick_start);
+        output := object_insert(output, 'total_ms', datediff('millisecond', :tick_start, current_timestamp()));
+        insert into internal.task_probe_monitoring select :tick_start, true, null, :output::variant;
+        return output;
+    EXCEPTION
+        WHEN OTHER THEN
+            SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Unhandled exception occurred during probe monitoring.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+            insert into internal.probe_actions select CURRENT_TIMESTAMP(), '', '', null::VARIANT, 'Caught unhandled exception';
+            insert into internal.task_probe_monitoring select :tick_start, false, :output::variant, OBJECT_CONSTRUCT('Error type', 'Other error', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate)::variant;
+            RAISE;
+    END;
+END;
+
+-- Whether any warehouse is running queries or a probe matched within the last `minutes`. Queries of the app itself, i.e.
+-- its tasks and pages, run as the application's role and don't count. Only running queries end after now, so a
+-- history truncated at the result limit means there are plenty of them.
+CREATE OR REPLACE PROCEDURE INTERNAL.IS_PROBE_MONITOR_ACTIVE(minutes number)
+RETURNS BOOLEAN
+AS
+BEGIN
+    let running boolean := (
+        select count(*) >= 10000 or count_if(execution_status = 'RUNNING' and warehouse_name is not null and coalesce(role_name <> current_role(), true)) > 0
+        from table(SNOWFLAKE.INFORMATION_SCHEMA.QUERY_HISTORY(END_TIME_RANGE_START => current_timestamp(), RESULT_LIMIT => 10000)));
+    let matched boolean := (select count(*) > 0 from internal.probe_recent_actions where action_time > dateadd(minute, -1 * :minutes, current_timestamp()));
+    return running or matched;
+END;
+
+-- Body of the probe monitoring task. With PROBE_MONITOR_ADAPTIVE set, the task keeps evaluating probes every
+-- PROBE_MONITOR_FAST_SECONDS while the account is active, within the minute until the next scheduled run. While the
+-- account is idle it only evaluates probes every PROBE_MONITOR_IDLE_MINUTES, which is safe since the watermark still
+-- covers every query that finished in between.
+CREATE OR REPLACE PROCEDURE INTERNAL.RUN_PROBE_MONITOR_LOOP()
+RETURNS NUMBER
+AS
+BEGIN
+    let adaptive string := (CALL INTERNAL.get_config('PROBE_MONITOR_ADAPTIVE'));
+    if (adaptive is null or adaptive <> 'true') then
+        CALL INTERNAL.RUN_PROBE_MONITOR();
+        return 1;
+    end if;
+
+    let fast_config string := (CALL INTERNAL.get_config('PROBE_MONITOR_FAST_SECONDS'));
+    let idle_config string := (CALL INTERNAL.get_config('PROBE_MONITOR_IDLE_MINUTES'));
+    let fast_seconds number := coalesce(try_to_number(fast_config), 15);
+    -- The watermark looks back at most ten minutes, so backing off for longer would miss finished queries.
+    let idle_minutes number := least(coalesce(try_to_number(idle_config), 5), 10);
+    let loop_start timestamp_ltz := current_timestamp();
+    let active boolean;
+    CALL INTERNAL.IS_PROBE_MONITOR_ACTIVE(:idle_minutes) into :active;
+    if (not active) then
+        let previous_tick string := (CALL INTERNAL.get_config('PROBE_WATERMARK'));
+        if (previous_tick is not null and previous_tick::timestamp_ltz > dateadd(minute, -1 * :idle_minutes, current_timestamp())) then
+            return 0;
+        end if;
+        CALL INTERNAL.RUN_PROBE_MONITOR();
+        return 1;
+    end if;
+
+    let ticks number := 0;
+    loop
+        let tick_start timestamp_ltz := current_timestamp();
+        CALL INTERNAL.RUN_PROBE_MONITOR();
+        ticks := ticks + 1;
+        -- Stop in time for the next scheduled run, which is skipped while this one is still going.
+        if (datediff('second', loop_start, current_timestamp()) + fast_seconds > 50) then
+            break;
+        end if;
+        CALL INTERNAL.IS_PROBE_MONITOR_ACTIVE(:idle_minutes) into :active;
+        if (not active) then
+            break;
+        end if;
+        let wait_seconds number := greatest(fast_seconds - datediff('second', tick_start, current_timestamp()), 1);
+        CALL SYSTEM$WAIT(:wait_seconds);
+    end loop;
+    return ticks;
+END;
+
+-- Returns the time from which the probe monitor has to evaluate completed queries.
+CREATE OR REPLACE PROCEDURE INTERNAL.GET_PROBE_WATERMARK()
+RETURNS TIMESTAMP_LTZ
+AS
+BEGIN
+    let watermark string := (CALL INTERNAL.get_config('PROBE_WATERMARK'));
+    if (watermark is null) then
+        -- First tick with a watermark. Remember recent actions so that queries which are still running aren't actioned twice.
+        truncate table internal.probe_recent_actions;
+        insert into internal.probe_recent_actions
+            select probe_name, query_id, action_time, null from internal.probe_actions
+            where action_time > dateadd(day, -1, current_timestamp()) and length(query_id) > 0;
+        return current_timestamp();
+    end if;
+    -- When the task was suspended for a while, don't act on everything that completed in the meantime.
+    return greatest(watermark::timestamp_ltz, dateadd(minute, -10, current_timestamp()));
+END;
+
+-- Moves the watermark to the start of the tick which just finished and forgets the actions of queries that can no
+-- longer be evaluated, which are those that ended before the new watermark. The end of a query is recorded when it is
+-- evaluated, so actions whose end was never seen are only forgotten once the query would have hit the default
+-- statement timeout of two days.
+CREATE OR REPLACE PROCEDURE INTERNAL.ADVANCE_PROBE_WATERMARK(tick_start timestamp_ltz)
+RETURNS NUMBER
+AS
+BEGIN
+    delete from internal.probe_recent_actions
+        where action_time < :tick_start
+        and (query_end_time < :tick_start or (query_end_time is null and action_time < dateadd(day, -2, :tick_start)));
+    let removed number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    CALL INTERNAL.SET_CONFIG('PROBE_WATERMARK', :tick_start::string);
+    return removed;
 END;
 
 CREATE OR REPLACE PROCEDURE ADMIN.CREATE_PROBE(name text, condition text, notify_writer boolean, notify_writer_method string, notify_other string, notify_other_method string, cancel boolean)
@@ -213,6 +538,9 @@ BEGIN
         END IF;
 
     COMMIT;
+    if (outcome is null) then
+        call INTERNAL.COMPILE_PROBE_PLAN();
+    end if;
     call ADMIN.UPDATE_PROBE_MONITOR_RUNNING();
     return outcome;
 END;
@@ -228,6 +556,7 @@ BEGIN
     end if;
 
     DELETE FROM internal.probes where name = :name;
+    call INTERNAL.COMPILE_PROBE_PLAN();
     call ADMIN.UPDATE_PROBE_MONITOR_RUNNING();
     return 'done';
 END;
@@ -273,6 +602,9 @@ BEGIN
     END IF;
 
     COMMIT;
+    if (outcome is null) then
+        call INTERNAL.COMPILE_PROBE_PLAN();
+    end if;
     call ADMIN.UPDATE_PROBE_MONITOR_RUNNING();
     return outcome;
 EXCEPTION
@@ -141,3 +141,61 @@ $$
 
   return str;
 $$;
+
+-- The latest successful output of each maintenance task. Refreshes read their watermark from here instead of sorting
+-- their whole task log, which keeps growing.
+CREATE TABLE INTERNAL.TASK_LAST_STATE IF NOT EXISTS (task_name string, run timestamp, output variant);
+
+CREATE OR REPLACE PROCEDURE INTERNAL.SET_TASK_LAST_STATE(task_name string, run timestamp, output variant)
+RETURNS BOOLEAN
+AS
+BEGIN
+    merge into internal.task_last_state s
+        using (select :task_name as task_name, :run as run, :output as output) n
+        on s.task_name = n.task_name
+        when matched then update set run = n.run, output = n.output
+        when not matched then insert (task_name, run, output) values (n.task_name, n.run, n.output);
+    return true;
+END;
+
+-- Builds a multi-table insert that materializes the new rows of a complete and daily view in a single pass. Rows which
+-- are incomplete, or end at the new completed watermark, go to the _INCOMPLETE table because the next refresh reads them
+-- again. The watermark is computed over the same rows with a window function. Binds: newest completed, oldest running,
+-- newest completed.
+create or replace procedure internal.generate_refresh_statement(source_schema varchar, source_table varchar, target_schema varchar, target_table varchar, end_column varchar, complete_condition varchar, order_by varchar)
+returns string
+as
+$$
+begin
+  let columns string := (
+      SELECT LISTAGG('"' || COLUMN_NAME || '"', ', ')
+      FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = :source_schema AND TABLE_NAME = :source_table
+      );
+  let stmt string := 'INSERT ALL
+      WHEN INCOMPLETE OR ' || :end_column || ' = NEWEST_COMPLETED THEN INTO "' || :target_schema || '"."' || :target_table || '_INCOMPLETE" (' || columns || ') VALUES (' || columns || ')
+      WHEN ' || :complete_condition || ' THEN INTO "' || :target_schema || '"."' || :target_table || '" (' || columns || ') VALUES (' || columns || ')
+      SELECT *, greatest(coalesce(max(iff(INCOMPLETE, null, ' || :end_column || ')) over (), 0::timestamp_ltz), ?::timestamp_ltz) AS NEWEST_COMPLETED
+      FROM "' || :source_schema || '"."' || :source_table || '"
+      WHERE filterts >= ? AND ' || :end_column || ' >= ?' || coalesce(' ORDER BY ' || :order_by, '');
+  return :stmt;
+end;
+$$;
+
+-- Rows and bytes processed by each phase (statement) of a task run, looked up by query id in the session history.
+create or replace procedure internal.phase_stats(phases object)
+returns object
+as
+$$
+begin
+  let stats object := (
+      select object_agg(p.key, object_construct('query_id', p.value, 'rows_produced', h.rows_produced, 'bytes_scanned', h.bytes_scanned, 'elapsed_ms', h.total_elapsed_time))
+      from table(flatten(input => :phases)) p
+      left outer join table(information_schema.query_history_by_session(result_limit => 1000)) h on h.query_id = p.value::string
+      );
+  return stats;
+exception
+  when other then
+    SYSTEM$LOG_INFO('Unable to look up phase statistics. ' || :SQLCODE || ': ' || :SQLERRM);
+    return null;
+end;
+$$;
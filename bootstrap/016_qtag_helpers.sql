@@ -19,65 +19,42 @@ try {
 }
 
 $$;
+-- The helpers below operate on the transformed qtag, which is materialized along with query history. They are plain SQL
+-- expressions so that label conditions using them don't pay for a javascript call per row.
 -- match a qtag with a specific key, value and source, given the transformed qtag
 create or replace function tools.qtag(qtag variant, source varchar, key varchar, value varchar)
 returns boolean
-language javascript
 as
 $$
-try {
-return QTAG[SOURCE][KEY] === VALUE;
-} catch {
-return false;
-}
+coalesce(get(get(qtag, source), key)::varchar = value, false)
 $$;
 -- check if a qtag exists wihit a given key/source, given the transformed qtag
 create or replace function tools.qtag_exists(qtag variant, source varchar, key varchar)
 returns boolean
-language javascript
 as
 $$
-try {
-return QTAG[SOURCE][KEY] !== undefined;
-} catch {
-return false;
-}
+coalesce(get(get(qtag, source), key) is not null, false)
 $$;
 -- extract the value for a given qtag key/source, given the transformed qtag
 create or replace function tools.qtag_value(qtag variant, source varchar, key varchar)
 returns varchar
-language javascript
 as
 $$
-try {
-return QTAG[SOURCE][KEY];
-} catch {
-return undefined;
-}
+get(get(qtag, source), key)::varchar
 $$;
 -- extract the keys for a given qtag source, given the transformed qtag
 create or replace function tools.qtag_keys(qtag variant, source varchar)
 returns variant
-language javascript
 as
 $$
-try {
-return Object.keys(QTAG[SOURCE]);
-} catch {
-return undefined;
-}
+iff(is_object(get(qtag, source)), object_keys(get(qtag, source)), null)
 $$;
 -- extract the sources for a given qtag, given the transformed qtag
 create or replace function tools.qtag_sources(qtag variant)
 returns variant
-language javascript
 as
 $$
-try {
-return Object.keys(QTAG);
-} catch {
-return undefined;
-}
+iff(is_object(qtag), object_keys(qtag), null)
 $$;
 -- match a qtag value with regex and with a specific key and source, given the transformed qtag
 create or replace function tools.qtag_matches(qtag variant, source varchar, key varchar, pattern varchar, parameters varchar)
@@ -14,6 +14,8 @@ BEGIN
         SELECT
             current_timestamp() as run_id,
             tools.qtag(query_text, true, true) as qtag,
+            -- Computed once here so that readers don't have to convert the qtag for every row.
+            tools.qtag_to_map(qtag) as qtag_filter,
             DATEDIFF('day', START_TIME, END_TIME) + 1 AS PERIOD_PLUS,
             -- Earlier versions generated COMPLETE and DAILY but accidentally applied the incorrect RECORD_TYPE to the given row.
             -- For new data, we generate COMPLETE_FIXED and DAILY_FIXED, and compensate in the views below.
@@ -40,6 +42,9 @@ call INTERNAL.create_view_QUERY_HISTORY_COMPLETE_AND_DAILY();
 
 create table internal_reporting_mv.query_history_complete_and_daily_incomplete if not exists  as select * from internal_reporting.query_history_complete_and_daily limit 0;
 create table internal_reporting_mv.query_history_complete_and_daily if not exists as select * from internal_reporting.query_history_complete_and_daily limit 0;
+-- The enriched views below read qtag_filter from the materialized tables, so it has to exist before migrate_queries runs.
+alter table internal_reporting_mv.query_history_complete_and_daily_incomplete add column if not exists qtag_filter variant;
+alter table internal_reporting_mv.query_history_complete_and_daily add column if not exists qtag_filter variant;
 
 -- sp to create view reporting.enriched_query_history
 CREATE OR REPLACE PROCEDURE INTERNAL.create_view_enriched_query_history()
@@ -53,18 +58,18 @@ BEGIN
         COPY GRANTS
         AS
             select
-                tools.qtag_to_map(qtag) as qtag_filter,
+                iff(qtag_filter is null and qtag is not null, tools.qtag_to_map(qtag), qtag_filter) as qtag_filter,
                 case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits * INTERNAL.GET_CREDIT_COST(warehouse_id) as COST,
                 case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits as unloaded_direct_compute_credits,
-                * exclude (period_plus, record_type, unloaded_direct_compute_credits)
+                * exclude (period_plus, record_type, unloaded_direct_compute_credits, qtag_filter)
             -- We may have reversed RECORD_TYPE rows in the materialized table. Filter to the new "correct" RECORD_TYPE and the old "incorrect" RECORD_TYPE.
             from internal_reporting_mv.query_history_complete_and_daily where RECORD_TYPE in ('COMPLETE_FIXED', 'DAILY')
             union all
             select
-                tools.qtag_to_map(qtag) as qtag_filter,
+                iff(qtag_filter is null and qtag is not null, tools.qtag_to_map(qtag), qtag_filter) as qtag_filter,
                 case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits * INTERNAL.GET_CREDIT_COST(warehouse_id) as COST,
                 case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits as unloaded_direct_compute_credits,
-                * exclude (period_plus, record_type, unloaded_direct_compute_credits)
+                * exclude (period_plus, record_type, unloaded_direct_compute_credits, qtag_filter)
             from internal_reporting_mv.query_history_complete_and_daily_incomplete where RECORD_TYPE in ('COMPLETE_FIXED', 'DAILY')
             ;
     $$;
@@ -85,17 +90,17 @@ BEGIN
     COPY GRANTS
     as
         select
-                tools.qtag_to_map(qtag) as qtag_filter,
+                iff(qtag_filter is null and qtag is not null, tools.qtag_to_map(qtag), qtag_filter) as qtag_filter,
         case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits * INTERNAL.GET_CREDIT_COST(warehouse_id) as COST,
                 case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits as unloaded_direct_compute_credits,
             -- We may have reversed RECORD_TYPE rows in the materialized table. Filter to the new "correct" RECORD_TYPE and the old "incorrect" RECORD_TYPE.
-            * exclude (period_plus, record_type, unloaded_direct_compute_credits) from internal_reporting_mv.query_history_complete_and_daily where RECORD_TYPE in ('DAILY_FIXED', 'COMPLETE')
+            * exclude (period_plus, record_type, unloaded_direct_compute_credits, qtag_filter) from internal_reporting_mv.query_history_complete_and_daily where RECORD_TYPE in ('DAILY_FIXED', 'COMPLETE')
         union all
         select
-                tools.qtag_to_map(qtag) as qtag_filter,
+                iff(qtag_filter is null and qtag is not null, tools.qtag_to_map(qtag), qtag_filter) as qtag_filter,
         case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits * INTERNAL.GET_CREDIT_COST(warehouse_id) as COST,
                 case warehouse_type when 'STANDARD' then 1.0 else 1.5 end * unloaded_direct_compute_credits as unloaded_direct_compute_credits,
-            * exclude (period_plus, record_type, unloaded_direct_compute_credits) from internal_reporting_mv.query_history_complete_and_daily_incomplete where RECORD_TYPE in ('DAILY_FIXED', 'COMPLETE');
+            * exclude (period_plus, record_type, unloaded_direct_compute_credits, qtag_filter) from internal_reporting_mv.query_history_complete_and_daily_incomplete where RECORD_TYPE in ('DAILY_FIXED', 'COMPLETE');
     $$;
     RETURN 'Success';
 END;
@@ -31,9 +31,70 @@ begin
     -- Ensure that RECORD_TYPE is VARCHAR and not VARCHAR(8)
     ALTER TABLE INTERNAL_REPORTING_MV.CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY MODIFY COLUMN RECORD_TYPE TYPE VARCHAR;
     ALTER TABLE INTERNAL_REPORTING_MV.CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY_INCOMPLETE MODIFY COLUMN RECORD_TYPE TYPE VARCHAR;
+    -- refresh_warehouse_events skips migrating while this is unchanged.
+    let fingerprint string;
+    call internal.schema_fingerprint('WAREHOUSE_EVENTS') into :fingerprint;
+    CALL INTERNAL.SET_CONFIG('WAREHOUSE_EVENTS_SCHEMA_FINGERPRINT', :fingerprint);
     return object_construct('migrate1', migrate1, 'migrate2', migrate2);
 end;
 
+-- One row per warehouse session with its duration and the time since the previous session of the warehouse started,
+-- both in milliseconds, and their internal.friendly_duration_ordinal buckets. The gap of a warehouse's first session is
+-- null. Reports aggregate these over the selected dates instead of windowing over every session.
+CREATE TABLE INTERNAL_REPORTING_MV.WAREHOUSE_SESSION_STATS IF NOT EXISTS (
+    SESSION_ID NUMBER,
+    WAREHOUSE_ID NUMBER,
+    WAREHOUSE_NAME STRING,
+    ST TIMESTAMP_LTZ,
+    ET TIMESTAMP_LTZ,
+    DURATION NUMBER,
+    DURATION_ORD NUMBER,
+    GAP NUMBER,
+    GAP_ORD NUMBER
+);
+
+CREATE OR REPLACE VIEW REPORTING.WAREHOUSE_SESSION_STATS
+COPY GRANTS
+AS
+SELECT * FROM INTERNAL_REPORTING_MV.WAREHOUSE_SESSION_STATS;
+
+-- Recomputes the sessions which started on or after `since`, the gap of the first of them per warehouse is taken from
+-- the newest session kept. The table is built in full the first time, a null `since` only does that.
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_WAREHOUSE_SESSION_STATS(since timestamp)
+    RETURNS NUMBER
+    LANGUAGE SQL
+AS
+BEGIN
+    let built string := (CALL INTERNAL.get_config('WAREHOUSE_SESSION_STATS_BUILT'));
+    if (built is null) then
+        since := 0::timestamp;
+    end if;
+    if (since is null) then
+        return 0;
+    end if;
+
+    delete from internal_reporting_mv.warehouse_session_stats where st >= :since;
+    insert into internal_reporting_mv.warehouse_session_stats (session_id, warehouse_id, warehouse_name, st, et, duration, duration_ord, gap, gap_ord)
+        select session_id, warehouse_id, warehouse_name, st, et, duration, internal.friendly_duration_ordinal(duration), gap, internal.friendly_duration_ordinal(gap)
+        from (
+            select s.session_id, s.warehouse_id, s.warehouse_name, s.st, s.et, s.duration,
+                datediff('seconds', coalesce(lag(s.st) over (partition by s.warehouse_id order by s.st), p.st), s.st) * 1000 as gap
+            from reporting.warehouse_sessions s
+            left outer join (
+                select warehouse_id, max(st) as st from internal_reporting_mv.warehouse_session_stats group by warehouse_id
+            ) p on p.warehouse_id = s.warehouse_id
+            where s.st >= :since
+        )
+        order by st;
+    let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    CALL INTERNAL.SET_CONFIG('WAREHOUSE_SESSION_STATS_BUILT', 'true');
+    return inserted;
+EXCEPTION
+    WHEN OTHER THEN
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while refreshing warehouse session stats.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
+
 CREATE OR REPLACE PROCEDURE internal.refresh_warehouse_events(migrate boolean) RETURNS STRING LANGUAGE SQL
     COMMENT = 'Refreshes the warehouse events materialized view. If migrate is true, then the materialized view will be migrated if necessary.'
     AS
@@ -42,7 +103,14 @@ BEGIN
     SYSTEM$LOG_INFO('Starting refresh warehouse events.');
     let migrate1 string := null;
     let migrate2 string := null;
+    let migration_skipped boolean := false;
     if (migrate) then
+        let fingerprint string;
+        call internal.schema_fingerprint('WAREHOUSE_EVENTS') into :fingerprint;
+        let migrated_fingerprint string := (CALL INTERNAL.get_config('WAREHOUSE_EVENTS_SCHEMA_FINGERPRINT'));
+        migration_skipped := coalesce(fingerprint = migrated_fingerprint, false);
+    end if;
+    if (migrate and not migration_skipped) then
         let migrate_result variant;
         call internal.migrate_warehouse_events() into migrate_result;
         migrate1 := migrate_result:migrate1::string;
@@ -50,9 +118,15 @@ BEGIN
     end if;
 
     let input variant := null;
+    let state variant := null;
     BEGIN
         BEGIN TRANSACTION;
-        input := (select output from INTERNAL.TASK_WAREHOUSE_EVENTS where success order by run desc limit 1);
+        -- A failed run rolls back and leaves the last state as it was, a reset removes it. Only states written before
+        -- TASK_LAST_STATE existed are read from the log.
+        input := (select any_value(output) from INTERNAL.TASK_LAST_STATE where task_name = 'WAREHOUSE_EVENTS');
+        if (input is null) then
+            input := (select output from INTERNAL.TASK_WAREHOUSE_EVENTS where success order by run desc limit 1);
+        end if;
         let oldest_running timestamp := 0::timestamp;
         let newest_completed timestamp := 0::timestamp;
 
@@ -61,32 +135,49 @@ BEGIN
             newest_completed := input:newest_completed::timestamp;
         end if;
 
+        let sessions_since timestamp := oldest_running;
+        let session_stats_rows number := 0;
+
         if (oldest_running = 0::timestamp) then
           -- we should ensure that there are no records in the table if this is the first run. This allows a separate process to insert a "reset" message in the log which will cause us to start over again.
           truncate table INTERNAL_REPORTING_MV.CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY;
         end if;
 
-        DROP TABLE IF EXISTS RAW_WH_EVT ;
-        CREATE TABLE RAW_WH_EVT AS SELECT * FROM INTERNAL_REPORTING.CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY WHERE filterts >= :oldest_running AND SESSION_END >= :newest_completed;
-        let new_records number := (select count(*) from RAW_WH_EVT);
+        -- New rows are routed to the complete and incomplete tables in a single pass over the view.
+        let run_id timestamp := current_timestamp();
+        let stmt string;
+        call internal.generate_refresh_statement('INTERNAL_REPORTING', 'CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY', 'INTERNAL_REPORTING_MV', 'CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY', 'SESSION_END', 'NOT INCOMPLETE AND SESSION_END <> NEWEST_COMPLETED', null) into :stmt;
+        execute immediate stmt using (newest_completed, oldest_running, newest_completed);
+        let load_qid string := last_query_id();
+        let new_INCOMPLETE number := (select $1 from TABLE(RESULT_SCAN(:load_qid)));
+        let new_closed number := (select $2 from TABLE(RESULT_SCAN(:load_qid)));
+        let new_records number := new_INCOMPLETE + new_closed;
 
         IF (new_records > 0) THEN
+            -- Rows of this run are the only ones left in the incomplete table, and every row that determines the watermarks
+            -- (the incomplete ones and those at the newest end time) is among them.
+            delete from INTERNAL_REPORTING_MV.CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY_INCOMPLETE where run_id < :run_id;
+            let cleanup_qid string := last_query_id();
             -- if there are incomplete queries, find the min timestamp of the incomplete queries. If there are no incomplete, find the newest timestamp for a filter condition next time.
-            oldest_running := (SELECT greatest(coalesce(MIN(case when incomplete then filterts else null end), max(SESSION_END)), :oldest_running) FROM RAW_WH_EVT);
-            newest_completed := (SELECT greatest(coalesce(max(SESSION_END), 0::TIMESTAMP), :newest_completed) FROM RAW_WH_EVT WHERE NOT INCOMPLETE);
-            let run_id timestamp := (SELECT run_id FROM RAW_WH_EVT limit 1);
-            TRUNCATE TABLE INTERNAL_REPORTING_MV.CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY_INCOMPLETE;
-            let where_clause varchar := (select 'INCOMPLETE OR session_end = to_timestamp_ltz(\'' || :newest_completed || '\')');
-            let new_INCOMPLETE number;
-            call internal.generate_insert_statement('INTERNAL_REPORTING_MV', 'CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY_INCOMPLETE', 'INTERNAL', 'RAW_WH_EVT', :where_clause) into :new_INCOMPLETE;
-            let where_clause_complete varchar := (select 'not incomplete and session_end <> to_timestamp_ltz(\'' || :newest_completed || '\')');
-            let new_closed number;
-            call internal.generate_insert_statement('INTERNAL_REPORTING_MV', 'CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY', 'INTERNAL', 'RAW_WH_EVT', :where_clause_complete) into :new_closed;
-            insert into INTERNAL.TASK_WAREHOUSE_EVENTS SELECT :run_id, true, :input, OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', :new_records, 'new_INCOMPLETE', :new_INCOMPLETE, 'new_closed', coalesce(:new_closed, 0))::VARIANT;
+            select greatest(coalesce(MIN(case when incomplete then filterts else null end), max(SESSION_END)), :oldest_running),
+                greatest(coalesce(max(case when incomplete then null else SESSION_END end), 0::TIMESTAMP), :newest_completed)
+            from INTERNAL_REPORTING_MV.CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY_INCOMPLETE;
+            let watermark_qid string := last_query_id();
+            oldest_running := (select $1 from TABLE(RESULT_SCAN(:watermark_qid)));
+            newest_completed := (select $2 from TABLE(RESULT_SCAN(:watermark_qid)));
+            let phases object;
+            call internal.phase_stats(object_construct('load', :load_qid, 'cleanup', :cleanup_qid, 'watermark', :watermark_qid)) into :phases;
+            call internal.refresh_warehouse_session_stats(:sessions_since) into :session_stats_rows;
+            state := OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migration_skipped', :migration_skipped, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', :new_records, 'new_INCOMPLETE', :new_INCOMPLETE, 'new_closed', coalesce(:new_closed, 0), 'session_stats', :session_stats_rows, 'phases', :phases)::VARIANT;
+            insert into INTERNAL.TASK_WAREHOUSE_EVENTS SELECT :run_id, true, :input, :state;
+            call INTERNAL.SET_TASK_LAST_STATE('WAREHOUSE_EVENTS', :run_id, :state);
         ELSE
-            insert into INTERNAL.TASK_WAREHOUSE_EVENTS SELECT :dt, true, :input, OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', 0, 'new_INCOMPLETE', 0, 'new_closed', 0)::VARIANT;
+            -- Nothing new was materialized, the session stats are only built if they never were.
+            call internal.refresh_warehouse_session_stats(null) into :session_stats_rows;
+            state := OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migration_skipped', :migration_skipped, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', 0, 'new_INCOMPLETE', 0, 'new_closed', 0, 'session_stats', :session_stats_rows)::VARIANT;
+            insert into INTERNAL.TASK_WAREHOUSE_EVENTS SELECT :dt, true, :input, :state;
+            call INTERNAL.SET_TASK_LAST_STATE('WAREHOUSE_EVENTS', :dt, :state);
         END IF;
-        DROP TABLE RAW_WH_EVT;
         COMMIT;
 
     EXCEPTION
@@ -12,10 +12,25 @@ begin
     let migrate1 string := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
     call internal.migrate_if_necessary('INTERNAL_REPORTING', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'INTERNAL_REPORTING_MV', 'QUERY_HISTORY_COMPLETE_AND_DAILY_INCOMPLETE');
     let migrate2 string := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    -- Reports filter on start_time and warehouse_name, so clustering on both lets date ranges prune micro-partitions. The
+    -- incomplete table is replaced on every refresh and stays small.
+    let clustering string;
+    call internal.migrate_clustering_if_necessary('INTERNAL_REPORTING_MV', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'TO_DATE(START_TIME), WAREHOUSE_NAME') into :clustering;
     -- Ensure that RECORD_TYPE is VARCHAR and not VARCHAR(8)
     ALTER TABLE INTERNAL_REPORTING_MV.QUERY_HISTORY_COMPLETE_AND_DAILY MODIFY COLUMN RECORD_TYPE TYPE VARCHAR;
     ALTER TABLE INTERNAL_REPORTING_MV.QUERY_HISTORY_COMPLETE_AND_DAILY_INCOMPLETE MODIFY COLUMN RECORD_TYPE TYPE VARCHAR;
-    return object_construct('migrate1', migrate1, 'migrate2', migrate2);
+    -- Rows materialized before qtag_filter was stored are converted once. Until then, the enriched views convert them on read.
+    let qtag_backfilled string := (CALL INTERNAL.get_config('QTAG_FILTER_BACKFILLED'));
+    if (qtag_backfilled is null) then
+        update internal_reporting_mv.query_history_complete_and_daily set qtag_filter = tools.qtag_to_map(qtag) where qtag_filter is null and qtag is not null;
+        update internal_reporting_mv.query_history_complete_and_daily_incomplete set qtag_filter = tools.qtag_to_map(qtag) where qtag_filter is null and qtag is not null;
+        CALL INTERNAL.SET_CONFIG('QTAG_FILTER_BACKFILLED', 'true');
+    end if;
+    -- Taken after migrating since the views were recreated. refresh_queries skips migrating while it is unchanged.
+    let fingerprint string;
+    call internal.schema_fingerprint('QUERY_HISTORY') into :fingerprint;
+    CALL INTERNAL.SET_CONFIG('QUERY_HISTORY_SCHEMA_FINGERPRINT', :fingerprint);
+    return object_construct('migrate1', migrate1, 'migrate2', migrate2, 'clustering', clustering);
 end;
 
 CREATE OR REPLACE PROCEDURE internal.refresh_queries(migrate boolean) RETURNS STRING LANGUAGE SQL AS
@@ -24,7 +39,14 @@ BEGIN
     SYSTEM$LOG_INFO('Starting refresh queries.');
     let migrate1 string := null;
     let migrate2 string := null;
+    let migration_skipped boolean := false;
     if (migrate) then
+        let fingerprint string;
+        call internal.schema_fingerprint('QUERY_HISTORY') into :fingerprint;
+        let migrated_fingerprint string := (CALL INTERNAL.get_config('QUERY_HISTORY_SCHEMA_FINGERPRINT'));
+        migration_skipped := coalesce(fingerprint = migrated_fingerprint, false);
+    end if;
+    if (migrate and not migration_skipped) then
         let migration_result variant;
         call internal.migrate_queries() into :migration_result;
         migrate1 := migration_result:migrate1::string;
@@ -32,9 +54,16 @@ BEGIN
     end if;
 
     let input variant := null;
+    let state variant := null;
+    let backfill_planned boolean := false;
     BEGIN
         BEGIN TRANSACTION;
-        input := (select output from INTERNAL.TASK_QUERY_HISTORY where success order by run desc limit 1);
+        -- A failed run rolls back and leaves the last state as it was, a reset removes it. Only states written before
+        -- TASK_LAST_STATE existed are read from the log.
+        input := (select any_value(output) from INTERNAL.TASK_LAST_STATE where task_name = 'QUERY_HISTORY');
+        if (input is null) then
+            input := (select output from INTERNAL.TASK_QUERY_HISTORY where success order by run desc limit 1);
+        end if;
         let oldest_running timestamp := 0::timestamp;
         let newest_completed timestamp := 0::timestamp;
 
@@ -43,32 +72,74 @@ BEGIN
             newest_completed := input:newest_completed::timestamp;
         end if;
 
+        let rollup_since timestamp := oldest_running;
+
         if (oldest_running = 0::timestamp) then
           -- we should ensure that there are no records in the table if this is the first run. This allows a separate process to insert a "reset" message in the log which will cause us to start over again.
           truncate table INTERNAL_REPORTING_MV.QUERY_HISTORY_COMPLETE_AND_DAILY;
+          -- Older history is loaded by the backfill task, a day at a time, so that this run only covers recent queries.
+          call internal.plan_query_history_backfill() into :oldest_running;
+          backfill_planned := true;
         end if;
 
-        DROP TABLE IF EXISTS RAW_QH_EVT ;
-        CREATE TABLE RAW_QH_EVT AS SELECT * FROM INTERNAL_REPORTING.QUERY_HISTORY_COMPLETE_AND_DAILY WHERE filterts >= :oldest_running AND end_time >= :newest_completed;
-        let new_records number := (select count(*) from RAW_QH_EVT);
+        -- New rows are routed to the complete and incomplete tables in a single pass over the view. Inserting in clustering
+        -- key order keeps the new micro-partitions well clustered before automatic clustering runs.
+        let run_id timestamp := current_timestamp();
+        let stmt string;
+        call internal.generate_refresh_statement('INTERNAL_REPORTING', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'INTERNAL_REPORTING_MV', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'END_TIME', 'END_TIME <> NEWEST_COMPLETED', 'TO_DATE(START_TIME), WAREHOUSE_NAME') into :stmt;
+        execute immediate stmt using (newest_completed, oldest_running, newest_completed);
+        let load_qid string := last_query_id();
+        let new_INCOMPLETE number := (select $1 from TABLE(RESULT_SCAN(:load_qid)));
+        let new_closed number := (select $2 from TABLE(RESULT_SCAN(:load_qid)));
+        let new_records number := new_INCOMPLETE + new_closed;
 
         IF (new_records > 0) THEN
+            -- Rows of this run are the only ones left in the incomplete table, and every row that determines the watermarks
+            -- (the incomplete ones and those at the newest end time) is among them.
+            delete from INTERNAL_REPORTING_MV.QUERY_HISTORY_COMPLETE_AND_DAILY_INCOMPLETE where run_id < :run_id;
+            let cleanup_qid string := last_query_id();
             -- if there are incomplete queries, find the min timestamp of the incomplete queries. If there are no incomplete, find the newest timestamp for a filter condition next time.
-            oldest_running := (SELECT greatest(coalesce(MIN(case when incomplete then filterts else null end), max(end_time)), :oldest_running) FROM RAW_QH_EVT);
-            newest_completed := (SELECT greatest(coalesce(max(end_time), 0::TIMESTAMP), :newest_completed) FROM RAW_QH_EVT WHERE NOT INCOMPLETE);
-            let run_id timestamp := (SELECT run_id FROM RAW_QH_EVT limit 1);
-            TRUNCATE TABLE INTERNAL_REPORTING_MV.QUERY_HISTORY_COMPLETE_AND_DAILY_INCOMPLETE;
-            let where_clause varchar := (select 'INCOMPLETE OR END_TIME = to_timestamp_ltz(\'' || :newest_completed || '\')');
-            let new_INCOMPLETE number;
-            call internal.generate_insert_statement('INTERNAL_REPORTING_MV', 'QUERY_HISTORY_COMPLETE_AND_DAILY_INCOMPLETE', 'INTERNAL', 'RAW_QH_EVT', :where_clause) into :new_INCOMPLETE;
-            let where_clause_complete varchar := (select 'END_TIME <> to_timestamp_ltz(\'' || :newest_completed || '\')');
-            let new_closed number;
-            call internal.generate_insert_statement('INTERNAL_REPORTING_MV', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'INTERNAL', 'RAW_QH_EVT', :where_clause_complete) into :new_closed;
-            insert into INTERNAL.TASK_QUERY_HISTORY SELECT :run_id, true, :input, OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', :new_records, 'new_INCOMPLETE', :new_INCOMPLETE, 'new_closed', coalesce(:new_closed, 0))::VARIANT;
+            select greatest(coalesce(MIN(case when incomplete then filterts else null end), max(end_time)), :oldest_running),
+                greatest(coalesce(max(case when incomplete then null else end_time end), 0::TIMESTAMP), :newest_completed)
+            from INTERNAL_REPORTING_MV.QUERY_HISTORY_COMPLETE_AND_DAILY_INCOMPLETE;
+            let watermark_qid string := last_query_id();
+            oldest_running := (select $1 from TABLE(RESULT_SCAN(:watermark_qid)));
+            newest_completed := (select $2 from TABLE(RESULT_SCAN(:watermark_qid)));
+            let phases object;
+            call internal.phase_stats(object_construct('load', :load_qid, 'cleanup', :cleanup_qid, 'watermark', :watermark_qid)) into :phases;
+            let query_tables_rows number;
+            call internal.refresh_query_tables(:rollup_since, null) into :query_tables_rows;
+            -- Before the labels, since tools.is_repeated_query and tools.is_ad_hoc_query look up the hash frequencies.
+            let hash_rows number;
+            call internal.refresh_query_hash_frequency(:rollup_since, null) into :hash_rows;
+            let qlike_cache object;
+            call internal.refresh_qlike_cache(:rollup_since, null) into :qlike_cache;
+            let label_store_rows number;
+            call internal.refresh_label_store(:rollup_since, null) into :label_store_rows;
+            let rollup_rows number;
+            call internal.refresh_daily_rollup(:rollup_since, null) into :rollup_rows;
+            let hourly_rows number;
+            call internal.refresh_query_history_hourly(:rollup_since, null) into :hourly_rows;
+            let utilization_rows number;
+            call internal.refresh_warehouse_daily_utilization(:rollup_since, null) into :utilization_rows;
+            state := OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migration_skipped', :migration_skipped, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', :new_records, 'new_INCOMPLETE', :new_INCOMPLETE, 'new_closed', coalesce(:new_closed, 0), 'query_tables', :query_tables_rows, 'label_store', :label_store_rows, 'daily_rollup', :rollup_rows, 'hourly', :hourly_rows, 'daily_utilization', :utilization_rows, 'query_hash', :hash_rows, 'qlike_cache', :qlike_cache, 'phases', :phases)::VARIANT;
+            insert into INTERNAL.TASK_QUERY_HISTORY SELECT :run_id, true, :input, :state;
+            call INTERNAL.SET_TASK_LAST_STATE('QUERY_HISTORY', :run_id, :state);
         ELSE
-            insert into INTERNAL.TASK_QUERY_HISTORY SELECT :dt, true, :input, OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', 0, 'new_INCOMPLETE', 0, 'new_closed', 0)::VARIANT;
+            -- Nothing new was materialized, but the rollup still has to be rebuilt if the labels changed, the hourly
+            -- aggregates and hash frequencies built if they never were, and the daily utilization updated for new metering.
+            let hash_rows number;
+            call internal.refresh_query_hash_frequency(null, null) into :hash_rows;
+            let rollup_rows number;
+            call internal.refresh_daily_rollup(null, null) into :rollup_rows;
+            let hourly_rows number;
+            call internal.refresh_query_history_hourly(null, null) into :hourly_rows;
+            let utilization_rows number;
+            call internal.refresh_warehouse_daily_utilization(null, null) into :utilization_rows;
+            state := OBJECT_CONSTRUCT('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migration_skipped', :migration_skipped, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2, 'new_records', 0, 'new_INCOMPLETE', 0, 'new_closed', 0, 'daily_rollup', :rollup_rows, 'hourly', :hourly_rows, 'daily_utilization', :utilization_rows, 'query_hash', :hash_rows)::VARIANT;
+            insert into INTERNAL.TASK_QUERY_HISTORY SELECT :dt, true, :input, :state;
+            call INTERNAL.SET_TASK_LAST_STATE('QUERY_HISTORY', :dt, :state);
         END IF;
-        DROP TABLE RAW_QH_EVT;
         COMMIT;
 
     EXCEPTION
@@ -79,5 +150,9 @@ BEGIN
         RAISE;
 
     END;
+    -- Started once the planned days are committed.
+    if (backfill_planned) then
+        call internal.start_query_history_backfill();
+    end if;
     CALL INTERNAL.SET_CONFIG('QUERY_HISTORY_MAINTENANCE', CURRENT_TIMESTAMP()::string);
 END;
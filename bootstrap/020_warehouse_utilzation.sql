@@ -1,52 +1,129 @@
 
+-- Daily utilization per warehouse. refresh_queries recomputes only the days touched by new queries or metering rows, the
+-- view below keeps the existing name for the reports reading it.
+CREATE TABLE INTERNAL_REPORTING_MV.WAREHOUSE_DAILY_UTILIZATION IF NOT EXISTS (
+    PERIOD TIMESTAMP_LTZ,
+    WAREHOUSE_ID NUMBER,
+    WAREHOUSE_NAME STRING,
+    QUERIES NUMBER,
+    UNLOADED_CC FLOAT,
+    LOADED_CC FLOAT
+);
+
 CREATE OR REPLACE VIEW REPORTING.WAREHOUSE_DAILY_UTILIZATION AS
-with QUERY_WH_UTIL AS (
 select
-    ST_PERIOD,
-    case when internal.is_serverless_warehouse(warehouse_id) then 'Serverless Task' else WAREHOUSE_NAME end as WAREHOUSE_NAME,
-    case when internal.is_serverless_warehouse(warehouse_id) then -1 else WAREHOUSE_ID end as WAREHOUSE_ID,
-    COUNT(*) AS QUERIES_EXECUTED,
-    SUM(unloaded_direct_compute_credits) AS UNLOADED_COMPUTE_CREDITS
-from REPORTING.ENRICHED_QUERY_HISTORY_DAILY
-WHERE NOT INTERNAL.IS_SERVERLESS_WAREHOUSE(WAREHOUSE_ID)
-GROUP BY ST_PERIOD, WAREHOUSE_ID, WAREHOUSE_NAME
-),
-WAREHOUSE_PERIODIC AS (
-select DATE_TRUNC('day', START_TIME) AS M_PERIOD, WAREHOUSE_ID, SUM(CREDITS_USED_COMPUTE) AS LOADED_COMPUTE_CREDITS, SUM(CREDITS_USED_CLOUD_SERVICES) AS WAREHOUSE_CLOUD_CREDITS, SUM(CREDITS_USED_COMPUTE) + SUM(CREDITS_USED_CLOUD_SERVICES) AS TOTAL_CREDITS, TOTAL_CREDITS * INTERNAL.GET_CREDIT_COST() AS COST
-FROM ACCOUNT_USAGE.WAREHOUSE_METERING_HISTORY
-GROUP BY M_PERIOD, WAREHOUSE_ID, WAREHOUSE_NAME
-UNION ALL
-select date_trunc('day', start_time), -1, sum(credits_used), 0, sum(credits_used), sum(credits_used) * INTERNAL.GET_SERVERLESS_CREDIT_COST() from account_usage.serverless_task_history group by 1
-)
-select
-    COALESCE(ST_PERIOD, M_PERIOD) AS PERIOD,
-    COALESCE(QUERY_WH_UTIL.WAREHOUSE_ID, WAREHOUSE_PERIODIC.WAREHOUSE_ID) AS WAREHOUSE_ID,
-    COALESCE(QUERY_WH_UTIL.WAREHOUSE_NAME, 'Unknown') AS WAREHOUSE_NAME,
-    COALESCE(QUERIES_EXECUTED, 0) AS QUERIES,
-    CASE
-        WHEN UNLOADED_COMPUTE_CREDITS IS NULL THEN 0
-        -- use this to correct for unloaded credit overaccounting
-        WHEN UNLOADED_COMPUTE_CREDITS > LOADED_COMPUTE_CREDITS THEN LOADED_COMPUTE_CREDITS
-        ELSE UNLOADED_COMPUTE_CREDITS
-    END AS UNLOADED_CC,
-    COALESCE(LOADED_COMPUTE_CREDITS, 0) AS LOADED_CC,
+    PERIOD,
+    WAREHOUSE_ID,
+    WAREHOUSE_NAME,
+    QUERIES,
+    UNLOADED_CC,
+    LOADED_CC,
     IFF(LOADED_CC = 0,null, UNLOADED_CC/LOADED_CC) AS UTILIZATION
-FROM
-    QUERY_WH_UTIL
-    FULL OUTER JOIN WAREHOUSE_PERIODIC ON QUERY_WH_UTIL.WAREHOUSE_ID = WAREHOUSE_PERIODIC.WAREHOUSE_ID AND ST_PERIOD = M_PERIOD;
-;
+FROM INTERNAL_REPORTING_MV.WAREHOUSE_DAILY_UTILIZATION;
+
+-- Recomputes every day on or after the day of `since`, or of the newest metering row seen by the previous run when new
+-- metering rows arrived since. Metering rows can arrive a few hours late, so the day before that one is recomputed as
+-- well. The table is built in full the first time. With `until`, only the days from `since` up to and including the day
+-- of `until` are recomputed and new metering rows are left to the next unbounded refresh.
+DROP PROCEDURE IF EXISTS INTERNAL.REFRESH_WAREHOUSE_DAILY_UTILIZATION(timestamp);
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_WAREHOUSE_DAILY_UTILIZATION(since timestamp, until timestamp)
+    RETURNS NUMBER
+    LANGUAGE SQL
+AS
+BEGIN
+    let built string := (CALL INTERNAL.get_config('WAREHOUSE_DAILY_UTILIZATION_BUILT'));
+    let metered string := (CALL INTERNAL.get_config('WAREHOUSE_DAILY_UTILIZATION_METERED'));
+    let previous timestamp_ltz := coalesce(try_to_timestamp_ltz(metered, 'YYYY-MM-DD HH24:MI:SS.FF9 TZHTZM'), 0::timestamp_ltz);
+    let newest_metered timestamp_ltz := (select max(newest) from (
+        select max(start_time) as newest from account_usage.warehouse_metering_history where start_time >= :previous
+        union all
+        select max(start_time) from account_usage.serverless_task_history where start_time >= :previous));
+
+    let from_day timestamp_ltz := null;
+    let to_day timestamp_ltz := '9999-12-31'::timestamp_ltz;
+    if (built is null) then
+        from_day := 0::timestamp_ltz;
+    elseif (until is not null) then
+        from_day := date_trunc('day', since);
+        to_day := dateadd(day, 1, date_trunc('day', dateadd(nanosecond, -1, until)));
+        newest_metered := null;
+    else
+        if (newest_metered > previous) then
+            from_day := date_trunc('day', dateadd(day, -1, previous));
+        end if;
+        if (since is not null) then
+            from_day := least(coalesce(from_day, date_trunc('day', since)), date_trunc('day', since));
+        end if;
+    end if;
+    if (from_day is null) then
+        return 0;
+    end if;
+
+    delete from internal_reporting_mv.warehouse_daily_utilization where period >= :from_day and period < :to_day;
+    insert into internal_reporting_mv.warehouse_daily_utilization (period, warehouse_id, warehouse_name, queries, unloaded_cc, loaded_cc)
+    select period, warehouse_id, warehouse_name, queries, unloaded_cc, loaded_cc from (
+        with QUERY_WH_UTIL AS (
+        select
+            ST_PERIOD,
+            case when internal.is_serverless_warehouse(warehouse_id) then 'Serverless Task' else WAREHOUSE_NAME end as WAREHOUSE_NAME,
+            case when internal.is_serverless_warehouse(warehouse_id) then -1 else WAREHOUSE_ID end as WAREHOUSE_ID,
+            COUNT(*) AS QUERIES_EXECUTED,
+            SUM(unloaded_direct_compute_credits) AS UNLOADED_COMPUTE_CREDITS
+        from REPORTING.ENRICHED_QUERY_HISTORY_DAILY
+        WHERE NOT INTERNAL.IS_SERVERLESS_WAREHOUSE(WAREHOUSE_ID) AND ST_PERIOD >= :from_day AND ST_PERIOD < :to_day
+        GROUP BY ST_PERIOD, WAREHOUSE_ID, WAREHOUSE_NAME
+        ),
+        WAREHOUSE_PERIODIC AS (
+        select DATE_TRUNC('day', START_TIME) AS M_PERIOD, WAREHOUSE_ID, SUM(CREDITS_USED_COMPUTE) AS LOADED_COMPUTE_CREDITS
+        FROM ACCOUNT_USAGE.WAREHOUSE_METERING_HISTORY
+        WHERE START_TIME >= :from_day AND START_TIME < :to_day
+        GROUP BY M_PERIOD, WAREHOUSE_ID, WAREHOUSE_NAME
+        UNION ALL
+        select date_trunc('day', start_time), -1, sum(credits_used) from account_usage.serverless_task_history where start_time >= :from_day and start_time < :to_day group by 1
+        )
+        select
+            COALESCE(ST_PERIOD, M_PERIOD) AS PERIOD,
+            COALESCE(QUERY_WH_UTIL.WAREHOUSE_ID, WAREHOUSE_PERIODIC.WAREHOUSE_ID) AS WAREHOUSE_ID,
+            COALESCE(QUERY_WH_UTIL.WAREHOUSE_NAME, 'Unknown') AS WAREHOUSE_NAME,
+            COALESCE(QUERIES_EXECUTED, 0) AS QUERIES,
+            CASE
+                WHEN UNLOADED_COMPUTE_CREDITS IS NULL THEN 0
+                -- use this to correct for unloaded credit overaccounting
+                WHEN UNLOADED_COMPUTE_CREDITS > LOADED_COMPUTE_CREDITS THEN LOADED_COMPUTE_CREDITS
+                ELSE UNLOADED_COMPUTE_CREDITS
+            END AS UNLOADED_CC,
+            COALESCE(LOADED_COMPUTE_CREDITS, 0) AS LOADED_CC
+        FROM
+            QUERY_WH_UTIL
+            FULL OUTER JOIN WAREHOUSE_PERIODIC ON QUERY_WH_UTIL.WAREHOUSE_ID = WAREHOUSE_PERIODIC.WAREHOUSE_ID AND ST_PERIOD = M_PERIOD
+    )
+    ORDER BY PERIOD;
+    let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+
+    CALL INTERNAL.SET_CONFIG('WAREHOUSE_DAILY_UTILIZATION_BUILT', 'true');
+    if (newest_metered > previous) then
+        let newest string := to_varchar(newest_metered, 'YYYY-MM-DD HH24:MI:SS.FF9 TZHTZM');
+        CALL INTERNAL.SET_CONFIG('WAREHOUSE_DAILY_UTILIZATION_METERED', :newest);
+    end if;
+    return inserted;
+EXCEPTION
+    WHEN OTHER THEN
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while refreshing daily warehouse utilization.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
 
+-- Reads the hourly aggregates maintained by refresh_queries rather than REPORTING.ENRICHED_QUERY_HISTORY_HOURLY.
 CREATE OR REPLACE VIEW REPORTING.WAREHOUSE_HOURLY_UTILIZATION AS
 with QUERY_WH_UTIL AS (
 select
-    ST_PERIOD,
+    HOUR AS ST_PERIOD,
     WAREHOUSE_NAME,
     WAREHOUSE_ID,
-    COUNT(*) AS QUERIES_EXECUTED,
+    SUM(QUERIES) AS QUERIES_EXECUTED,
     SUM(unloaded_direct_compute_credits) AS UNLOADED_COMPUTE_CREDITS
-from REPORTING.ENRICHED_QUERY_HISTORY_HOURLY
+from INTERNAL_REPORTING_MV.QUERY_HISTORY_HOURLY
 WHERE NOT INTERNAL.IS_SERVERLESS_WAREHOUSE(WAREHOUSE_ID)
-GROUP BY ST_PERIOD, WAREHOUSE_ID, WAREHOUSE_NAME
+GROUP BY HOUR, WAREHOUSE_ID, WAREHOUSE_NAME
 ),
 WAREHOUSE_PERIODIC AS (
 select DATE_TRUNC('hour', START_TIME) AS M_PERIOD, WAREHOUSE_ID, SUM(CREDITS_USED_COMPUTE) AS LOADED_COMPUTE_CREDITS, SUM(CREDITS_USED_CLOUD_SERVICES) WARESHOUSE_CLOUD_CREDITS
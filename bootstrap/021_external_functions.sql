@@ -23,44 +23,126 @@ AS $$
 throw ERR;
 $$;
 
+-- Results of QLike calls, keyed by selector, selector params, query hash, database and schema. tools.qlike only receives
+-- the query text, so its hash stands in for query_parameterized_hash. Filled by internal.refresh_qlike_cache since
+-- functions cannot write to tables, results older than QLIKE_CACHE_DAYS (default 30) are expired by retention.
+CREATE TABLE INTERNAL.QLIKE_CACHE IF NOT EXISTS (key number, selector string, selector_params string, query_hash string, database string, schema string, result boolean, cached_at timestamp_ltz);
+
+create or replace function internal.qlike_cache_key(request object)
+    returns number
+as
+$$
+    hash(request:selector::string, request:selector_params::string, request:query_hash::string, request:database::string, request:schema::string)
+$$;
+
+-- Unwraps a QLike response. A javascript function is not inlined, so the external function it is given is only called
+-- once per row.
+CREATE or replace FUNCTION internal.qlike_result(RESPONSE variant)
+    RETURNS VARIANT
+    LANGUAGE JAVASCRIPT
+AS $$
+if (RESPONSE.error && RESPONSE.error.length != 0) {
+    throw RESPONSE.error;
+}
+return RESPONSE.result;
+$$;
+
 create or replace function internal.wrapper_qlike(request object)
     returns boolean
     immutable
 as
 $$
-    iff(length(internal.ef_qlike(request):error) != 0,
-        internal.throw_exception(internal.ef_qlike(request):error),
-        internal.ef_qlike(request):result)::boolean
+    coalesce((select any_value(result) from internal.qlike_cache where key = internal.qlike_cache_key(request)),
+        internal.qlike_result(internal.ef_qlike(request))::boolean)
 $$;
 
 create or replace function tools.qlike(query_text varchar, selector varchar)
     returns boolean
 as
 $$
-    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', current_database(), 'schema', current_schema()))
+    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', current_database(), 'schema', current_schema(), 'query_hash', hash(query_text)::varchar))
 $$;
 
 create or replace function tools.qlike(query_text varchar, selector varchar, params varchar)
     returns boolean
 as
 $$
-    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', current_database(), 'schema', current_schema(), 'selector_params', params))
+    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', current_database(), 'schema', current_schema(), 'selector_params', params, 'query_hash', hash(query_text)::varchar))
 $$;
 
 create or replace function tools.qlike(query_text varchar, selector varchar, database varchar, currentschema varchar)
     returns boolean
 as
 $$
-    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', database, 'schema', currentschema))
+    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', database, 'schema', currentschema, 'query_hash', hash(query_text)::varchar))
 $$;
 
 create or replace function tools.qlike(query_text varchar, selector varchar, params varchar, database varchar, currentschema varchar)
     returns boolean
 as
 $$
-    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', database, 'schema', currentschema, 'selector_params', params))
+    internal.wrapper_qlike(object_construct('selector', selector, 'query_text', query_text, 'database', database, 'schema', currentschema, 'selector_params', params, 'query_hash', hash(query_text)::varchar))
 $$;
 
+-- Calls QLike for the queries which started on or after `since` (and before `until` unless it is null) and are not
+-- cached yet, once per distinct query text, for every selector used by tools.qlike(query_text, '<selector>'[, '<params>'])
+-- in a label condition. Run before labels are evaluated so that they are read from the cache, label conditions pass the
+-- query's own database and schema (see internal.label_condition_sql) so the requests are built from them too. Failed
+-- calls are not cached and are retried by the label itself.
+DROP PROCEDURE IF EXISTS INTERNAL.REFRESH_QLIKE_CACHE(timestamp);
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_QLIKE_CACHE(since timestamp, until timestamp)
+    RETURNS OBJECT
+    LANGUAGE SQL
+AS
+BEGIN
+    let has_url boolean;
+    call internal.has_config('url') into :has_url;
+    if (since is null or not has_url) then
+        return object_construct('selectors', 0, 'cached', 0);
+    end if;
+
+    -- Quotes within the selector and params literals are escaped by doubling them.
+    let pattern string := 'tools\\.qlike\\s*\\(\\s*query_text\\s*,\\s*\'(([^\']|\'\')*)\'\\s*(,\\s*\'(([^\']|\'\')*)\'\\s*)?\\)';
+    let rs resultset := (
+        select distinct
+            replace(regexp_substr(m.value::string, :pattern, 1, 1, 'ie', 1), '\'\'', '\'') as selector,
+            nullif(replace(regexp_substr(m.value::string, :pattern, 1, 1, 'ie', 4), '\'\'', '\''), '') as selector_params
+        from internal.labels l, lateral flatten(regexp_substr_all(l.condition, :pattern, 1, 1, 'i')) m);
+    let selectors cursor for rs;
+    let selector_count number := 0;
+    let cached number := 0;
+    for s in selectors do
+        let selector string := s.selector;
+        let selector_params string := s.selector_params;
+        insert into internal.qlike_cache (key, selector, selector_params, query_hash, database, schema, result, cached_at)
+            select key, :selector, :selector_params, request:query_hash, request:database, request:schema, response:result::boolean, current_timestamp()
+            from (
+                select key, request, internal.ef_qlike(request) as response
+                from (
+                    select internal.qlike_cache_key(request) as key, request
+                    from (
+                        select object_construct('selector', :selector, 'query_text', any_value(query_text), 'database', database_name, 'schema', schema_name,
+                            'selector_params', :selector_params, 'query_hash', hash(query_text)::varchar) as request
+                        from reporting.enriched_query_history
+                        where start_time >= :since and start_time < coalesce(:until, '9999-12-31'::timestamp) and query_text is not null
+                        group by hash(query_text), database_name, schema_name
+                    )
+                )
+                where key not in (select key from internal.qlike_cache)
+            )
+            where coalesce(length(response:error), 0) = 0;
+        let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+        cached := cached + inserted;
+        selector_count := selector_count + 1;
+    end for;
+    return object_construct('selectors', selector_count, 'cached', cached);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Labels still call QLike themselves, so a failure here only loses the caching.
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while refreshing the QLike cache.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        return object_construct('error', :sqlerrm);
+END;
+
 BEGIN
     CREATE FUNCTION IF NOT EXISTS internal.ef_notifications(request object)
         RETURNS VARIANT
@@ -0,0 +1,288 @@
+
+-- Daily aggregates of labeled query history. Reports read these instead of scanning labeled_query_history row by row
+-- whenever their filters only touch the rolled up dimensions. Labels are evaluated once, when a day is rolled up, and
+-- stored as the array of matching (ungrouped) label names and an object of group name to grouped label value.
+CREATE TABLE INTERNAL_REPORTING_MV.QUERY_HISTORY_DAILY_ROLLUP IF NOT EXISTS (
+    DAY TIMESTAMP_LTZ,
+    WAREHOUSE_ID NUMBER,
+    WAREHOUSE_NAME STRING,
+    USER_NAME STRING,
+    ROLE_NAME STRING,
+    QUERY_TYPE STRING,
+    EXECUTION_STATUS STRING,
+    LABELS ARRAY,
+    LABEL_GROUPS OBJECT,
+    QUERIES NUMBER,
+    UNLOADED_DIRECT_COMPUTE_CREDITS FLOAT,
+    DURATION NUMBER
+);
+
+-- Cost is derived when reading so that changes to the credit cost apply to already rolled up days.
+CREATE OR REPLACE VIEW REPORTING.QUERY_HISTORY_DAILY_ROLLUP
+COPY GRANTS
+AS
+SELECT
+    unloaded_direct_compute_credits * INTERNAL.GET_CREDIT_COST(warehouse_id) as COST,
+    *
+FROM INTERNAL_REPORTING_MV.QUERY_HISTORY_DAILY_ROLLUP;
+
+CREATE OR REPLACE FUNCTION INTERNAL.LABEL_DEFINITIONS_HASH()
+    RETURNS STRING
+AS
+$$
+    (select hash_agg(name, group_name, group_rank, condition, is_dynamic)::string from internal.labels)
+$$;
+
+-- The rollup is only usable by reports when it was built with the current label definitions.
+CREATE OR REPLACE FUNCTION INTERNAL.IS_DAILY_ROLLUP_CURRENT()
+    RETURNS BOOLEAN
+AS
+$$
+    (select count(*) > 0 from internal.config where key = 'DAILY_ROLLUP_LABELS' and value = internal.label_definitions_hash())
+$$;
+
+-- Recomputes the rollup for every day from the day of `since` up to and including the day of `until`, or up to now when
+-- `until` is null. A null `since` only rebuilds the rollup (in full) when the label definitions changed since it was
+-- last built.
+DROP PROCEDURE IF EXISTS INTERNAL.REFRESH_DAILY_ROLLUP(timestamp);
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_DAILY_ROLLUP(since timestamp, until timestamp)
+    RETURNS NUMBER
+    LANGUAGE SQL
+AS
+BEGIN
+    let labels_hash string := (select internal.label_definitions_hash());
+    let rollup_hash string := (CALL INTERNAL.get_config('DAILY_ROLLUP_LABELS'));
+    if (rollup_hash is null or rollup_hash <> labels_hash) then
+        since := 0::timestamp;
+        until := null;
+    end if;
+
+    if (since is null) then
+        return 0;
+    end if;
+    let from_day timestamp := date_trunc('day', since);
+    let to_day timestamp := '9999-12-31'::timestamp;
+    if (until is not null) then
+        to_day := dateadd(day, 1, date_trunc('day', dateadd(nanosecond, -1, until)));
+    end if;
+
+    let exprs object;
+    call internal.label_expressions() into :exprs;
+    let label_columns string := exprs:label_columns::string;
+    let group_columns string := exprs:group_columns::string;
+    let labels_expr string := exprs:labels::string;
+    let groups_expr string := exprs:groups::string;
+
+    let stmt string := 'insert into internal_reporting_mv.query_history_daily_rollup
+        (day, warehouse_id, warehouse_name, user_name, role_name, query_type, execution_status, labels, label_groups, queries, unloaded_direct_compute_credits, duration)
+        select day, warehouse_id, warehouse_name, user_name, role_name, query_type, execution_status, '
+            || labels_expr || ', ' || groups_expr || ', queries, unloaded_direct_compute_credits, duration
+        from (
+            select
+                date_trunc(\'day\', start_time) as day, warehouse_id, warehouse_name, user_name, role_name, query_type, execution_status'
+                || label_columns || group_columns || ',
+                count(*) as queries,
+                sum(unloaded_direct_compute_credits) as unloaded_direct_compute_credits,
+                sum(duration) as duration
+            from reporting.labeled_query_history
+            where start_time >= ? and start_time < ?
+            group by 1, 2, 3, 4, 5, 6, 7' || label_columns || group_columns || '
+        )';
+
+    delete from internal_reporting_mv.query_history_daily_rollup where day >= :from_day and day < :to_day;
+    execute immediate stmt using (from_day, to_day);
+    let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    CALL INTERNAL.SET_CONFIG('DAILY_ROLLUP_LABELS', :labels_hash);
+    return inserted;
+EXCEPTION
+    WHEN OTHER THEN
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while refreshing the daily query rollup.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
+
+-- Hourly aggregates of query history per warehouse. Hourly utilization reads these instead of expanding every query into
+-- hourly slices (reporting.enriched_query_history_hourly) on every read.
+CREATE TABLE INTERNAL_REPORTING_MV.QUERY_HISTORY_HOURLY IF NOT EXISTS (
+    HOUR TIMESTAMP_LTZ,
+    WAREHOUSE_ID NUMBER,
+    WAREHOUSE_NAME STRING,
+    QUERIES NUMBER,
+    UNLOADED_DIRECT_COMPUTE_CREDITS FLOAT,
+    DURATION NUMBER
+);
+
+-- Recomputes every hour from the hour of `since` up to and including the hour of `until` (or up to now) from the queries
+-- which ran in it. The table is built in full the first time, a null `since` only does that.
+DROP PROCEDURE IF EXISTS INTERNAL.REFRESH_QUERY_HISTORY_HOURLY(timestamp);
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_QUERY_HISTORY_HOURLY(since timestamp, until timestamp)
+    RETURNS NUMBER
+    LANGUAGE SQL
+AS
+BEGIN
+    let built string := (CALL INTERNAL.get_config('QUERY_HISTORY_HOURLY_BUILT'));
+    if (built is null) then
+        since := 0::timestamp;
+        until := null;
+    end if;
+    if (since is null) then
+        return 0;
+    end if;
+    let from_hour timestamp_ltz := date_trunc('hour', since);
+    let to_hour timestamp_ltz := '9999-12-31'::timestamp_ltz;
+    if (until is not null) then
+        to_hour := dateadd(hour, 1, date_trunc('hour', dateadd(nanosecond, -1, until)));
+    end if;
+
+    delete from internal_reporting_mv.query_history_hourly where hour >= :from_hour and hour < :to_hour;
+    insert into internal_reporting_mv.query_history_hourly (hour, warehouse_id, warehouse_name, queries, unloaded_direct_compute_credits, duration)
+        select st_period, warehouse_id, warehouse_name, count(*), sum(unloaded_direct_compute_credits), sum(duration)
+        from reporting.enriched_query_history_hourly
+        where end_time >= :from_hour and st_period >= :from_hour and st_period < :to_hour
+        group by st_period, warehouse_id, warehouse_name
+        order by st_period;
+    let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    CALL INTERNAL.SET_CONFIG('QUERY_HISTORY_HOURLY_BUILT', 'true');
+    return inserted;
+EXCEPTION
+    WHEN OTHER THEN
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while refreshing hourly query history.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
+
+-- Queries per query_parameterized_hash, day and warehouse. Repeated query reports read these instead of grouping every
+-- query by its hash, and the per-hash totals in QUERY_HASH_FREQUENCY are derived from them.
+CREATE TABLE INTERNAL_REPORTING_MV.QUERY_HASH_DAILY IF NOT EXISTS (
+    DAY TIMESTAMP_LTZ,
+    QUERY_PARAMETERIZED_HASH STRING,
+    WAREHOUSE_ID NUMBER,
+    WAREHOUSE_NAME STRING,
+    QUERIES NUMBER,
+    COSTED_QUERIES NUMBER,
+    UNLOADED_DIRECT_COMPUTE_CREDITS FLOAT,
+    FIRST_SEEN TIMESTAMP_LTZ,
+    LAST_SEEN TIMESTAMP_LTZ,
+    QUERY_TEXT STRING
+);
+
+CREATE OR REPLACE VIEW REPORTING.QUERY_HASH_DAILY
+COPY GRANTS
+AS
+SELECT
+    unloaded_direct_compute_credits * INTERNAL.GET_CREDIT_COST(warehouse_id) as COST,
+    *
+FROM INTERNAL_REPORTING_MV.QUERY_HASH_DAILY;
+
+-- Totals per query_parameterized_hash over the whole materialized history, used by tools.is_repeated_query and
+-- tools.is_ad_hoc_query.
+CREATE TABLE INTERNAL_REPORTING_MV.QUERY_HASH_FREQUENCY IF NOT EXISTS (
+    QUERY_PARAMETERIZED_HASH STRING,
+    QUERIES NUMBER,
+    FIRST_SEEN TIMESTAMP_LTZ,
+    LAST_SEEN TIMESTAMP_LTZ,
+    UNLOADED_DIRECT_COMPUTE_CREDITS FLOAT
+);
+
+-- The cost is the sum of the daily costs, which are priced per warehouse, so both views agree on the cost of a hash.
+CREATE OR REPLACE VIEW REPORTING.QUERY_HASH_FREQUENCY
+COPY GRANTS
+AS
+SELECT
+    c.COST,
+    f.*
+FROM INTERNAL_REPORTING_MV.QUERY_HASH_FREQUENCY f
+LEFT OUTER JOIN (
+    SELECT query_parameterized_hash, sum(cost) as COST FROM REPORTING.QUERY_HASH_DAILY GROUP BY query_parameterized_hash
+) c ON c.query_parameterized_hash = f.query_parameterized_hash;
+
+-- Recomputes the totals of every hash seen from `from_day` up to `to_day` (or up to now) from the daily counts. A null
+-- `from_day` recomputes all of them, e.g. after old days were removed.
+DROP PROCEDURE IF EXISTS INTERNAL.REFRESH_QUERY_HASH_TOTALS(timestamp);
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_QUERY_HASH_TOTALS(from_day timestamp, to_day timestamp)
+    RETURNS NUMBER
+    LANGUAGE SQL
+AS
+BEGIN
+    let touched number := 0;
+    if (from_day is null) then
+        delete from internal_reporting_mv.query_hash_frequency;
+        insert into internal_reporting_mv.query_hash_frequency (query_parameterized_hash, queries, first_seen, last_seen, unloaded_direct_compute_credits)
+            select query_parameterized_hash, sum(queries), min(first_seen), max(last_seen), sum(unloaded_direct_compute_credits)
+            from internal_reporting_mv.query_hash_daily
+            group by query_parameterized_hash;
+        touched := (select $1 from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    else
+        merge into internal_reporting_mv.query_hash_frequency f
+            using (
+                select query_parameterized_hash, sum(queries) as queries, min(first_seen) as first_seen, max(last_seen) as last_seen,
+                    sum(unloaded_direct_compute_credits) as unloaded_direct_compute_credits
+                from internal_reporting_mv.query_hash_daily
+                where query_parameterized_hash in (select query_parameterized_hash from internal_reporting_mv.query_hash_daily
+                    where day >= :from_day and day < coalesce(:to_day, '9999-12-31'::timestamp))
+                group by query_parameterized_hash
+            ) n
+            on f.query_parameterized_hash = n.query_parameterized_hash
+            when matched then update set queries = n.queries, first_seen = n.first_seen, last_seen = n.last_seen,
+                unloaded_direct_compute_credits = n.unloaded_direct_compute_credits
+            when not matched then insert (query_parameterized_hash, queries, first_seen, last_seen, unloaded_direct_compute_credits)
+                values (n.query_parameterized_hash, n.queries, n.first_seen, n.last_seen, n.unloaded_direct_compute_credits);
+        -- The merge reports inserted and updated rows separately.
+        touched := (select $1 + $2 from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    end if;
+    return touched;
+END;
+
+-- Recomputes the daily hash counts for every day from the day of `since` up to and including the day of `until` (or up
+-- to now), then the totals of the hashes in them. Like the hourly aggregates, everything is built the first time and a
+-- null `since` only does that. Until account usage has query_parameterized_hash (2023_06 bundle) there is nothing to
+-- count.
+DROP PROCEDURE IF EXISTS INTERNAL.REFRESH_QUERY_HASH_FREQUENCY(timestamp);
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_QUERY_HASH_FREQUENCY(since timestamp, until timestamp)
+    RETURNS NUMBER
+    LANGUAGE SQL
+AS
+BEGIN
+    -- The column rather than the bundle status, which is no longer ENABLED once the bundle is generally released.
+    let query_hash_enabled boolean := (select count(*) > 0 from information_schema.columns
+        where table_schema = 'REPORTING' and table_name = 'ENRICHED_QUERY_HISTORY' and column_name = 'QUERY_PARAMETERIZED_HASH');
+    if (not query_hash_enabled) then
+        return 0;
+    end if;
+    let built string := (CALL INTERNAL.get_config('QUERY_HASH_FREQUENCY_BUILT'));
+    if (built is null) then
+        since := 0::timestamp;
+        until := null;
+    end if;
+    if (since is null) then
+        return 0;
+    end if;
+    let from_day timestamp_ltz := date_trunc('day', since);
+    let to_day timestamp_ltz := '9999-12-31'::timestamp_ltz;
+    if (until is not null) then
+        to_day := dateadd(day, 1, date_trunc('day', dateadd(nanosecond, -1, until)));
+    end if;
+    -- A rebuild from the start recomputes all totals, which also drops hashes no longer in the history.
+    let rebuild boolean := since = 0::timestamp;
+
+    delete from internal_reporting_mv.query_hash_daily where day >= :from_day and day < :to_day;
+    insert into internal_reporting_mv.query_hash_daily
+        (day, query_parameterized_hash, warehouse_id, warehouse_name, queries, costed_queries, unloaded_direct_compute_credits, first_seen, last_seen, query_text)
+        select date_trunc('day', start_time), query_parameterized_hash, warehouse_id, warehouse_name,
+            count(*), count_if(unloaded_direct_compute_credits > 0), sum(unloaded_direct_compute_credits),
+            min(start_time), max(start_time), any_value(query_text)
+        from reporting.enriched_query_history
+        where start_time >= :from_day and start_time < :to_day and query_parameterized_hash is not null
+        group by 1, 2, 3, 4
+        order by 1;
+    let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    if (rebuild) then
+        call internal.refresh_query_hash_totals(null, null);
+    else
+        call internal.refresh_query_hash_totals(:from_day, :to_day);
+    end if;
+    CALL INTERNAL.SET_CONFIG('QUERY_HASH_FREQUENCY_BUILT', 'true');
+    return inserted;
+EXCEPTION
+    WHEN OTHER THEN
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while refreshing query hash frequencies.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
@@ -0,0 +1,192 @@
+
+-- Optional store of the label values for each query. When enabled, REPORTING.LABELED_QUERY_HISTORY reads the values of
+-- every materialized label from here instead of evaluating its condition for every row on every read.
+CREATE TABLE INTERNAL_REPORTING_MV.LABELED_QUERIES IF NOT EXISTS (QUERY_ID STRING, START_TIME TIMESTAMP_LTZ, LABELS ARRAY, LABEL_GROUPS OBJECT);
+
+CREATE OR REPLACE FUNCTION INTERNAL.IS_LABEL_STORE_ENABLED()
+    RETURNS BOOLEAN
+AS
+$$
+    (select count(*) > 0 from internal.config where key = 'LABEL_STORE_ENABLED' and value = 'true')
+$$;
+
+-- Re-evaluates all labels for queries which started on or after `since`, and before `until` unless it is null. Called by
+-- refresh_queries for new rows and by the query history backfill for the days it loaded.
+DROP PROCEDURE IF EXISTS INTERNAL.REFRESH_LABEL_STORE(timestamp);
+CREATE OR REPLACE PROCEDURE INTERNAL.REFRESH_LABEL_STORE(since timestamp, until timestamp)
+    RETURNS NUMBER
+    LANGUAGE SQL
+AS
+BEGIN
+    -- The store is filled for the first time by the backfill task.
+    let built boolean := (select count(*) > 0 from internal.config where key = 'LABEL_STORE_BUILT' and value = 'true');
+    let enabled boolean := (select internal.is_label_store_enabled());
+    if (not enabled or not built) then
+        return 0;
+    end if;
+
+    let exprs object;
+    call internal.label_expressions() into :exprs;
+    let stmt string := 'insert into internal_reporting_mv.labeled_queries (query_id, start_time, labels, label_groups)
+        select query_id, start_time, ' || exprs:labels::string || ', ' || exprs:groups::string || '
+        from reporting.labeled_query_history where start_time >= ? and start_time < ?';
+    let to_time timestamp := coalesce(until, '9999-12-31'::timestamp);
+
+    -- Removing the rows first means the labeled view evaluates every condition for them.
+    delete from internal_reporting_mv.labeled_queries where start_time >= :since and start_time < :to_time;
+    execute immediate stmt using (since, to_time);
+    let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    return inserted;
+END;
+
+-- Fills the store on first use and afterwards recomputes only the labels (or label groups) whose definition changed
+-- since their values were stored. The labeled view is rebuilt to read the newly materialized labels from the store.
+CREATE OR REPLACE PROCEDURE INTERNAL.BACKFILL_LABEL_STORE()
+    RETURNS OBJECT
+    LANGUAGE SQL
+AS
+BEGIN
+    let enabled boolean := (select internal.is_label_store_enabled());
+    if (not enabled) then
+        return object_construct('enabled', false);
+    end if;
+
+    let built boolean := (select count(*) > 0 from internal.config where key = 'LABEL_STORE_BUILT' and value = 'true');
+    if (not built) then
+        -- Snapshot the definitions first. A label changed while the store is being built is then backfilled again.
+        select name, is_group, definition from internal.label_definitions;
+        let definitions string := (select last_query_id());
+
+        let exprs object;
+        call internal.label_expressions() into :exprs;
+        truncate table internal_reporting_mv.labeled_queries;
+        execute immediate 'insert into internal_reporting_mv.labeled_queries (query_id, start_time, labels, label_groups)
+            select query_id, start_time, ' || exprs:labels::string || ', ' || exprs:groups::string || '
+            from reporting.labeled_query_history';
+
+        delete from internal.materialized_labels;
+        insert into internal.materialized_labels
+            select name, is_group, definition, current_timestamp() from TABLE(RESULT_SCAN(:definitions));
+        call internal.set_config('LABEL_STORE_BUILT', 'true');
+        call internal.update_label_view();
+        return object_construct('enabled', true, 'built', true);
+    end if;
+
+    -- Deleted labels are dropped from the stored values and new or changed ones recomputed, all of them by a single merge
+    -- over the queries which are still retained.
+    let labels_expr string := 's.labels';
+    let groups_expr string := 's.label_groups';
+    let removed cursor for
+        select m.name, m.is_group from internal.materialized_labels m
+        where not exists (select 1 from internal.label_definitions d where d.name = m.name and d.is_group = m.is_group);
+    for r in removed do
+        let literal string := '\'' || replace(r.name, '\'', '\\\'') || '\'';
+        if (r.is_group) then
+            groups_expr := 'object_delete(' || groups_expr || ', ' || literal || ')';
+        else
+            labels_expr := 'array_remove(' || labels_expr || ', ' || literal || '::variant)';
+        end if;
+    end for;
+
+    -- Snapshot the changed definitions, a label changed while the merge runs is then backfilled again.
+    select d.name, d.is_group, d.definition
+        from internal.label_definitions d
+        left outer join internal.materialized_labels m on m.name = d.name and m.is_group = d.is_group and m.definition = d.definition
+        where m.name is null;
+    let pending_qid string := (select last_query_id());
+    let backfilled array := array_construct();
+    let value_exprs string := '';
+    let pending cursor for select name, is_group from TABLE(RESULT_SCAN(?));
+    open pending using (pending_qid);
+    for p in pending do
+        let name string := p.name;
+        let is_group boolean := p.is_group;
+        let literal string := '\'' || replace(name, '\'', '\\\'') || '\'';
+        let value_column string := 'lq_value_' || array_size(backfilled);
+        let value_expr string := '';
+
+        if (not is_group) then
+            let condition string := (select any_value(internal.label_condition_sql(condition)) from internal.labels where name = :name and group_name is null);
+            value_expr := 'case when ' || condition || ' then true else false end';
+            labels_expr := 'array_cat(array_remove(' || labels_expr || ', ' || literal || '::variant), iff(m.' || value_column || ', array_construct(' || literal || '), array_construct()))';
+        else
+            let dynamic_condition string := (select any_value(internal.label_condition_sql(condition)) from internal.labels where group_name = :name and is_dynamic);
+            if (dynamic_condition is not null) then
+                value_expr := 'iff(' || dynamic_condition || ' is not null, ' || dynamic_condition || ', \'Other\')';
+            else
+                value_expr := (
+                    select 'case ' || listagg(' when ' || internal.label_condition_sql(condition) || ' then \'' || replace(name, '\'', '\\\'') || '\'', '') within group (order by group_rank) || ' else \'Other\' end'
+                    from internal.labels where group_name = :name and not is_dynamic);
+            end if;
+            groups_expr := 'object_insert(' || groups_expr || ', ' || literal || ', m.' || value_column || ', true)';
+        end if;
+        value_exprs := value_exprs || ', ' || value_expr || ' as ' || value_column;
+        backfilled := array_append(backfilled, name);
+    end for;
+
+    let changed boolean := (labels_expr <> 's.labels' or groups_expr <> 's.label_groups');
+    if (changed) then
+        -- Older rows were removed from the store by the retention task.
+        let history_days string := (CALL INTERNAL.get_config('HISTORY_RETENTION_DAYS'));
+        let days number := coalesce(try_to_number(history_days), 0);
+        let cutoff timestamp_ltz := 0::timestamp_ltz;
+        if (days > 0) then
+            cutoff := dateadd(day, -1 * days, current_timestamp());
+        end if;
+        execute immediate 'merge into internal_reporting_mv.labeled_queries s
+            using (select query_id as lq_query_id' || value_exprs || ' from reporting.enriched_query_history where start_time >= ?) m
+            on s.query_id = m.lq_query_id
+            when matched then update set labels = ' || labels_expr || ', label_groups = ' || groups_expr using (cutoff);
+
+        delete from internal.materialized_labels m
+            where not exists (select 1 from internal.label_definitions d where d.name = m.name and d.is_group = m.is_group);
+        delete from internal.materialized_labels m
+            using (select name, is_group from TABLE(RESULT_SCAN(:pending_qid))) p
+            where m.name = p.name and m.is_group = p.is_group;
+        insert into internal.materialized_labels
+            select name, is_group, definition, current_timestamp() from TABLE(RESULT_SCAN(:pending_qid));
+        call internal.update_label_view();
+    end if;
+    return object_construct('enabled', true, 'built', false, 'backfilled', backfilled);
+EXCEPTION
+    WHEN OTHER THEN
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while backfilling the label store.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
+
+-- Runs the backfill in the background after a label was created or changed.
+CREATE OR REPLACE PROCEDURE INTERNAL.START_LABEL_BACKFILL()
+    RETURNS BOOLEAN
+    LANGUAGE SQL
+AS
+BEGIN
+    let enabled boolean := (select internal.is_label_store_enabled());
+    if (not enabled) then
+        return false;
+    end if;
+    execute task TASKS.LABEL_BACKFILL;
+    return true;
+EXCEPTION
+    WHEN OTHER THEN
+        -- The task only exists once finalize_setup has run. Its daily schedule picks up anything left pending.
+        SYSTEM$LOG_INFO('Unable to start label backfill task. ' || :SQLCODE || ': ' || :SQLERRM);
+        return false;
+END;
+
+CREATE OR REPLACE PROCEDURE INTERNAL.ENABLE_LABEL_STORE(enabled boolean)
+    RETURNS BOOLEAN
+    LANGUAGE SQL
+AS
+BEGIN
+    if (enabled) then
+        call internal.set_config('LABEL_STORE_ENABLED', 'true');
+        call internal.start_label_backfill();
+    else
+        call internal.set_config('LABEL_STORE_ENABLED', 'false');
+        call internal.set_config('LABEL_STORE_BUILT', 'false');
+        call internal.update_label_view();
+        truncate table internal_reporting_mv.labeled_queries;
+        delete from internal.materialized_labels;
+    end if;
+    return enabled;
+END;
@@ -0,0 +1,115 @@
+
+-- Task logs older than the retention are compacted into one row per log and day before they are removed.
+CREATE TABLE INTERNAL.TASK_LOG_DAILY IF NOT EXISTS (log_name string, day date, runs number, failures number);
+CREATE TABLE INTERNAL.TASK_RETENTION IF NOT EXISTS (run timestamp, success boolean, input variant, output variant);
+
+-- Removes rows older than the configured retention:
+--  * TASK_LOG_RETENTION_DAYS (default 90) for the task logs and probe actions. The latest successful run of each log is
+--    always kept since refreshes fall back to it.
+--  * HISTORY_RETENTION_DAYS (default unset, keep everything) for the materialized query history, warehouse sessions and
+--    the tables derived from them.
+--  * QLIKE_CACHE_DAYS (default 30) for cached QLike results.
+CREATE OR REPLACE PROCEDURE INTERNAL.APPLY_RETENTION()
+    RETURNS OBJECT
+    LANGUAGE SQL
+AS
+BEGIN
+    let run timestamp := current_timestamp();
+    let log_days string := (CALL INTERNAL.get_config('TASK_LOG_RETENTION_DAYS'));
+    let history_days string := (CALL INTERNAL.get_config('HISTORY_RETENTION_DAYS'));
+    let qlike_days string := (CALL INTERNAL.get_config('QLIKE_CACHE_DAYS'));
+    let input variant := object_construct('task_log_retention_days', log_days, 'history_retention_days', history_days, 'qlike_cache_days', qlike_days);
+    let deleted object := object_construct();
+    BEGIN
+        let log_cutoff timestamp := dateadd(day, -1 * coalesce(try_to_number(log_days), 90), :run);
+        let logs cursor for
+            select column1 as log_name, column2 as time_column, column3 as success_expr from values
+                ('INTERNAL.TASK_QUERY_HISTORY', 'run', 'success'),
+                ('INTERNAL.TASK_WAREHOUSE_EVENTS', 'run', 'success'),
+                ('INTERNAL.TASK_PROBE_MONITORING', 'run', 'success'),
+                ('INTERNAL.TASK_RETENTION', 'run', 'success'),
+                ('INTERNAL.QUOTA_TASK_HISTORY', 'start_time', 'credits_used is not null'),
+                ('INTERNAL.PROBE_ACTIONS', 'action_time', 'outcome <> \'Caught unhandled exception\'');
+        for l in logs do
+            let log_name string := l.log_name;
+            let keep_after string := '(select max(' || l.time_column || ') from ' || log_name || ' where ' || l.success_expr || ')';
+            let old_rows string := l.time_column || ' < ? and ' || l.time_column || ' < ' || keep_after;
+            execute immediate 'merge into internal.task_log_daily d
+                using (
+                    select \'' || log_name || '\' as log_name, to_date(' || l.time_column || ') as day, count(*) as runs, count_if(not (' || l.success_expr || ')) as failures
+                    from ' || log_name || ' where ' || old_rows || '
+                    group by 2
+                ) n
+                on d.log_name = n.log_name and d.day = n.day
+                when matched then update set runs = d.runs + n.runs, failures = d.failures + n.failures
+                when not matched then insert (log_name, day, runs, failures) values (n.log_name, n.day, n.runs, n.failures)' using (log_cutoff);
+            execute immediate 'delete from ' || log_name || ' where ' || old_rows using (log_cutoff);
+            let log_deleted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, log_name, log_deleted);
+        end for;
+
+        -- QLike results are expired whatever the history retention, QLike itself may match differently by now.
+        let qlike_cutoff timestamp := dateadd(day, -1 * coalesce(try_to_number(qlike_days), 30), :run);
+        delete from internal.qlike_cache where cached_at < :qlike_cutoff;
+        let qlike_deleted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+        deleted := object_insert(deleted, 'QLIKE_CACHE', qlike_deleted);
+
+        let days number := try_to_number(history_days);
+        if (days > 0) then
+            let history_cutoff timestamp := dateadd(day, -1 * days, :run);
+            let history_deleted number := 0;
+            delete from internal_reporting_mv.query_history_complete_and_daily where end_time < :history_cutoff;
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'QUERY_HISTORY_COMPLETE_AND_DAILY', history_deleted);
+            delete from internal_reporting_mv.cluster_and_warehouse_sessions_complete_and_daily where session_end < :history_cutoff;
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'CLUSTER_AND_WAREHOUSE_SESSIONS_COMPLETE_AND_DAILY', history_deleted);
+            delete from internal_reporting_mv.warehouse_session_stats where et < :history_cutoff;
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'WAREHOUSE_SESSION_STATS', history_deleted);
+            delete from internal_reporting_mv.labeled_queries where start_time < :history_cutoff;
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'LABELED_QUERIES', history_deleted);
+            delete from internal_reporting_mv.query_tables where coalesce(last_seen, 0::timestamp_ltz) < :history_cutoff;
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'QUERY_TABLES', history_deleted);
+            -- Whole days only, a partially removed day would under report.
+            delete from internal_reporting_mv.query_history_daily_rollup where day < date_trunc('day', :history_cutoff);
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'QUERY_HISTORY_DAILY_ROLLUP', history_deleted);
+            delete from internal_reporting_mv.query_history_hourly where hour < date_trunc('day', :history_cutoff);
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'QUERY_HISTORY_HOURLY', history_deleted);
+            delete from internal_reporting_mv.warehouse_daily_utilization where period < date_trunc('day', :history_cutoff);
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'WAREHOUSE_DAILY_UTILIZATION', history_deleted);
+            delete from internal_reporting_mv.query_hash_daily where day < date_trunc('day', :history_cutoff);
+            history_deleted := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+            deleted := object_insert(deleted, 'QUERY_HASH_DAILY', history_deleted);
+            if (history_deleted > 0) then
+                call internal.refresh_query_hash_totals(null, null);
+            end if;
+        end if;
+        insert into internal.task_retention select :run, true, :input, :deleted;
+        return deleted;
+    EXCEPTION
+        WHEN OTHER THEN
+            SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while applying retention.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+            insert into internal.task_retention select :run, false, :input, OBJECT_CONSTRUCT('Error type', 'Other error', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate)::variant;
+            RAISE;
+    END;
+END;
+
+-- Row counts and storage of the tables maintained by the app, largest first.
+CREATE OR REPLACE PROCEDURE INTERNAL.TABLE_STORAGE_STATS()
+    RETURNS TABLE (table_schema string, table_name string, row_count number, bytes number, last_altered timestamp_ltz)
+    LANGUAGE SQL
+AS
+BEGIN
+    let rs resultset := (
+        select table_schema, table_name, row_count, bytes, last_altered
+        from information_schema.tables
+        where table_schema in ('INTERNAL', 'INTERNAL_REPORTING_MV') and table_type = 'BASE TABLE'
+        order by bytes desc nulls last, table_schema, table_name);
+    return table(rs);
+END;
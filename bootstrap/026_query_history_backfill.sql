@@ -0,0 +1,95 @@
+
+-- Day ranges of query history still to be materialized after a (re)load of query history. refresh_queries only loads
+-- queries which started after the newest range, older ones are backfilled newest day first so that recent reports are
+-- available early. Days go from PENDING to LOADED once materialized and to DONE once the derived tables include them.
+CREATE TABLE INTERNAL.QUERY_HISTORY_BACKFILL IF NOT EXISTS (chunk_start timestamp_ltz, chunk_end timestamp_ltz, status string, rows number, finished_at timestamp_ltz);
+
+-- Splits the history before the boundary into days to backfill and returns the boundary. Queries still running are left
+-- to refresh_queries, so the boundary moves back to the oldest of them.
+CREATE OR REPLACE PROCEDURE INTERNAL.PLAN_QUERY_HISTORY_BACKFILL()
+    RETURNS TIMESTAMP_LTZ
+    LANGUAGE SQL
+AS
+BEGIN
+    let boundary timestamp_ltz := (
+        select least(date_trunc('day', dateadd(day, -1, current_timestamp())), coalesce(min(start_time), current_timestamp()))
+        from account_usage.query_history
+        where start_time > end_time and start_time >= dateadd(day, -14, current_timestamp()));
+    let oldest timestamp_ltz := (select coalesce(min(start_time), :boundary) from account_usage.query_history);
+    let retention_days number := (select try_to_number(value) from internal.config where key = 'HISTORY_RETENTION_DAYS');
+    if (retention_days > 0) then
+        oldest := greatest(oldest, dateadd(day, -1 * retention_days, current_timestamp()));
+    end if;
+
+    delete from internal.query_history_backfill;
+    insert into internal.query_history_backfill (chunk_start, chunk_end, status)
+        select greatest(dateadd(day, -1 * (n + 1), :boundary), :oldest), dateadd(day, -1 * n, :boundary), 'PENDING'
+        from (select row_number() over (order by seq4()) - 1 as n from table(generator(rowcount => 3660)))
+        where dateadd(day, -1 * n, :boundary) > :oldest;
+    return boundary;
+END;
+
+-- Materializes pending days, newest first, for up to max_minutes. A day interrupted by a failure is loaded again on the
+-- next run. The tables derived from query history are then refreshed for the loaded days, and only once that succeeded
+-- are they DONE, so a failed refresh is retried by the next run.
+CREATE OR REPLACE PROCEDURE INTERNAL.RUN_QUERY_HISTORY_BACKFILL(max_minutes number)
+    RETURNS OBJECT
+    LANGUAGE SQL
+AS
+BEGIN
+    let started timestamp_ltz := current_timestamp();
+    let processed number := 0;
+    let chunks cursor for select chunk_start, chunk_end from internal.query_history_backfill where status = 'PENDING' order by chunk_start desc;
+    for c in chunks do
+        if (datediff(minute, started, current_timestamp()) >= max_minutes) then
+            break;
+        end if;
+        let chunk_start timestamp_ltz := c.chunk_start;
+        let chunk_end timestamp_ltz := c.chunk_end;
+        delete from internal_reporting_mv.query_history_complete_and_daily where filterts >= :chunk_start and filterts < :chunk_end;
+        let where_clause varchar := 'NOT INCOMPLETE AND FILTERTS >= to_timestamp_ltz(\'' || chunk_start || '\') AND FILTERTS < to_timestamp_ltz(\'' || chunk_end || '\') ORDER BY TO_DATE(START_TIME), WAREHOUSE_NAME';
+        let inserted number;
+        call internal.generate_insert_statement('INTERNAL_REPORTING_MV', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'INTERNAL_REPORTING', 'QUERY_HISTORY_COMPLETE_AND_DAILY', :where_clause) into :inserted;
+        update internal.query_history_backfill set status = 'LOADED', rows = :inserted where chunk_start = :chunk_start;
+        processed := processed + 1;
+    end for;
+
+    -- Only the loaded days are refreshed, in one transaction so that the deletes and inserts of the refreshes don't
+    -- interleave with those of refresh_queries.
+    let oldest timestamp_ltz := (select min(chunk_start) from internal.query_history_backfill where status = 'LOADED');
+    let newest timestamp_ltz := (select max(chunk_end) from internal.query_history_backfill where status = 'LOADED');
+    if (oldest is not null) then
+        BEGIN TRANSACTION;
+        call internal.refresh_query_tables(:oldest, :newest);
+        call internal.refresh_query_hash_frequency(:oldest, :newest);
+        call internal.refresh_qlike_cache(:oldest, :newest);
+        call internal.refresh_label_store(:oldest, :newest);
+        call internal.refresh_daily_rollup(:oldest, :newest);
+        call internal.refresh_query_history_hourly(:oldest, :newest);
+        call internal.refresh_warehouse_daily_utilization(:oldest, :newest);
+        update internal.query_history_backfill set status = 'DONE', finished_at = current_timestamp() where status = 'LOADED';
+        COMMIT;
+    end if;
+    let remaining number := (select count(*) from internal.query_history_backfill where status <> 'DONE');
+    return object_construct('processed', processed, 'remaining', remaining);
+EXCEPTION
+    WHEN OTHER THEN
+        ROLLBACK;
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred while backfilling query history.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
+
+-- Runs the backfill in the background after refresh_queries planned it.
+CREATE OR REPLACE PROCEDURE INTERNAL.START_QUERY_HISTORY_BACKFILL()
+    RETURNS BOOLEAN
+    LANGUAGE SQL
+AS
+BEGIN
+    execute task TASKS.QUERY_HISTORY_BACKFILL;
+    return true;
+EXCEPTION
+    WHEN OTHER THEN
+        -- The task only exists once finalize_setup has run. Its hourly schedule picks up anything left pending.
+        SYSTEM$LOG_INFO('Unable to start query history backfill task. ' || :SQLCODE || ': ' || :SQLERRM);
+        return false;
+END;
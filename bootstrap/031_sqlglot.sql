@@ -17,11 +17,101 @@ def test(sql, database, schema):
         return list()
 $$;
 
+-- Batch variant of tools.tables. Statements are parsed once per (query_hash, database, schema), both within a batch
+-- and across batches handled by the same process, so repeated query texts are only parsed once.
+create or replace function tools.tables_vectorized(sql varchar, database varchar, schema varchar, query_hash varchar)
+returns array
+language python
+runtime_version=3.8
+packages=('pandas')
+imports=('{{stage}}/python/sqlglot.zip')
+handler='tables'
+as
+$$
+import pandas
+from _snowflake import vectorized
+from sqlglot import parse_one
+import sqlglot.expressions as exp
+
+MAX_MEMO_SIZE = 100000
+memo = {}
+
+def parse(sql, database, schema):
+    try:
+        return list(f"{database if table.catalog == '' else table.catalog}.{schema if table.db == '' else table.db}.{table.name}".upper() for
+        table in parse_one(sql, read='snowflake').find_all(exp.Table))
+    except:
+        return list()
+
+@vectorized(input=pandas.DataFrame)
+def tables(df):
+    results = []
+    for sql, database, schema, query_hash in df.itertuples(index=False):
+        if query_hash is None:
+            results.append(parse(sql, database, schema))
+            continue
+        key = (query_hash, database, schema)
+        found = memo.get(key)
+        if found is None:
+            found = parse(sql, database, schema)
+            if len(memo) >= MAX_MEMO_SIZE:
+                memo.clear()
+            memo[key] = found
+        results.append(found)
+    return pandas.Series(results)
+$$;
+
+-- Table references of every materialized query text, per database and schema it was resolved against. Filled by
+-- refresh_queries, texts not seen since the history retention are removed by apply_retention.
+create table internal_reporting_mv.query_tables if not exists (text_hash number, query_hash varchar, database_name varchar, schema_name varchar, tables array, last_seen timestamp_ltz);
+alter table internal_reporting_mv.query_tables add column if not exists last_seen timestamp_ltz;
+
+-- Parses the texts of the queries which started on or after `since`, and before `until` unless it is null.
+drop procedure if exists internal.refresh_query_tables(timestamp);
+create or replace procedure internal.refresh_query_tables(since timestamp, until timestamp)
+returns number
+language sql
+as
+begin
+    -- query_parameterized_hash only exists once the 2023_06 bundle is enabled. Texts that differ only in literals
+    -- reference the same tables, so it lets the parser skip those.
+    let query_hash_enabled boolean := (select system$BEHAVIOR_CHANGE_BUNDLE_STATUS('2023_06') = 'ENABLED');
+    let key_expr string := iff(query_hash_enabled, 'coalesce(query_parameterized_hash, hash(query_text)::varchar)', 'hash(query_text)::varchar');
+    let to_time timestamp := coalesce(until, '9999-12-31'::timestamp);
+    let texts string := '(
+            select hash(query_text) as text_hash, database_name, schema_name, any_value(' || key_expr || ') as query_hash,
+                any_value(query_text) as query_text, max(start_time) as last_seen
+            from reporting.enriched_query_history
+            where start_time >= ? and start_time < ? and query_text is not null
+            group by text_hash, database_name, schema_name
+        )';
+    -- Texts parsed before are only marked as seen again.
+    execute immediate 'update internal_reporting_mv.query_tables t set last_seen = greatest_ignore_nulls(t.last_seen, q.last_seen)
+        from ' || texts || ' q
+        where t.text_hash = q.text_hash and equal_null(t.database_name, q.database_name) and equal_null(t.schema_name, q.schema_name)'
+        using (since, to_time);
+    execute immediate 'insert into internal_reporting_mv.query_tables (text_hash, query_hash, database_name, schema_name, tables, last_seen)
+        select text_hash, query_hash, database_name, schema_name, tools.tables_vectorized(query_text, database_name, schema_name, query_hash), last_seen
+        from ' || texts || ' q
+        where not exists (select 1 from internal_reporting_mv.query_tables t
+            where t.text_hash = q.text_hash and equal_null(t.database_name, q.database_name) and equal_null(t.schema_name, q.schema_name))
+        order by query_hash'
+        using (since, to_time);
+    let inserted number := (select * from TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+    return inserted;
+end;
+
+-- Resolves against the current database and schema, so only texts materialized for them are read from query_tables and
+-- the others are parsed. Label conditions use the variant of tools.tables_contains taking the query's own database and
+-- schema instead.
 create or replace function tools.tables(sql varchar)
 returns array
 as
 $$
-tools.tables(sql, current_database(), current_schema())
+coalesce(
+    (select any_value(t.tables) from internal_reporting_mv.query_tables t
+        where t.text_hash = hash(sql) and equal_null(t.database_name, current_database()) and equal_null(t.schema_name, current_schema())),
+    tools.tables(sql, current_database(), current_schema()))
 $$;
 
 create or replace function tools.tables_contains(sql varchar, tbl varchar)
@@ -30,3 +120,15 @@ as
 $$
 array_contains(upper(tbl)::variant, tools.tables(sql))
 $$;
+
+-- Resolves against the database and schema the query ran in. Label conditions calling tools.tables_contains(query_text,
+-- ...) are evaluated with this variant, which reads the references materialized by refresh_queries.
+create or replace function tools.tables_contains(sql varchar, database varchar, schema varchar, tbl varchar)
+returns boolean
+as
+$$
+array_contains(upper(tbl)::variant, coalesce(
+    (select any_value(t.tables) from internal_reporting_mv.query_tables t
+        where t.text_hash = hash(sql) and equal_null(t.database_name, database) and equal_null(t.schema_name, schema)),
+    tools.tables(sql, database, schema)))
+$$;
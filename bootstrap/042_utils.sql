@@ -7,18 +7,19 @@ begin
     if (:enabled) then
        execute immediate $$
     begin
+-- Hash counts are maintained by internal.refresh_query_hash_frequency whenever query history is refreshed.
 create or replace function tools.is_repeated_query(qph varchar, size number)
 returns boolean
 immutable
 as
-'qph in (select query_parameterized_hash from reporting.enriched_query_history group by query_parameterized_hash having count(query_parameterized_hash) > size)'
+'qph in (select query_parameterized_hash from internal_reporting_mv.query_hash_frequency where queries > size)'
 ;
 
 create or replace function tools.is_ad_hoc_query(qph varchar, size number)
 returns boolean
 immutable
 as
-'qph in (select query_parameterized_hash from reporting.enriched_query_history group by query_parameterized_hash having count(query_parameterized_hash) < size)'
+'qph in (select query_parameterized_hash from internal_reporting_mv.query_hash_frequency where queries < size)'
 ;
     end;
     $$;
@@ -51,6 +51,13 @@ CREATE OR REPLACE TASK TASKS.QUERY_HISTORY_MAINTENANCE
     AS
     CALL INTERNAL.refresh_queries(true);
 
+CREATE OR REPLACE TASK TASKS.QUERY_HISTORY_BACKFILL
+    SCHEDULE = '60 minute'
+    ALLOW_OVERLAPPING_EXECUTION = FALSE
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = "LARGE"
+    AS
+    CALL INTERNAL.RUN_QUERY_HISTORY_BACKFILL(50);
+
 CREATE OR REPLACE TASK TASKS.SFUSER_MAINTENANCE
     SCHEDULE = '1440 minute'
     ALLOW_OVERLAPPING_EXECUTION = FALSE
@@ -63,6 +70,20 @@ CREATE OR REPLACE TASK TASKS.SFUSER_MAINTENANCE
         COMMIT;
     END;
 
+CREATE OR REPLACE TASK TASKS.LABEL_BACKFILL
+    SCHEDULE = '1440 minute'
+    ALLOW_OVERLAPPING_EXECUTION = FALSE
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = "LARGE"
+    AS
+    CALL INTERNAL.BACKFILL_LABEL_STORE();
+
+CREATE OR REPLACE TASK TASKS.RETENTION_MAINTENANCE
+    SCHEDULE = '1440 minute'
+    ALLOW_OVERLAPPING_EXECUTION = FALSE
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = "XSMALL"
+    AS
+    CALL INTERNAL.APPLY_RETENTION();
+
 -- enable the query_hash column in the query_history view
 call INTERNAL.ENABLE_QUERY_HASH();
 
@@ -111,84 +132,9 @@ CREATE OR REPLACE TASK TASKS.PROBE_MONITORING
     ALLOW_OVERLAPPING_EXECUTION = FALSE
     USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = "XSMALL"
     AS
-DECLARE
-  sql STRING;
 BEGIN
     SYSTEM$LOG_DEBUG('probe_monitoring task beginning');
-    CALL INTERNAL.GET_PROBE_SELECT() into :sql;
-    execute immediate sql;
-    LET c1 CURSOR FOR SELECT probe_name, query_id, to_json(action_taken) as action_takens, action_taken, query_text, user_name, warehouse_name, start_time FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
-    FOR act IN c1 DO
-        let outcome string := '';
-        if (act.action_taken:CANCEL::boolean) then
-            let id string := act.query_id;
-            select SYSTEM$CANCEL_QUERY(:id);
-            BEGIN
-                outcome := (SELECT * FROM TABLE(RESULT_SCAN(LAST_QUERY_ID())));
-            EXCEPTION
-                when EXPRESSION_ERROR THEN
-                    outcome := SQLERRM;
-                WHEN other THEN
-                    outcome := SQLERRM;
-            END;
-        end if;
-
-        -- Send emails
-        let emails string := act.action_taken:EMAIL;
-        if (length(emails) > 1) then
-            let subject string := 'Sundeck OpsCenter probe [{probe_name}] matched query.';
-            let body string := '
-                Query Id: {query_id}\n
-                Query User: {user_name}\n
-                Warehouse Name: {warehouse_name}\n
-                Start Time: {start_time}\n
-                Query Text: \n{query_text}
-            ';
-            let dict variant := OBJECT_CONSTRUCT('query_id', act.query_id, 'query_text', act.query_text, 'user_name', act.user_name, 'warehouse_name', act.warehouse_name, 'start_time', act.start_time, 'probe_name', act.probe_name);
-            let outcome2 string := '';
-            BEGIN
-                outcome2 := (select to_json(INTERNAL.NOTIFICATIONS(tools.templatejs(:body, :dict), tools.templatejs(:subject, :dict), 'email', :emails)));
-            EXCEPTION
-                when EXPRESSION_ERROR THEN
-                    outcome2 := SQLERRM;
-                WHEN other THEN
-                    outcome2 := SQLERRM;
-            END;
-            outcome := outcome || outcome2;
-        end if;
-
-        -- Send slack messages
-        let slackDests string := act.action_taken:SLACK;
-        IF (length(slackDests) > 1) THEN
-            let slackResult string := '';
-            let dict variant := OBJECT_CONSTRUCT('bt', CHAR(UNICODE('\u0060')), 'query_id', act.query_id, 'query_text', act.query_text, 'user_name', act.user_name, 'warehouse_name', act.warehouse_name, 'start_time', act.start_time, 'probe_name', act.probe_name);
-            let message string := '
-Sundeck OpsCenter probe [{probe_name}] matched query.\n
-Query Id: {bt}{query_id}{bt}\n
-Query User: {user_name}\n
-Warehouse Name: {bt}{warehouse_name}{bt}\n
-Start Time: {bt}{start_time}{bt}\n
-Query Text: {bt}{bt}{bt}{query_text}{bt}{bt}{bt}
-            ';
-           BEGIN
-               slackResult := (select to_json(INTERNAL.NOTIFICATIONS(tools.templatejs(:message, :dict), 'unused', 'slack', :slackDests)));
-           EXCEPTION
-           WHEN other THEN
-               slackResult := SQLERRM;
-           END;
-           outcome := outcome || slackResult;
-       END IF;
-
-       let name string := act.PROBE_NAME;
-       let action string := act.ACTION_TAKENS;
-       let query_id string := act.QUERY_ID;
-       insert into internal.probe_actions select CURRENT_TIMESTAMP(), :name, :query_id, parse_json(:action), :outcome;
-   END FOR;
-EXCEPTION
-   WHEN OTHER THEN
-       SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Unhandled exception occurred during probe monitoring.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
-       insert into internal.probe_actions select CURRENT_TIMESTAMP(), '', '', null::VARIANT, 'Caught unhandled exception';
-       RAISE;
+    CALL INTERNAL.RUN_PROBE_MONITOR_LOOP();
 END;
 
 CREATE OR REPLACE TASK TASKS.USER_LIMITS_MAINTENANCE
@@ -321,6 +267,9 @@ call ADMIN.UPDATE_PROBE_MONITOR_RUNNING();
 alter task TASKS.SFUSER_MAINTENANCE resume;
 alter task TASKS.WAREHOUSE_EVENTS_MAINTENANCE resume;
 alter task TASKS.QUERY_HISTORY_MAINTENANCE resume;
+alter task TASKS.QUERY_HISTORY_BACKFILL resume;
+alter task TASKS.LABEL_BACKFILL resume;
+alter task TASKS.RETENTION_MAINTENANCE resume;
 
 -- Kick off the maintenance tasks.
 execute task TASKS.SFUSER_MAINTENANCE;
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import pytest
 from common_utils import generate_unique_name
 from common_utils import run_proc
@@ -300,6 +301,21 @@ def test_validate_predefined_label(conn, timestamp_string):
     assert run_proc(conn, sql) is None
 
 
+def test_preview_label(conn, timestamp_string):
+    sql = "call INTERNAL.PREVIEW_LABEL('rows_produced > 100', false, 7, 10);"
+    preview = json.loads(run_proc(conn, sql))
+    assert preview["sampled_queries"] <= preview["total_queries"]
+    assert (
+        preview["matched_cost_low"]
+        <= preview["matched_cost"]
+        <= preview["matched_cost_high"]
+    )
+    assert len(preview["top_hashes"]) <= 10
+
+    sql = "call INTERNAL.PREVIEW_LABEL('rows_produced >', false, 7, 10);"
+    assert "Invalid condition SQL" in json.loads(run_proc(conn, sql))["error"]
+
+
 def test_initialize_labels(conn, timestamp_string):
     # step 1: clean up the labels table and predefined_labels table
     sql = "truncate table internal.labels"
@@ -458,3 +474,42 @@ def test_migrate_predefined_labels(conn, timestamp_string):
 
     sql = "delete from internal.config where KEY = 'LABELS_INITED'"
     run_sql(conn, sql)
+
+
+def test_label_store_follows_label_changes(conn, timestamp_string):
+    enabled = row_count(
+        conn,
+        "select count(*) from internal.config where key = 'LABEL_STORE_ENABLED' and value = 'true'",
+    )
+    run_sql(conn, "call internal.enable_label_store(true);")
+    run_sql(conn, "call internal.backfill_label_store();")
+
+    label = generate_unique_name("label", timestamp_string)
+    stored = f"""select count(*) from internal_reporting_mv.labeled_queries s
+        join reporting.enriched_query_history q on q.query_id = s.query_id
+        where array_contains('{label}'::variant, s.labels) <> coalesce({{condition}}, false)"""
+    try:
+        sql = f"call ADMIN.CREATE_LABEL('{label}', NULL, NULL, 'rows_produced > 100');"
+        assert (
+            run_proc(conn, sql) is None
+        ), "Stored procedure did not return NULL value!"
+        run_sql(conn, "call internal.backfill_label_store();")
+        sql = stored.format(condition="q.rows_produced > 100")
+        assert row_count(conn, sql) == 0, "Stored label differs from its condition!"
+
+        sql = f"call ADMIN.UPDATE_LABEL('{label}', '{label}', NULL, NULL, 'compilation_time > 3000');"
+        assert (
+            run_proc(conn, sql) is None
+        ), "Stored procedure did not return NULL value!"
+        run_sql(conn, "call internal.backfill_label_store();")
+        sql = stored.format(condition="q.compilation_time > 3000")
+        assert row_count(conn, sql) == 0, "Stored label differs from its new condition!"
+
+        sql = f"call ADMIN.DELETE_LABEL('{label}');"
+        assert run_proc(conn, sql) == "done", "Stored procedure did not return 'done'!"
+        run_sql(conn, "call internal.backfill_label_store();")
+        sql = stored.format(condition="false")
+        assert row_count(conn, sql) == 0, "Deleted label is still stored!"
+    finally:
+        if not enabled:
+            run_sql(conn, "call internal.enable_label_store(false);")
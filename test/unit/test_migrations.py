@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from common_utils import generate_unique_name
+from common_utils import run_proc
+from common_utils import run_sql
+
+
+def test_migration_records_schema_fingerprint(conn):
+    run_proc(conn, "call internal.migrate_queries();")
+    fingerprint = run_proc(conn, "call internal.schema_fingerprint('QUERY_HISTORY');")
+    sql = "select value from internal.config where key = 'QUERY_HISTORY_SCHEMA_FINGERPRINT'"
+    assert (
+        run_sql(conn, sql) == fingerprint
+    ), "Migration did not record the schema fingerprint!"
+
+    # refreshing with an unchanged fingerprint skips the migration
+    run_proc(conn, "call internal.refresh_queries(true);")
+    sql = """select output:migration_skipped::boolean from internal.task_query_history
+        where success order by run desc limit 1"""
+    assert run_sql(conn, sql) == "True", "Unchanged schema was migrated again!"
+
+
+def test_schema_fingerprint_changes_with_labels(conn, timestamp_string):
+    fingerprint = run_proc(conn, "call internal.schema_fingerprint('QUERY_HISTORY');")
+    label = generate_unique_name("label", timestamp_string)
+    run_proc(
+        conn, f"call ADMIN.CREATE_LABEL('{label}', NULL, NULL, 'rows_produced > 100');"
+    )
+    try:
+        assert (
+            run_proc(conn, "call internal.schema_fingerprint('QUERY_HISTORY');")
+            != fingerprint
+        ), "Adding a label did not change the fingerprint!"
+    finally:
+        run_proc(conn, f"call ADMIN.DELETE_LABEL('{label}');")
+    assert (
+        run_proc(conn, "call internal.schema_fingerprint('QUERY_HISTORY');")
+        == fingerprint
+    ), "Removing the label did not restore the fingerprint!"
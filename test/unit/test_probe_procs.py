@@ -146,3 +146,18 @@ def test_error_message(conn, timestamp_string, statement, expected_error):
     assert expected_error in str(
         run_proc(conn, sql)
     ), "Stored procedure output does not match expected result!"
+
+
+def test_backtest_probes(conn):
+    sql = """select count(*) from table(result_scan(last_query_id()))
+                 where matches <= queries and saved_credits <= matched_credits"""
+    with conn() as cnx:
+        cur = cnx.cursor()
+        cur.execute(
+            """call internal.backtest_probes(
+                array_construct(
+                    object_construct('name', 'all', 'condition', 'true'),
+                    object_construct('name', 'big', 'condition', 'bytes_scanned > 10000000000')),
+                dateadd(day, -90, current_timestamp()), current_timestamp(), 60);"""
+        )
+        assert cur.execute(sql).fetchone()[0] == 2, "Expected a row per probe!"
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from common_utils import generate_unique_name
+from common_utils import run_proc
+from common_utils import row_count
+from common_utils import run_sql
+
+
+def test_daily_rollup_follows_label_definitions(conn, timestamp_string):
+    label = generate_unique_name("label", timestamp_string)
+    sql = f"call ADMIN.CREATE_LABEL('{label}', NULL, NULL, 'rows_produced > 100');"
+    assert run_proc(conn, sql) is None, "Stored procedure did not return NULL value!"
+
+    # a new label invalidates the rollup until it is rebuilt
+    sql = "select internal.is_daily_rollup_current()"
+    assert run_sql(conn, sql) == "False", "Rollup should be stale after a label change!"
+
+    assert row_count(conn, "call internal.refresh_daily_rollup(null, null);") >= 0
+    assert run_sql(conn, sql) == "True", "Rollup should be current after a rebuild!"
+
+    # nothing changed, so nothing is rebuilt
+    assert row_count(conn, "call internal.refresh_daily_rollup(null, null);") == 0
+
+    sql = f"call ADMIN.DELETE_LABEL('{label}');"
+    assert run_proc(conn, sql) == "done", "Stored procedure did not return 'done'!"
+
+
+def test_hourly_history_refresh(conn):
+    assert (
+        row_count(conn, "call internal.refresh_query_history_hourly(null, null);") >= 0
+    )
+    sql = (
+        "select count(*) from internal.config where key = 'QUERY_HISTORY_HOURLY_BUILT'"
+    )
+    assert row_count(conn, sql) == 1, "Hourly history should be built!"
+
+    # recomputing the last day replaces its hours rather than adding to them
+    refresh = "call internal.refresh_query_history_hourly(dateadd(day, -1, current_timestamp()), null);"
+    row_count(conn, refresh)
+    row_count(conn, refresh)
+
+    # the recomputed hours hold the queries and credits of the hourly query history
+    sql = """with expected as (
+            select st_period as hour, warehouse_id, warehouse_name, count(*) as queries,
+                round(sum(unloaded_direct_compute_credits), 6) as credits
+            from reporting.enriched_query_history_hourly
+            where st_period >= dateadd(hour, -23, current_timestamp())
+            group by 1, 2, 3
+        ), actual as (
+            select hour, warehouse_id, warehouse_name, queries, round(unloaded_direct_compute_credits, 6) as credits
+            from internal_reporting_mv.query_history_hourly
+            where hour >= dateadd(hour, -23, current_timestamp())
+        )
+        select (select count(*) from (select * from expected minus select * from actual))
+            + (select count(*) from (select * from actual minus select * from expected))
+            + abs((select count(*) from expected) - (select count(*) from actual))"""
+    assert row_count(conn, sql) == 0, "Hourly history differs from query history!"
+
+
+def test_query_hash_frequency_refresh(conn):
+    assert (
+        row_count(conn, "call internal.refresh_query_hash_frequency(null, null);") >= 0
+    )
+
+    # incremental refreshes after the build merge the totals of the hashes seen again
+    refresh = "call internal.refresh_query_hash_frequency(dateadd(day, -1, current_timestamp()), null);"
+    assert row_count(conn, refresh) >= 0
+    assert row_count(conn, refresh) >= 0
+    sql = "call internal.refresh_query_hash_totals(dateadd(day, -1, current_timestamp()), null);"
+    assert row_count(conn, sql) >= 0
+
+    # the totals agree with the query history they are derived from
+    sql = """select count(*) from (
+        select query_parameterized_hash, count(*) as queries, sum(unloaded_direct_compute_credits) as credits
+        from reporting.enriched_query_history where query_parameterized_hash is not null
+        group by query_parameterized_hash) q
+        full outer join internal_reporting_mv.query_hash_frequency f using (query_parameterized_hash)
+        where not equal_null(q.queries, f.queries)
+            or abs(coalesce(q.credits, 0) - coalesce(f.unloaded_direct_compute_credits, 0)) > 0.000001"""
+    assert row_count(conn, sql) == 0, "Hash totals differ from query history!"
+
+    # and so does the cost of each hash in both reporting views
+    sql = """select count(*) from reporting.query_hash_frequency f
+        full outer join (select query_parameterized_hash, sum(cost) as cost from reporting.query_hash_daily
+            group by query_parameterized_hash) d using (query_parameterized_hash)
+        where abs(coalesce(f.cost, 0) - coalesce(d.cost, 0)) > 0.000001"""
+    assert row_count(conn, sql) == 0, "Hash costs differ between the reports!"
+
+
+def test_warehouse_session_stats_refresh(conn):
+    assert row_count(conn, "call internal.refresh_warehouse_session_stats(null);") >= 0
+
+    # recomputing the last day replaces its sessions rather than adding to them
+    refresh = "call internal.refresh_warehouse_session_stats(dateadd(day, -1, current_timestamp()));"
+    row_count(conn, refresh)
+    sql = "select count(*) from internal_reporting_mv.warehouse_session_stats"
+    before = row_count(conn, sql)
+    row_count(conn, refresh)
+    assert row_count(conn, sql) == before, "Warehouse sessions were duplicated!"
+
+    # the gaps are the ones to the previous session of the warehouse
+    sql = """with expected as (
+            select session_id, warehouse_id, st, et,
+                datediff('seconds', lag(st) over (partition by warehouse_id order by st), st) * 1000 as gap
+            from reporting.warehouse_sessions
+        ), actual as (
+            select session_id, warehouse_id, st, et, gap from internal_reporting_mv.warehouse_session_stats
+        )
+        select count(*) from (
+            (select * from expected where st >= dateadd(day, -1, current_timestamp())
+            minus
+            select * from actual where st >= dateadd(day, -1, current_timestamp()))
+            union all
+            (select * from actual where st >= dateadd(day, -1, current_timestamp())
+            minus
+            select * from expected where st >= dateadd(day, -1, current_timestamp())))"""
+    assert row_count(conn, sql) == 0, "Session gaps differ from the warehouse sessions!"
+
+
+def test_warehouse_daily_utilization_refresh(conn):
+    assert (
+        row_count(
+            conn, "call internal.refresh_warehouse_daily_utilization(null, null);"
+        )
+        >= 0
+    )
+
+    # recomputing the last day replaces its rows rather than adding to them
+    refresh = "call internal.refresh_warehouse_daily_utilization(dateadd(day, -1, current_timestamp()), null);"
+    row_count(conn, refresh)
+    sql = "select count(*) from reporting.warehouse_daily_utilization"
+    before = row_count(conn, sql)
+    row_count(conn, refresh)
+    assert row_count(conn, sql) == before, "Daily utilization was duplicated!"
+
+    # the recomputed days match what the view used to compute from the query history and metering
+    sql = """with query_wh_util as (
+            select st_period,
+                case when internal.is_serverless_warehouse(warehouse_id) then 'Serverless Task' else warehouse_name end as warehouse_name,
+                case when internal.is_serverless_warehouse(warehouse_id) then -1 else warehouse_id end as warehouse_id,
+                count(*) as queries_executed,
+                sum(unloaded_direct_compute_credits) as unloaded_compute_credits
+            from reporting.enriched_query_history_daily
+            where not internal.is_serverless_warehouse(warehouse_id)
+            group by st_period, warehouse_id, warehouse_name
+        ), warehouse_periodic as (
+            select date_trunc('day', start_time) as m_period, warehouse_id, sum(credits_used_compute) as loaded_compute_credits
+            from account_usage.warehouse_metering_history
+            group by m_period, warehouse_id, warehouse_name
+            union all
+            select date_trunc('day', start_time), -1, sum(credits_used) from account_usage.serverless_task_history group by 1
+        ), expected as (
+            select coalesce(st_period, m_period) as period,
+                coalesce(q.warehouse_id, w.warehouse_id) as warehouse_id,
+                coalesce(q.warehouse_name, 'Unknown') as warehouse_name,
+                coalesce(queries_executed, 0) as queries,
+                round(case
+                    when unloaded_compute_credits is null then 0
+                    when unloaded_compute_credits > loaded_compute_credits then loaded_compute_credits
+                    else unloaded_compute_credits
+                end, 6) as unloaded_cc,
+                round(coalesce(loaded_compute_credits, 0), 6) as loaded_cc
+            from query_wh_util q
+            full outer join warehouse_periodic w on q.warehouse_id = w.warehouse_id and st_period = m_period
+        ), actual as (
+            select period, warehouse_id, warehouse_name, queries, round(unloaded_cc, 6), round(loaded_cc, 6)
+            from internal_reporting_mv.warehouse_daily_utilization
+        )
+        select count(*) from (
+            (select * from expected where period >= date_trunc('day', dateadd(day, -1, current_timestamp()))
+            minus
+            select * from actual where period >= date_trunc('day', dateadd(day, -1, current_timestamp())))
+            union all
+            (select * from actual where period >= date_trunc('day', dateadd(day, -1, current_timestamp()))
+            minus
+            select * from expected where period >= date_trunc('day', dateadd(day, -1, current_timestamp()))))"""
+    assert (
+        row_count(conn, sql) == 0
+    ), "Daily utilization differs from the query history!"
+
+
+def test_refresh_queries_watermarks(conn):
+    # a second run only picks up what changed since the first one
+    assert run_proc(conn, "call internal.refresh_queries(false);") is None
+    assert run_proc(conn, "call internal.refresh_queries(false);") is None
+
+    # the incomplete table only keeps the rows of the latest run
+    sql = """select count(*) from internal_reporting_mv.query_history_complete_and_daily_incomplete
+        where run_id < (select max(run_id) from internal_reporting_mv.query_history_complete_and_daily_incomplete)"""
+    assert row_count(conn, sql) == 0, "Rows of an earlier run were left behind!"
+
+    # the recorded watermarks are the ones computed from the materialized rows
+    sql = """with completed as (
+            select max(end_time) as newest_completed from (
+                select end_time from internal_reporting_mv.query_history_complete_and_daily
+                union all
+                select end_time from internal_reporting_mv.query_history_complete_and_daily_incomplete where not incomplete)
+        ), watermarks as (
+            select coalesce(min(iff(i.incomplete, i.filterts, null)), any_value(c.newest_completed)) as oldest_running,
+                any_value(c.newest_completed) as newest_completed
+            from completed c
+            left outer join internal_reporting_mv.query_history_complete_and_daily_incomplete i on true
+        )
+        select count(*) from internal.task_last_state s, watermarks w
+        where s.task_name = 'QUERY_HISTORY'
+            and s.output:oldest_running::timestamp = w.oldest_running::timestamp
+            and s.output:newest_completed::timestamp = w.newest_completed::timestamp
+            and s.run = (select max(run) from internal.task_query_history where success)"""
+    assert row_count(conn, sql) == 1, "Watermarks differ from the materialized rows!"
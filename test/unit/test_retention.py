@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from common_utils import row_count
+from common_utils import run_proc
+
+
+def test_retention_keeps_last_successful_run(conn):
+    sql = "select count(*) from internal.task_query_history where success"
+    had_runs = row_count(conn, sql) > 0
+
+    assert run_proc(conn, "call internal.apply_retention();") is not None
+
+    # refreshes fall back to the latest successful run, so it is never removed
+    assert (row_count(conn, sql) > 0) == had_runs, "Latest successful run was removed!"
+
+    sql = "select count(*) from internal.task_retention where success and run > dateadd(minute, -5, current_timestamp())"
+    assert row_count(conn, sql) >= 1, "Retention run was not logged!"
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import pytest
+
+from common_utils import row_count
+from common_utils import run_sql
+
+
+def test_tables_vectorized(conn):
+    sql = """select tools.tables_vectorized(column1, 'DB', 'SCH', column2) from values
+        ('select * from t1 join other.t2 on t1.id = t2.id', 'h1'),
+        ('select * from t1 join other.t2 on t1.id = t2.id', 'h1'),
+        ('select 1 from x.y.z', null)
+        order by column2 nulls last limit 1"""
+    tables = run_sql(conn, sql)
+    assert (
+        "DB.SCH.T1" in tables
+    ), "Unqualified table was not resolved against the given database and schema!"
+    assert (
+        "DB.OTHER.T2" in tables
+    ), "Partially qualified table was not resolved against the given database!"
+
+
+def test_tables_resolves_against_current_schema(conn):
+    # whether or not the text was materialized for another database and schema
+    sql = """select array_contains((current_database() || '.' || current_schema() || '.T1')::variant,
+        tools.tables('select * from t1'))"""
+    assert (
+        run_sql(conn, sql) == "True"
+    ), "Table was not resolved against the current schema!"
+
+
+def test_tables_contains(conn):
+    sql = "select tools.tables_contains('select * from a.b.c', 'a.b.c')"
+    assert run_sql(conn, sql) == "True", "Table reference was not found!"
+
+
+def test_tables_contains_resolves_against_query_schema(conn):
+    sql = "select tools.tables_contains('select * from c', 'A', 'B', 'a.b.c')"
+    assert (
+        run_sql(conn, sql) == "True"
+    ), "Table was not resolved against the query's schema!"
+
+
+def test_label_condition_qlike_resolves_against_query_schema(conn):
+    sql = "select internal.label_condition_sql('tools.qlike(query_text, \\'sel\\', \\'p\\')')"
+    assert (
+        run_sql(conn, sql)
+        == "tools.qlike(query_text, 'sel', 'p', database_name, schema_name)"
+    ), "QLike call was not rewritten to use the query's database and schema!"
+
+
+def test_label_condition_resolves_against_query_schema(conn):
+    sql = "select internal.label_condition_sql('tools.tables_contains(query_text, \\'a.b.c\\')')"
+    assert (
+        run_sql(conn, sql)
+        == "tools.tables_contains(query_text, database_name, schema_name, 'a.b.c')"
+    ), "Label condition was not rewritten to use the query's database and schema!"
+
+
+# Local stand-in for the QLike endpoint: a query matches when its text, ignoring case and whitespace, contains the
+# selector. Only installed while the tests run, the app keeps the placeholder unless Sundeck is set up.
+LOCAL_QLIKE = """create or replace function internal.ef_qlike(REQUEST object)
+    returns variant
+    language javascript
+as $$
+var normalize = function(s) { return (s || '').replace(/\\s+/g, ' ').trim().toLowerCase(); };
+return {'result': normalize(REQUEST.query_text).indexOf(normalize(REQUEST.selector)) >= 0};
+$$"""
+
+PLACEHOLDER_QLIKE = """create or replace function internal.ef_qlike(request object)
+    returns variant
+    language javascript
+as 'throw "You must configure a Sundeck token to use QLike.";'"""
+
+SELECTOR = "opscenter test selector"
+
+
+@pytest.fixture
+def local_qlike(conn):
+    sql = """select count(*) from information_schema.functions
+        where function_schema = 'INTERNAL' and function_name = 'EF_QLIKE' and is_external = 'YES'"""
+    if row_count(conn, sql) > 0:
+        pytest.skip("QLike is set up against Sundeck.")
+    run_sql(conn, LOCAL_QLIKE)
+    yield
+    run_sql(conn, PLACEHOLDER_QLIKE)
+    run_sql(conn, f"delete from internal.qlike_cache where selector = '{SELECTOR}'")
+
+
+def test_qlike_cache(conn, local_qlike):
+    sql = f"select tools.qlike('SELECT  1', '{SELECTOR}')"
+    assert run_sql(conn, sql) == "False", "Stand-in matched an unrelated query!"
+
+    # a cached result is used instead of calling QLike, for the database and schema it was cached for
+    sql = f"""insert into internal.qlike_cache (key, selector, query_hash, database, schema, result, cached_at)
+        select internal.qlike_cache_key(object_construct('selector', '{SELECTOR}', 'query_text', 'SELECT  1',
+            'database', 'DB1', 'schema', 'S1', 'query_hash', hash('SELECT  1')::varchar)),
+            '{SELECTOR}', hash('SELECT  1')::varchar, 'DB1', 'S1', true, current_timestamp()"""
+    run_sql(conn, sql)
+    sql = f"select tools.qlike('SELECT  1', '{SELECTOR}', 'DB1', 'S1')"
+    assert run_sql(conn, sql) == "True", "Cached result was not used!"
+    sql = f"select tools.qlike('SELECT  1', '{SELECTOR}')"
+    assert run_sql(conn, sql) == "False", "Result cached for another schema was used!"
+
+    # other texts still go to QLike
+    sql = f"select tools.qlike('select 2 -- {SELECTOR.upper()}', '{SELECTOR}')"
+    assert run_sql(conn, sql) == "True", "Stand-in did not match the selector!"